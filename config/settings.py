@@ -4,6 +4,9 @@ Django settings for config project (SureJan MVP).
 
 from pathlib import Path
 
+from .sqlite import sqlite_database
+from .templates import django_templates
+
 # Base directory
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -22,9 +25,11 @@ INSTALLED_APPS = [
     "django.contrib.staticfiles",
 ]
 # third-party and local apps
-INSTALLED_APPS += ["django_htmx", "django_ratelimit", "csp", "core"]
+INSTALLED_APPS += ["django_htmx", "csp", "core"]
 
 MIDDLEWARE = [
+    # First, so that it also measures the other middleware's queries.
+    'core.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -39,31 +44,144 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'config.urls'
 
+# The profile sets the template loaders and debugging (see config/templates.py);
+# "development" is Django's defaults.
+TEMPLATE_PROFILE = "development" if DEBUG else "production"
 TEMPLATES = [
-    {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [BASE_DIR / 'templates'],  # so we can use /templates/core/ later
-        'APP_DIRS': True,
-        'OPTIONS': {
-            'context_processors': [
-                'django.template.context_processors.request',
-                'django.contrib.auth.context_processors.auth',
-                'django.contrib.messages.context_processors.messages',
-            ],
-        },
-    },
+    django_templates(
+        # DjangoTemplates, timed for core.instrumentation.
+        'core.instrumentation.TimedDjangoTemplates',
+        [BASE_DIR / 'templates'],  # so we can use /templates/core/ later
+        TEMPLATE_PROFILE,
+        context_processors=[
+            'django.template.context_processors.request',
+            'django.contrib.auth.context_processors.auth',
+            'django.contrib.messages.context_processors.messages',
+        ],
+    ),
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
 
-# Database (SQLite for dev)
-DATABASES = {
+# Caches (local memory for dev; any shared backend works in production)
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rate limit counters, apart so that clearing one cache keeps the other.
+    # Local memory is per process; use a shared backend with several workers.
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ratelimit',
+    },
+}
+
+# Rendered feed page cache (see core.feedcache)
+FEED_CACHE = {
+    "ENABLED": True,
+    "ALIAS": "default",
+    "TTL": 300,
+    "RANKED_TTL": 30,
+}
+
+# Conditional GET on the feed and post pages (see core.httpcache): anonymous
+# responses carry an ETag and Last-Modified from per-page version stamps and
+# may be kept by a reverse proxy for MAX_AGE seconds before revalidating.
+# Feed pages show scores and ranks up to RANKED_PERIOD seconds late.
+HTTP_CACHE = {
+    "ENABLED": True,
+    "MAX_AGE": 10,
+    "RANKED_PERIOD": 30,
+}
+
+# Community sidebar statistics (see core.communitystats): counts over the
+# last WINDOW_HOURS hourly buckets, cached for TTL seconds.
+COMMUNITY_STATS = {
+    "WINDOW_HOURS": 24,
+    "ALIAS": "default",
+    "TTL": 60,
+}
+
+# Personalized home feed (see core.subscriptions): from
+# CACHE_MIN_SUBSCRIPTIONS subscriptions on (None: never), the first
+# CACHE_DEPTH posts of the merged feed are cached for CACHE_TTL seconds.
+PERSONAL_FEED = {
+    "CACHE_MIN_SUBSCRIPTIONS": 100,
+    "CACHE_DEPTH": 200,
+    "CACHE_TTL": 60,
+    "ALIAS": "default",
+}
+
+# Rate limits on the write endpoints (see core.ratelimit): sliding-window
+# counts per signed-in user and per client IP, "<requests>/<n><s|m|h|d>".
+RATE_LIMITS = {
+    "ENABLED": True,
+    "ALIAS": "ratelimit",
+    "POLICIES": {
+        "vote": {"user": "120/m", "ip": "600/m"},
+        "vote_batch": {"user": "10/m", "ip": "50/m"},
+        "comment": {"user": "10/m", "ip": "30/m"},
+        "submit_post": {"user": "5/10m", "ip": "20/10m"},
+    },
+}
+
+# Background tasks (see core.tasks): rank refreshes and sidebar counts are
+# queued by the writes and run by "manage.py run_tasks". EAGER runs them
+# inline instead.
+TASKS = {
+    "EAGER": False,
+    "BATCH_SIZE": 500,
+    "MAX_ATTEMPTS": 5,
+    "RETRY_DELAY": 10,
+    "LEASE": 300,
+    "POLL_INTERVAL": 1.0,
+}
+
+# Bulk removal, archiving and purging (see core.moderation): rows are
+# deleted about CHUNK_SIZE at a time, each chunk in its own transaction.
+# Archives written from the admin go to ARCHIVE_DIR.
+MODERATION = {
+    "CHUNK_SIZE": 500,
+    "ARCHIVE_DIR": BASE_DIR / "archive",
 }
 
+# Database (SQLite). The profile sets WAL mode, connection reuse and lock
+# handling (see config/sqlite.py); "development" is Django's defaults.
+SQLITE_PROFILE = "development" if DEBUG else "production"
+DATABASES = {
+    'default': sqlite_database(
+        BASE_DIR / 'db.sqlite3',
+        SQLITE_PROFILE,
+        # A file-backed test database lets concurrency tests use real
+        # per-thread connections (shared-cache in-memory SQLite cannot).
+        TEST={'NAME': BASE_DIR / 'test_db.sqlite3'},
+    ),
+}
+# Optionally send reads to a query_only connection on the same file.
+SQLITE_READ_CONNECTION = False
+if SQLITE_READ_CONNECTION:
+    DATABASES['reader'] = sqlite_database(
+        BASE_DIR / 'db.sqlite3', SQLITE_PROFILE, read_only=True, TEST={'MIRROR': 'default'}
+    )
+    DATABASE_ROUTERS = ['core.routers.ReadConnectionRouter']
+
+# Read replicas (see core.routers.ReplicaRouter): aliases of copies of the
+# primary that serve reads, except for a client's own requests for
+# STICKY_SECONDS after it writes. Locally each one is "<alias>.sqlite3",
+# refreshed by "manage.py sync_replicas"; replaces the reader above.
+REPLICATION = {
+    "REPLICAS": [],
+    "STICKY_SECONDS": 10,
+}
+for alias in REPLICATION["REPLICAS"]:
+    DATABASES[alias] = sqlite_database(
+        BASE_DIR / f'{alias}.sqlite3', SQLITE_PROFILE, read_only=True, TEST={'MIRROR': 'default'}
+    )
+if REPLICATION["REPLICAS"]:
+    DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+    # Before anything that reads, such as the session and user lookups.
+    MIDDLEWARE.insert(1, 'core.routers.PrimaryStickinessMiddleware')
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -98,5 +216,42 @@ CSP_DIRECTIVES = {
     "script-src": ("'self'",),
 }
 
-# Silence specific system checks for django_ratelimit
-SILENCED_SYSTEM_CHECKS = ["django_ratelimit.E003", "django_ratelimit.W001"]
+# Write-behind vote buffering (see core.votebuffer). Disabled by default.
+VOTE_BUFFER = {
+    "ENABLED": False,
+    "FLUSH_INTERVAL_MS": 250,
+    "MAX_PENDING": 1000,
+}
+
+# Live score and comment streams on post pages (see core.live). Served
+# over ASGI only; the hub is per process.
+LIVE_UPDATES = {
+    "INTERVAL_MS": 500,
+    "MAX_CONNECTIONS": 1000,
+    "MAX_PENDING": 50,
+}
+
+# Per-request query and latency instrumentation (see core.instrumentation).
+# Query budgets are advisory (logged) unless FAIL_ON_BUDGET, as in the tests.
+INSTRUMENTATION = {
+    "ENABLED": True,
+    "WINDOW": 1000,
+    "SERVER_TIMING": DEBUG,
+    "FAIL_ON_BUDGET": False,
+}
+
+# Most SQL queries a request to each URL name may run, counted like
+# assertNumQueries: session and user lookups and savepoints included.
+QUERY_BUDGETS = {
+    # Merging a subscriber's feed takes a few rounds (see core.feeds).
+    "home": 8,
+    "all_posts": 5,
+    # Three of these load the sidebar stats when they are not cached.
+    "community": 10,
+    "post_detail": 8,
+    "comment_page": 6,
+    "comment_replies": 6,
+    # One of these stamps the pages showing the vote (see core.httpcache).
+    "vote_post": 18,
+    "vote_comment": 18,
+}
@@ -0,0 +1,89 @@
+"""SQLite connection profiles for ``DATABASES``.
+
+:func:`sqlite_database` builds a ``DATABASES`` entry from a named profile.
+``development`` is Django's defaults. ``production`` configures every new
+connection through the backend's ``init_command`` and options:
+
+* ``journal_mode=WAL``: readers and the writer no longer block each other,
+  and a commit appends to the log instead of rewriting the database file.
+* ``synchronous=NORMAL``: in WAL mode the log is only synced at checkpoints;
+  a power cut can lose the last commits but never corrupts the database.
+* ``mmap_size`` and ``cache_size``: serve hot pages from memory.
+* ``transaction_mode=IMMEDIATE``: transactions take the write lock at
+  ``BEGIN``. Deferred transactions that read and then write can deadlock,
+  which SQLite reports at once as "database is locked" without waiting.
+* ``timeout``: the busy timeout, how long a connection waits for a lock.
+* ``CONN_MAX_AGE``: keep connections, and their page cache, across
+  requests. Under ASGI sync code runs in a fresh thread per request, so
+  connections are only reused by WSGI workers.
+
+A ``read_only`` entry uses the same profile with ``query_only`` set, for
+routing reads to a connection that cannot write (see
+:class:`core.routers.ReadConnectionRouter`).
+
+:func:`copy_database` makes a consistent copy of a database file for a
+profile, for replicas and benchmarks.
+"""
+
+import sqlite3
+from contextlib import closing
+
+
+PROFILES = {
+    "development": {"pragmas": {}, "options": {}, "conn_max_age": 0},
+    "production": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 256 * 1024 * 1024,
+            # Negative sizes are in KiB: 64 MiB per connection.
+            "cache_size": -64 * 1024,
+            "temp_store": "MEMORY",
+        },
+        "options": {"transaction_mode": "IMMEDIATE", "timeout": 10},
+        "conn_max_age": 600,
+    },
+}
+
+
+def sqlite_database(name, profile="production", read_only=False, **extra):
+    """Return a ``DATABASES`` entry for the SQLite file ``name``.
+
+    ``extra`` keys (``TEST``, ...) are added to the entry as they are.
+    """
+
+    config = PROFILES[profile]
+    pragmas = dict(config["pragmas"])
+    if read_only:
+        # The journal mode is stored in the file; only writers may change it.
+        pragmas.pop("journal_mode", None)
+        pragmas["query_only"] = "ON"
+    options = dict(config["options"])
+    if pragmas:
+        options["init_command"] = ";".join(
+            f"PRAGMA {name}={value}" for name, value in pragmas.items()
+        )
+    return {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": name,
+        "CONN_MAX_AGE": config["conn_max_age"],
+        "CONN_HEALTH_CHECKS": config["conn_max_age"] > 0,
+        "OPTIONS": options,
+        **extra,
+    }
+
+
+def copy_database(source, target, profile="production"):
+    """Copy the SQLite file ``source`` to ``target`` with the online backup API.
+
+    The copy is consistent even while ``source`` is being written. The
+    journal mode is stored in the file, so the copy's is set for ``profile``.
+    """
+
+    # Closed, not just committed: an open connection to ``target`` would
+    # keep its journal mode from changing.
+    with closing(sqlite3.connect(source)) as src, closing(sqlite3.connect(target)) as dst:
+        src.backup(dst)
+    journal_mode = PROFILES[profile]["pragmas"].get("journal_mode", "DELETE")
+    with closing(sqlite3.connect(target)) as connection:
+        connection.execute(f"PRAGMA journal_mode={journal_mode}")
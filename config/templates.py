@@ -0,0 +1,43 @@
+"""Template engine profiles for ``TEMPLATES``.
+
+:func:`django_templates` builds a ``TEMPLATES`` entry from a named profile.
+``development`` is Django's defaults: templates are compiled once per
+process and cached, and with ``DEBUG`` the engine keeps the debug
+information that template errors show. ``production``:
+
+* lists the cached loader explicitly, so templates are compiled once per
+  process whatever ``DEBUG`` is, and never checked for changes;
+* turns template debugging off, so rendering skips the error annotation
+  that only debug pages use.
+"""
+
+LOADERS = [
+    "django.template.loaders.filesystem.Loader",
+    "django.template.loaders.app_directories.Loader",
+]
+
+PROFILES = {
+    "development": {"options": {}},
+    "production": {
+        "options": {
+            "debug": False,
+            "loaders": [("django.template.loaders.cached.Loader", LOADERS)],
+        },
+    },
+}
+
+
+def django_templates(backend, dirs, profile="production", **options):
+    """Return a ``TEMPLATES`` entry for ``backend`` searching ``dirs`` and the apps.
+
+    ``options`` (``context_processors``, ...) are added to ``OPTIONS``.
+    """
+
+    config = PROFILES[profile]
+    return {
+        "BACKEND": backend,
+        "DIRS": dirs,
+        # Explicit loaders replace APP_DIRS.
+        "APP_DIRS": "loaders" not in config["options"],
+        "OPTIONS": {**config["options"], **options},
+    }
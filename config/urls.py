@@ -10,11 +10,20 @@ from core import views as core_views
 
 urlpatterns = [
     path("", core_views.home, name="home"),
+    path("all/", core_views.all_posts, name="all_posts"),
+    path("search/", core_views.search, name="search"),
     path("r/<slug:name>/", core_views.community, name="community"),
     path("r/<slug:name>/submit/", core_views.submit_post, name="submit_post"),
+    path("r/<slug:name>/subscribe/", core_views.subscribe, name="subscribe"),
     path("post/<int:pk>/", core_views.post_detail, name="post_detail"),
+    path("post/<int:pk>/comments/", core_views.comment_page, name="comment_page"),
     path("post/<int:pk>/comment/", core_views.add_comment, name="add_comment"),
+    path("post/<int:pk>/live/", core_views.post_live, name="post_live"),
+    path("comment/<int:pk>/replies/", core_views.comment_replies, name="comment_replies"),
     path("vote/post/<int:pk>/", core_views.vote_post, name="vote_post"),
+    path("vote/comment/<int:pk>/", core_views.vote_comment, name="vote_comment"),
+    path("vote/batch/", core_views.vote_batch, name="vote_batch"),
+    path("stats/requests/", core_views.request_stats, name="request_stats"),
     path("admin/", admin.site.urls),
 ]
 
@@ -1,21 +1,67 @@
 from django.contrib import admin
 
-from .models import Community, Post, Comment
+from . import moderation
+from .models import Community, Post, Comment, Job
+
+
+class ChunkedDeleteMixin:
+    """Replace "delete selected" with chunked deletions (see core.moderation).
+
+    The default action deletes every selected row and everything below it
+    in one transaction, with a signal per row.
+    """
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop("delete_selected", None)
+        return actions
 
 
 @admin.register(Community)
-class CommunityAdmin(admin.ModelAdmin):
+class CommunityAdmin(ChunkedDeleteMixin, admin.ModelAdmin):
     list_display = ("id", "name", "title", "created_at")
     search_fields = ("name", "title")
+    actions = ["purge_communities"]
+
+    @admin.action(permissions=["delete"], description="Purge selected communities")
+    def purge_communities(self, request, queryset):
+        for community in queryset:
+            tally = moderation.purge_community(community)
+            self.message_user(request, f"Purged {community}: {tally}.")
 
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(ChunkedDeleteMixin, admin.ModelAdmin):
     list_display = ("id", "community", "author", "post_type", "title", "score", "created_at")
     list_filter = ("post_type", "community")
     search_fields = ("title", "body")
+    actions = ["remove_posts", "archive_posts"]
+
+    @admin.action(permissions=["delete"], description="Remove selected posts")
+    def remove_posts(self, request, queryset):
+        tally = moderation.remove_posts(queryset)
+        self.message_user(request, f"Removed {tally}.")
+
+    @admin.action(permissions=["delete"], description="Archive and remove selected posts")
+    def archive_posts(self, request, queryset):
+        path = moderation.archive_path()
+        with moderation.open_archive(path) as stream:
+            tally = moderation.remove_posts(queryset, archive=moderation.archive_writer(stream))
+        self.message_user(request, f"Archived to {path}: {tally}.")
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(ChunkedDeleteMixin, admin.ModelAdmin):
     list_display = ("id", "post", "author", "score", "created_at")
+    actions = ["remove_comments"]
+
+    @admin.action(permissions=["delete"], description="Remove selected comments and replies")
+    def remove_comments(self, request, queryset):
+        tally = moderation.remove_comments(queryset)
+        self.message_user(request, f"Removed {tally}.")
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "task", "status", "attempts", "run_after", "created_at")
+    list_filter = ("status", "task")
@@ -0,0 +1,344 @@
+"""Community sidebar statistics, maintained incrementally.
+
+Totals (posts, comments and subscribers) live in one
+:class:`~core.models.CommunityStats` row per community.
+Counts over the last ``WINDOW_HOURS`` come from hourly buckets instead of
+scanning ``created_at``: a :class:`~core.models.CommunityActivity` row per
+community and UTC hour counts the posts and comments created in it, and a
+:class:`~core.models.CommunityActiveUser` row records each user who
+posted, commented or voted there in that hour. Every write adds to its
+hour's rows with one ``UPDATE`` (an ``INSERT`` the first time in an hour),
+so reading a window sums at most ``WINDOW_HOURS`` rows and counts distinct
+users from an index. Additions are made by a background task (see
+core.tasks), batched per community and hour; removals are immediate, so
+a post deleted while its addition is still queued leaves the counts one
+too high until the next rebuild.
+
+Bulk inserts (``seed_demo``) bypass these functions; the
+``rebuild_community_stats`` command recomputes everything from the post
+and comment tables and prunes buckets that have left the window. Votes
+carry no timestamp, so voters only count as active from the moment they
+vote.
+
+:func:`community_stats` caches a community's numbers for ``TTL`` seconds,
+so the sidebar may lag writes by that much. Settings live in
+``COMMUNITY_STATS``.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import tasks
+from .models import Comment, CommunityActiveUser, CommunityActivity, CommunityStats, Post
+
+
+DEFAULTS = {"WINDOW_HOURS": 24, "ALIAS": "default", "TTL": 60}
+
+_RECENT = {"posts": Sum("posts"), "comments": Sum("comments")}
+
+
+class SidebarStats(NamedTuple):
+    post_count: int
+    comment_count: int
+    subscriber_count: int
+    # Within the last window_hours.
+    recent_posts: int
+    recent_comments: int
+    active_users: int
+    window_hours: int
+
+
+def stats_settings():
+    return {**DEFAULTS, **getattr(settings, "COMMUNITY_STATS", {})}
+
+
+def hour_of(moment):
+    """Return the start of the UTC hour containing ``moment``."""
+
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def window_start(now=None, config=None):
+    """Return the first hour of the window ending with the hour of ``now``."""
+
+    config = config or stats_settings()
+    return hour_of(now or timezone.now()) - timedelta(hours=config["WINDOW_HOURS"] - 1)
+
+
+def post_added(post):
+    _activity_added([(post.community_id, post.author_id, post.created_at, 1, 0)])
+
+
+def post_removed(post):
+    _decrement(CommunityStats.objects.filter(community_id=post.community_id), "post_count")
+    _decrement(
+        CommunityActivity.objects.filter(
+            community_id=post.community_id, hour=hour_of(post.created_at)
+        ),
+        "posts",
+    )
+
+
+def comment_added(comment, community_id):
+    _activity_added([(community_id, comment.author_id, comment.created_at, 0, 1)])
+
+
+def comment_removed(comment):
+    # The community is reached through the post inside the UPDATE, so a
+    # delete needs no separate read.
+    _decrement(
+        CommunityStats.objects.filter(community__posts=comment.post_id), "comment_count"
+    )
+    _decrement(
+        CommunityActivity.objects.filter(
+            community__posts=comment.post_id, hour=hour_of(comment.created_at)
+        ),
+        "comments",
+    )
+
+
+def activity_removed(events):
+    """Subtract ``(community_id, moment, posts, comments)`` events of deleted rows.
+
+    For bulk deletions (see core.moderation): the events are summed per
+    community and hour, so each table takes one ``UPDATE`` per group.
+    """
+
+    totals = defaultdict(lambda: [0, 0])
+    buckets = defaultdict(lambda: [0, 0])
+    for community_id, moment, posts, comments in events:
+        for counts in (totals[community_id], buckets[(community_id, hour_of(moment))]):
+            counts[0] += posts
+            counts[1] += comments
+    for community_id, (posts, comments) in totals.items():
+        _subtract(
+            CommunityStats.objects.filter(community_id=community_id),
+            post_count=posts,
+            comment_count=comments,
+        )
+    for (community_id, hour), (posts, comments) in buckets.items():
+        _subtract(
+            CommunityActivity.objects.filter(community_id=community_id, hour=hour),
+            posts=posts,
+            comments=comments,
+        )
+
+
+def subscriber_added(community_id):
+    _increment(CommunityStats, {"community_id": community_id}, subscriber_count=1)
+
+
+def subscriber_removed(community_id):
+    _decrement(CommunityStats.objects.filter(community_id=community_id), "subscriber_count")
+
+
+def votes_cast(votes):
+    """Mark voters active; ``votes`` holds ``(user_id, target_type, target_id)``.
+
+    Costs one query per target type to find the communities; the voters
+    are recorded by a background task, merged per hour. Returns
+    ``{(target_type, target_id): (post_id, community_id)}`` for the targets
+    found, so that callers need not look them up again.
+    """
+
+    targets = {"post": set(), "comment": set()}
+    for _, target_type, target_id in votes:
+        targets[target_type].add(target_id)
+    found = {}
+    if targets["post"]:
+        rows = Post.objects.filter(pk__in=targets["post"]).values_list("pk", "community_id")
+        found.update((("post", pk), (pk, community_id)) for pk, community_id in rows)
+    if targets["comment"]:
+        rows = Comment.objects.filter(pk__in=targets["comment"]).values_list(
+            "pk", "post_id", "post__community_id"
+        )
+        found.update(
+            (("comment", pk), (post_id, community_id)) for pk, post_id, community_id in rows
+        )
+    hour = hour_of(timezone.now())
+    _activity_added(
+        {
+            (found[(target_type, target_id)][1], user_id, hour, 0, 0)
+            for user_id, target_type, target_id in votes
+            if (target_type, target_id) in found
+        },
+        dedupe=True,
+    )
+    return found
+
+
+def _activity_added(events, dedupe=False):
+    """Queue ``(community_id, user_id, moment, posts, comments)`` events for the stats.
+
+    Only events that count nothing but an active user (votes) may be
+    deduplicated: the rest add to counters.
+    """
+
+    tasks.enqueue(
+        "core.communitystats.record_activity",
+        [
+            {
+                "community": community_id,
+                "user": user_id,
+                "at": moment.isoformat(),
+                "posts": posts,
+                "comments": comments,
+            }
+            for community_id, user_id, moment, posts, comments in events
+        ],
+        dedupe=dedupe,
+    )
+
+
+def record_activity(events):
+    """Task adding queued events to the totals, hourly buckets and active users.
+
+    Events of the same community and hour are summed into one ``UPDATE``
+    of each table.
+    """
+
+    totals = defaultdict(lambda: [0, 0])
+    buckets = defaultdict(lambda: [0, 0])
+    active = defaultdict(set)
+    for event in events:
+        hour = hour_of(datetime.fromisoformat(event["at"]))
+        for counts in (totals[event["community"]], buckets[(event["community"], hour)]):
+            counts[0] += event["posts"]
+            counts[1] += event["comments"]
+        active[hour].add((event["community"], event["user"]))
+    for community_id, (posts, comments) in totals.items():
+        if posts or comments:
+            _increment(
+                CommunityStats,
+                {"community_id": community_id},
+                post_count=posts,
+                comment_count=comments,
+            )
+    for (community_id, hour), (posts, comments) in buckets.items():
+        if posts or comments:
+            _increment(
+                CommunityActivity,
+                {"community_id": community_id, "hour": hour},
+                posts=posts,
+                comments=comments,
+            )
+    for hour, pairs in active.items():
+        users_active(pairs, hour)
+
+
+def users_active(pairs, moment=None):
+    """Record ``(community_id, user_id)`` pairs as active in the hour of ``moment``."""
+
+    hour = hour_of(moment or timezone.now())
+    CommunityActiveUser.objects.bulk_create(
+        [
+            CommunityActiveUser(community_id=community_id, hour=hour, user_id=user_id)
+            for community_id, user_id in set(pairs)
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def _increment(model, keys, **deltas):
+    """Add ``deltas`` to the row matching ``keys``, creating it on first use."""
+
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**keys).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **deltas)
+    except IntegrityError:
+        # Another writer created it since the UPDATE.
+        model.objects.filter(**keys).update(**changes)
+
+
+def _decrement(queryset, field):
+    queryset.filter(**{f"{field}__gt": 0}).update(**{field: F(field) - 1})
+
+
+def _subtract(queryset, **deltas):
+    changes = {
+        field: Greatest(F(field) - delta, Value(0)) for field, delta in deltas.items() if delta
+    }
+    if changes:
+        queryset.update(**changes)
+
+
+def community_stats(community_id):
+    """Return the :class:`SidebarStats` of a community, cached for ``TTL`` seconds."""
+
+    config = stats_settings()
+    cache = caches[config["ALIAS"]]
+    stats = cache.get(_cache_key(community_id))
+    if stats is None:
+        totals, recent, active = _queries(community_id, config)
+        stats = _stats(totals.first(), recent.aggregate(**_RECENT), active.count(), config)
+        cache.set(_cache_key(community_id), stats, config["TTL"])
+    return stats
+
+
+async def acommunity_stats(community_id):
+    """Async version of :func:`community_stats`."""
+
+    config = stats_settings()
+    cache = caches[config["ALIAS"]]
+    stats = await cache.aget(_cache_key(community_id))
+    if stats is None:
+        totals, recent, active = _queries(community_id, config)
+        stats = _stats(
+            await totals.afirst(),
+            await recent.aaggregate(**_RECENT),
+            await active.acount(),
+            config,
+        )
+        await cache.aset(_cache_key(community_id), stats, config["TTL"])
+    return stats
+
+
+def _cache_key(community_id):
+    return f"community-stats:{community_id}"
+
+
+def _queries(community_id, config):
+    since = window_start(config=config)
+    totals = CommunityStats.objects.filter(community_id=community_id).values_list(
+        "post_count", "comment_count", "subscriber_count"
+    )
+    recent = CommunityActivity.objects.filter(community_id=community_id, hour__gte=since)
+    active = (
+        CommunityActiveUser.objects.filter(community_id=community_id, hour__gte=since)
+        .values("user_id")
+        .distinct()
+    )
+    return totals, recent, active
+
+
+def _stats(totals, recent, active_users, config):
+    post_count, comment_count, subscriber_count = totals or (0, 0, 0)
+    return SidebarStats(
+        post_count=post_count,
+        comment_count=comment_count,
+        subscriber_count=subscriber_count,
+        recent_posts=recent["posts"] or 0,
+        recent_comments=recent["comments"] or 0,
+        active_users=active_users,
+        window_hours=config["WINDOW_HOURS"],
+    )
+
+
+def prune(now=None):
+    """Delete the buckets that have left the window; return how many rows went."""
+
+    since = window_start(now)
+    activity, _ = CommunityActivity.objects.filter(hour__lt=since).delete()
+    active_users, _ = CommunityActiveUser.objects.filter(hour__lt=since).delete()
+    return activity + active_users
@@ -0,0 +1,32 @@
+"""Incremental maintenance of the denormalized comment counters on Post."""
+
+from django.db.models import F, Max
+
+from .models import Comment, Post
+
+
+def comment_added(comment):
+    """Account for a newly created comment on its post."""
+
+    Post.objects.filter(pk=comment.post_id).update(
+        comment_count=F("comment_count") + 1,
+        last_comment_at=comment.created_at,
+    )
+
+
+def comment_removed(post_id):
+    """Account for a deleted comment on its post.
+
+    ``last_comment_at`` is re-derived from the remaining comments inside the
+    same ``UPDATE``, so a delete never needs a separate read.
+    """
+
+    Post.objects.filter(pk=post_id, comment_count__gt=0).update(
+        comment_count=F("comment_count") - 1,
+        last_comment_at=(
+            Comment.objects.filter(post_id=post_id)
+            .values("post_id")
+            .annotate(latest=Max("created_at"))
+            .values("latest")
+        ),
+    )
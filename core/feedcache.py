@@ -0,0 +1,227 @@
+"""Rendered-fragment cache for feed pages.
+
+A feed page (its rows plus the "load more" link) is rendered once and
+stored under a key built from the feed's scope, the scope's version, the
+sort and the cursor. Creating, editing or deleting a post bumps the
+version of its community and of the home feed, so those pages are simply
+never looked up again. Votes and comments do not invalidate anything:
+rows are cached with placeholders for the score and comment count, and a
+cache hit fills them in from one ``pk IN (...)`` query. The viewer's own
+votes are placeholders too, filled from one query on their ``Vote`` rows,
+so a cached page never depends on who rendered it. Pages in a ranked sort
+also expire after ``RANKED_TTL`` seconds, since votes reorder them.
+
+Settings live in ``FEED_CACHE``; any Django cache backend works, the
+local-memory and file-based ones included. :func:`afeed_page` is the same
+lookup for async views, through the cache's and the ORM's async APIs.
+"""
+
+import re
+import threading
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import Post
+from .votes import aload_vote_state, load_vote_state
+
+
+DEFAULTS = {"ENABLED": True, "ALIAS": "default", "TTL": 300, "RANKED_TTL": 30}
+
+PLACEHOLDER_RE = re.compile(r"<!--(score|comments|up|down):(\d+)-->")
+
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+class FeedPage(NamedTuple):
+    html: str
+    post_ids: list
+    next_cursor: str | None
+
+
+def cache_settings():
+    return {**DEFAULTS, **getattr(settings, "FEED_CACHE", {})}
+
+
+def _cache():
+    return caches[cache_settings()["ALIAS"]]
+
+
+def home_scope():
+    return "home"
+
+
+def community_scope(community_id):
+    return f"community:{community_id}"
+
+
+def _version_key(scope):
+    return f"feed:version:{scope}"
+
+
+def feed_version(scope):
+    """Return the current version of a feed scope."""
+
+    cache = _cache()
+    version = cache.get(_version_key(scope))
+    if version is None:
+        # Seed from the clock rather than 1 so that a version evicted from
+        # the cache can never collide with pages rendered before eviction.
+        cache.add(_version_key(scope), time.time_ns(), timeout=None)
+        version = cache.get(_version_key(scope))
+    return version
+
+
+async def afeed_version(scope):
+    """Async version of :func:`feed_version`."""
+
+    cache = _cache()
+    version = await cache.aget(_version_key(scope))
+    if version is None:
+        await cache.aadd(_version_key(scope), time.time_ns(), timeout=None)
+        version = await cache.aget(_version_key(scope))
+    return version
+
+
+def bump_feed_version(*scopes):
+    """Invalidate every cached page of the given scopes."""
+
+    cache = _cache()
+    for scope in scopes:
+        try:
+            cache.incr(_version_key(scope))
+        except ValueError:
+            cache.add(_version_key(scope), time.time_ns(), timeout=None)
+
+
+def invalidate_post(post):
+    """Invalidate the feeds that list ``post``."""
+
+    bump_feed_version(home_scope(), community_scope(post.community_id))
+
+
+def feed_page(scope, sort, period, cursor, build, user=None, **extra_context):
+    """Return the rendered :class:`FeedPage`, from the cache when possible.
+
+    ``build`` is called on a miss and must return ``(posts, next_cursor)``.
+    ``user``'s votes are marked on the returned page. ``extra_context`` is
+    passed to ``core/_feed_page.html``; it must not depend on the viewer
+    since the page is shared between requests.
+    """
+
+    config = cache_settings()
+    key = _page_key(scope, feed_version(scope), sort, period, cursor)
+    entry = _cache().get(key) if config["ENABLED"] else None
+
+    if entry is None:
+        posts, next_cursor = build()
+        entry = _render_entry(posts, next_cursor, sort, period, extra_context)
+        if config["ENABLED"]:
+            _cache().set(key, entry, _ttl(config, sort))
+        values = {post.pk: (post.score, post.comment_count) for post in posts}
+        _count("misses")
+    else:
+        values = {
+            pk: (score, comment_count)
+            for pk, score, comment_count in _current_values(entry["ids"])
+        }
+        _count("hits")
+
+    vote_state = {}
+    if user is not None:
+        vote_state = load_vote_state(user, {"post": entry["ids"]})
+    return _feed_page(entry, values, vote_state)
+
+
+async def afeed_page(scope, sort, period, cursor, build, user=None, **extra_context):
+    """Async version of :func:`feed_page`; ``build`` must be a coroutine function."""
+
+    config = cache_settings()
+    key = _page_key(scope, await afeed_version(scope), sort, period, cursor)
+    entry = await _cache().aget(key) if config["ENABLED"] else None
+
+    if entry is None:
+        posts, next_cursor = await build()
+        entry = _render_entry(posts, next_cursor, sort, period, extra_context)
+        if config["ENABLED"]:
+            await _cache().aset(key, entry, _ttl(config, sort))
+        values = {post.pk: (post.score, post.comment_count) for post in posts}
+        _count("misses")
+    else:
+        values = {
+            pk: (score, comment_count)
+            async for pk, score, comment_count in _current_values(entry["ids"])
+        }
+        _count("hits")
+
+    vote_state = {}
+    if user is not None:
+        vote_state = await aload_vote_state(user, {"post": entry["ids"]})
+    return _feed_page(entry, values, vote_state)
+
+
+def _page_key(scope, version, sort, period, cursor):
+    return f"feed:page:{scope}:{version}:{sort}:{period}:{cursor or ''}"
+
+
+def _ttl(config, sort):
+    return config["TTL"] if sort == "new" else config["RANKED_TTL"]
+
+
+def _render_entry(posts, next_cursor, sort, period, extra_context):
+    context = {
+        "posts": posts,
+        "next_cursor": next_cursor,
+        "sort": sort,
+        "period": period,
+        "placeholders": True,
+        **extra_context,
+    }
+    return {
+        "html": render_to_string("core/_feed_page.html", context),
+        "ids": [post.pk for post in posts],
+        "next_cursor": next_cursor,
+    }
+
+
+def _current_values(ids):
+    return Post.objects.filter(pk__in=ids).values_list("pk", "score", "comment_count")
+
+
+def _feed_page(entry, values, vote_state):
+    return FeedPage(
+        mark_safe(_fill_placeholders(entry["html"], values, vote_state)),
+        entry["ids"],
+        entry["next_cursor"],
+    )
+
+
+def _fill_placeholders(html, values, vote_state):
+    def replace(match):
+        kind, pk = match.group(1), int(match.group(2))
+        if kind in ("up", "down"):
+            voted = vote_state.get(("post", pk)) == (1 if kind == "up" else -1)
+            return " voted" if voted else ""
+        score, comment_count = values.get(pk, (0, 0))
+        if kind == "score":
+            return str(score)
+        return f"{comment_count} comment{'' if comment_count == 1 else 's'}"
+
+    return PLACEHOLDER_RE.sub(replace, html)
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def feed_cache_stats():
+    """Return this process's hit/miss counters."""
+
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,280 @@
+"""Feed sort orders and keyset pagination.
+
+Every sort orders by a single stored column plus ``id`` as a tiebreaker,
+with a matching ``(community, -column, -id)`` and ``(-column, -id)`` index
+on ``Post``, so a feed page of the new, hot, rising or all-time top sort
+is an index range scan rather than a sort. Top over a period also filters
+on ``created_at``, which no score index orders: SQLite either walks the
+score index skipping older posts, or reads the period from the
+``created_at`` index and sorts it in a temporary B-tree, depending on its
+statistics. Either way that page costs more as the period fills up.
+
+Pages are addressed by an opaque cursor holding the sort key and id of
+the last row shown. The next page seeks straight to that position in the
+index instead of counting past ``OFFSET`` rows, so page 1000 costs the
+same as page 1.
+
+A feed over several communities (the personalized home feed) is a k-way
+merge of the per-community streams, see :func:`merge_page`.
+"""
+
+import base64
+import binascii
+import heapq
+import json
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.exceptions import FullResultSet
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+
+SORT_ORDERINGS = {
+    "new": ("-created_at", "-id"),
+    "hot": ("-hot_rank", "-id"),
+    "top": ("-score", "-id"),
+    "rising": ("-rising_rank", "-id"),
+}
+TOP_PERIODS = {
+    "day": timedelta(days=1),
+    "week": timedelta(days=7),
+    "all": None,
+}
+DEFAULT_SORT = "new"
+DEFAULT_PERIOD = "day"
+PAGE_SIZE = 50
+# Streams read per UNION ALL statement; SQLite allows 500 compound terms.
+MERGE_CHUNK = 100
+# Fewest rows read from each stream per round.
+MERGE_BATCH = 4
+
+
+def parse_sort(params):
+    """Return a valid ``(sort, period)`` pair from query parameters."""
+
+    sort = params.get("sort")
+    if sort not in SORT_ORDERINGS:
+        sort = DEFAULT_SORT
+    period = params.get("t")
+    if period not in TOP_PERIODS:
+        period = DEFAULT_PERIOD
+    return sort, period if sort == "top" else None
+
+
+def sort_posts(queryset, sort, period=None):
+    """Filter and order a ``Post`` queryset for the given sort.
+
+    The order is read from an index, except for top over a period (see
+    the module docstring).
+    """
+
+    if sort == "top" and TOP_PERIODS.get(period):
+        queryset = queryset.filter(created_at__gte=timezone.now() - TOP_PERIODS[period])
+    elif sort == "rising":
+        queryset = queryset.filter(rising_rank__gt=0)
+    return queryset.order_by(*SORT_ORDERINGS[sort])
+
+
+def _sort_field(sort):
+    return SORT_ORDERINGS[sort][0].lstrip("-")
+
+
+def encode_cursor(sort, post, field=None):
+    """Return the opaque cursor pointing just after ``post`` in ``sort`` order.
+
+    ``field`` names the sort key for orderings other than the feed sorts.
+    """
+
+    key = getattr(post, field or _sort_field(sort))
+    if isinstance(key, datetime):
+        key = key.isoformat()
+    payload = json.dumps([sort, key, post.pk], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(sort, token, field=None):
+    """Return ``(key, id)`` from a cursor token, or ``None`` if it is invalid.
+
+    Tokens issued for a different sort, or whose key does not have the
+    type of the sort key (an aware datetime for ``created_at``, a finite
+    number otherwise), are treated as invalid. ``field`` is as for
+    :func:`encode_cursor`.
+    """
+
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        cursor_sort, key, pk = json.loads(base64.urlsafe_b64decode(padded))
+        if cursor_sort != sort or not _is_id(pk):
+            return None
+        if (field or _sort_field(sort)) == "created_at":
+            if not isinstance(key, str):
+                return None
+            key = datetime.fromisoformat(key)
+            if timezone.is_naive(key):
+                return None
+        elif isinstance(key, bool) or not isinstance(key, (int, float)):
+            return None
+        elif not math.isfinite(key) or isinstance(key, int) and not _is_id(abs(key)):
+            return None
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    return key, pk
+
+
+def _is_id(value):
+    # Anything else would fail in the database rather than match nothing.
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value < 2**63
+
+
+def paginate(queryset, sort, cursor=None, page_size=PAGE_SIZE):
+    """Return ``(posts, next_cursor)`` for the page after ``cursor``.
+
+    ``queryset`` must already be sorted with :func:`sort_posts`.
+    ``next_cursor`` is ``None`` on the last page.
+    """
+
+    queryset = _after_cursor(queryset, sort, cursor)
+    return _split_page(list(queryset[: page_size + 1]), sort, page_size)
+
+
+async def apaginate(queryset, sort, cursor=None, page_size=PAGE_SIZE):
+    """Async version of :func:`paginate`."""
+
+    queryset = _after_cursor(queryset, sort, cursor)
+    posts = [post async for post in queryset[: page_size + 1]]
+    return _split_page(posts, sort, page_size)
+
+
+def merge_page(queryset, community_ids, sort, cursor=None, page_size=PAGE_SIZE):
+    """Return ``(posts, next_cursor)`` over the posts of several communities.
+
+    Like :func:`paginate` on ``queryset.filter(community__in=...)``, without
+    the single ``IN (...) ORDER BY`` that would read and sort every
+    matching post: see :func:`merged_rows`.
+    """
+
+    rows = merged_rows(queryset, community_ids, sort, cursor, page_size + 1)
+    return page_from_rows(queryset, rows, sort, page_size)
+
+
+def merged_rows(queryset, community_ids, sort, cursor=None, limit=PAGE_SIZE + 1):
+    """Return the first ``limit`` ``(key, id)`` rows after ``cursor`` across communities.
+
+    Each community is a stream read in order from its ``(community,
+    -key)`` index, a few rows at a time, with up to ``MERGE_CHUNK`` streams
+    per statement. After each round the rows read so far are merged and
+    cut to ``limit``; a stream is only read again while its last row
+    still ranks above the last row kept, since nothing after it can.
+    """
+
+    positions = dict.fromkeys(community_ids, decode_cursor(sort, cursor))
+    batch = max(MERGE_BATCH, -(-limit // max(len(positions), 1)))
+    rows, pending = [], list(positions)
+    while pending:
+        reads = _read_streams(queryset, sort, pending, positions, batch)
+        refill = []
+        for community_id, stream in reads.items():
+            rows.extend(stream)
+            if len(stream) == batch:
+                positions[community_id] = stream[-1]
+                refill.append(community_id)
+        rows = heapq.nlargest(limit, rows)
+        if len(rows) == limit:
+            refill = [key for key in refill if positions[key] > rows[-1]]
+        pending = refill
+        batch *= 2
+    return rows
+
+
+def page_from_rows(queryset, rows, sort, page_size=PAGE_SIZE):
+    """Return ``(posts, next_cursor)`` for ``(key, id)`` rows in feed order."""
+
+    posts = queryset.in_bulk([pk for _, pk in rows])
+    return _split_page([posts[pk] for _, pk in rows if pk in posts], sort, page_size)
+
+
+def _read_streams(queryset, sort, community_ids, positions, batch):
+    """Return ``{community_id: rows}``, up to ``batch`` rows after each position.
+
+    The statement is written out rather than built with the ORM: compiling
+    a queryset per stream costs more than the index reads themselves.
+    ``queryset``'s own filters (the sort's period, say) are compiled once.
+    """
+
+    model = queryset.model
+    alias = queryset.db
+    connection = connections[alias]
+    qn = connection.ops.quote_name
+    field = model._meta.get_field(_sort_field(sort))
+    table = qn(model._meta.db_table)
+    key, pk = f"{table}.{qn(field.column)}", f"{table}.{qn(model._meta.pk.column)}"
+    community = f"{table}.{qn(model._meta.get_field('community').column)}"
+    try:
+        where, where_params = queryset.query.get_compiler(using=alias).compile(
+            queryset.query.where
+        )
+        where = f" AND ({where})"
+    except FullResultSet:
+        where, where_params = "", []
+
+    reads = defaultdict(list)
+    for start in range(0, len(community_ids), MERGE_CHUNK):
+        parts, params = [], []
+        for i, community_id in enumerate(community_ids[start : start + MERGE_CHUNK]):
+            after, after_params = "", []
+            if positions[community_id] is not None:
+                value, last_pk = positions[community_id]
+                value = field.get_db_prep_value(value, connection)
+                # As in _after_position: the bound lets the database seek.
+                after = f" AND {key} <= %s AND ({key} < %s OR ({key} = %s AND {pk} < %s))"
+                after_params = [value, value, value, last_pk]
+            parts.append(
+                f"SELECT * FROM (SELECT {community}, {key}, {pk} FROM {table} "
+                f"WHERE {community} = %s{where}{after} "
+                f"ORDER BY {key} DESC, {pk} DESC LIMIT %s) AS stream{i}"
+            )
+            params += [community_id, *where_params, *after_params, batch]
+        with connection.cursor() as cursor:
+            cursor.execute(" UNION ALL ".join(parts), params)
+            for community_id, value, row_pk in cursor.fetchall():
+                reads[community_id].append((_row_key(value), row_pk))
+    for stream in reads.values():
+        # UNION ALL does not promise to keep each part's order.
+        stream.sort(reverse=True)
+    return reads
+
+
+def _row_key(key):
+    # Raw SQLite rows hold naive UTC datetimes; cursors decode aware ones.
+    if isinstance(key, datetime) and timezone.is_naive(key):
+        return key.replace(tzinfo=dt_timezone.utc)
+    return key
+
+
+def _after_cursor(queryset, sort, cursor):
+    return _after_position(queryset, sort, decode_cursor(sort, cursor))
+
+
+def _after_position(queryset, sort, position):
+    if position is None:
+        return queryset
+    key, pk = position
+    field = _sort_field(sort)
+    # The redundant ``field <= key`` bound lets the database seek into
+    # the index; the OR alone would be evaluated as a filter.
+    return queryset.filter(
+        Q(**{f"{field}__lt": key}) | Q(**{field: key, "pk__lt": pk}),
+        **{f"{field}__lte": key},
+    )
+
+
+def _split_page(posts, sort, page_size):
+    if len(posts) <= page_size:
+        return posts, None
+    posts = posts[:page_size]
+    return posts, encode_cursor(sort, posts[-1])
@@ -38,8 +38,17 @@ class PostForm(forms.ModelForm):
 class CommentForm(forms.ModelForm):
     class Meta:
         model = Comment
-        fields = ["body"]
-        widgets = {"body": forms.Textarea(attrs={"rows": 3})}
+        fields = ["body", "parent"]
+        widgets = {
+            "body": forms.Textarea(attrs={"rows": 3}),
+            "parent": forms.HiddenInput(),
+        }
+
+    def __init__(self, *args, post=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if post is not None:
+            # Replies may only target comments on the same post.
+            self.fields["parent"].queryset = post.comments.all()
 
     def clean_body(self):
         body = (self.cleaned_data.get("body") or "").strip()
@@ -0,0 +1,191 @@
+"""Conditional GET and cache headers for the feed and post pages.
+
+Each page has a version stamp, a :class:`~core.models.PageStamp` row:
+``home`` for the global feed, ``community:<id>`` for a community page and
+``post:<id>`` for a post page. A stamp is the time, in nanoseconds, of the
+last change that shows on the pages of its scope (posts created, edited or
+deleted, comments, subscriptions, votes on a post page), kept strictly
+increasing even when clocks tie or step back. It is written by the
+transaction making the change, so it is shared by every process,
+including management commands and the ``run_tasks`` workers, and commits
+with the change. A scope without a row has not changed since stamps were
+introduced.
+
+Votes only stamp their post's page. Stamping the feeds too would make
+every vote write the same ``home`` row and change the feeds' ``ETag`` on
+nearly every request; feed pages show scores up to ``RANKED_PERIOD``
+seconds late instead.
+
+An anonymous request's ``ETag`` hashes the stamp, the full path, the HTMX
+headers that select a fragment and the current hour, and on feed pages the
+current ``RANKED_PERIOD``, since scores, ranks and the sidebar's hourly
+counts move without a stamp. ``Last-Modified`` is the latest of the stamp,
+the start of the current hour and, on feed pages, the start of the current
+period. HTTP dates count whole seconds, so it is left out while that
+second is still running (a change later in the same second would not move
+it), and on ranked sorts, whose order moves with time alone. A request
+that matches is answered 304 before anything is loaded, in one query: the
+stamp by primary key, or for a community page the community by its unique
+name with its stamp in a subquery (see :func:`community_stamp`).
+
+Anonymous responses are ``public`` with a ``max-age`` of ``MAX_AGE``
+seconds, so a reverse proxy in front of the site can serve them and then
+revalidate. Signed-in users' pages carry their own votes and CSRF tokens:
+they get ``private, no-cache`` and no validators. Settings live in
+``HTTP_CACHE``.
+"""
+
+import hashlib
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import CharField, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Concat
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .models import PageStamp
+
+
+DEFAULTS = {"ENABLED": True, "MAX_AGE": 10, "RANKED_PERIOD": 30}
+
+
+class Validators(NamedTuple):
+    etag: str | None
+    last_modified: int | None
+    # Whether shared caches may store the response.
+    public: bool
+
+
+# Validators of a signed-in user's page: private, none to compare.
+PRIVATE = Validators(None, None, public=False)
+
+
+def http_settings():
+    return {**DEFAULTS, **getattr(settings, "HTTP_CACHE", {})}
+
+
+def home_scope():
+    return "home"
+
+
+def community_scope(community_id):
+    return f"community:{community_id}"
+
+
+def post_scope(post_id):
+    return f"post:{post_id}"
+
+
+def community_stamp():
+    """Return an annotation of ``Community`` rows with their page stamp."""
+
+    # The same key as community_scope(), built in SQL.
+    scope = Concat(Value("community:"), Cast(OuterRef("pk"), CharField()))
+    return Subquery(PageStamp.objects.filter(scope=scope).values("stamp")[:1])
+
+
+def touch(*scopes):
+    """Mark the pages of ``scopes`` as changed, within the current transaction."""
+
+    scopes = sorted(set(scopes))
+    now = time.time_ns()
+    qn = connection.ops.quote_name
+    table, scope, stamp = qn(PageStamp._meta.db_table), qn("scope"), qn("stamp")
+    greatest = "MAX" if connection.vendor == "sqlite" else "GREATEST"
+    rows = ", ".join(["(%s, %s)"] * len(scopes))
+    with connection.cursor() as cursor:
+        # One statement; a stamp never repeats or goes back.
+        cursor.execute(
+            f"INSERT INTO {table} ({scope}, {stamp}) VALUES {rows} "
+            f"ON CONFLICT ({scope}) DO UPDATE SET "
+            f"{stamp} = {greatest}({table}.{stamp} + 1, excluded.{stamp})",
+            [value for name in scopes for value in (name, now)],
+        )
+
+
+def forget(*scopes):
+    """Drop the stamps of ``scopes`` whose pages are gone."""
+
+    PageStamp.objects.filter(scope__in=scopes).delete()
+
+
+def post_changed(post):
+    touch(home_scope(), community_scope(post.community_id), post_scope(post.pk))
+
+
+def comment_changed(post_id, community_id):
+    # Feed rows show the comment count.
+    touch(home_scope(), community_scope(community_id), post_scope(post_id))
+
+
+def votes_changed(targets):
+    """Mark the post pages of the voted targets; ``targets`` is as from ``votes_cast``.
+
+    The feeds catch up within ``RANKED_PERIOD`` (see the module docstring).
+    """
+
+    scopes = {post_scope(post_id) for post_id, _ in targets.values()}
+    if scopes:
+        touch(*scopes)
+
+
+async def avalidators(request, user, scope, sort=None):
+    """Return the :class:`Validators` of a page of ``scope``, or ``None`` when disabled."""
+
+    if not http_settings()["ENABLED"] or user.is_authenticated:
+        return validators(request, user, None, sort)
+    stamps = PageStamp.objects.filter(scope=scope).values_list("stamp", flat=True)
+    return validators(request, user, await stamps.afirst(), sort)
+
+
+def validators(request, user, stamp, sort=None):
+    """Return the :class:`Validators` of a page whose stamp has been read already."""
+
+    config = http_settings()
+    if not config["ENABLED"]:
+        return None
+    if user.is_authenticated:
+        return PRIVATE
+
+    now = time.time()
+    hour = int(now // 3600)
+    # Feed pages (those with a sort) show scores, which votes do not stamp.
+    period = int(now // config["RANKED_PERIOD"]) if sort is not None else 0
+    fragment = (request.headers.get("HX-Request"), request.headers.get("HX-Target"))
+    parts = (stamp, request.get_full_path(), fragment, hour, period)
+    etag = hashlib.sha1(repr(parts).encode()).hexdigest()
+    last_modified = max((stamp or 0) // 10**9, hour * 3600, period * config["RANKED_PERIOD"])
+    if sort not in (None, "new") or last_modified >= int(now):
+        last_modified = None
+    return Validators(f'"{etag}"', last_modified, public=True)
+
+
+def not_modified(request, validators):
+    """Return a 304 response when the client's copy is current, else ``None``."""
+
+    if validators is None or validators.etag is None:
+        return None
+    response = get_conditional_response(
+        request, etag=validators.etag, last_modified=validators.last_modified
+    )
+    return finish(response, validators) if response is not None else None
+
+
+def finish(response, validators):
+    """Add the validators and ``Cache-Control`` to ``response``."""
+
+    if validators is None:
+        return response
+    if not validators.public:
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    response["ETag"] = validators.etag
+    if validators.last_modified is not None:
+        response["Last-Modified"] = http_date(validators.last_modified)
+    patch_cache_control(response, public=True, max_age=http_settings()["MAX_AGE"])
+    # HTMX requests get a fragment of the page.
+    patch_vary_headers(response, ["HX-Request", "HX-Target"])
+    return response
@@ -0,0 +1,236 @@
+"""Per-request query count and latency instrumentation.
+
+:class:`InstrumentationMiddleware` measures every request and files the
+sample under the resolved URL name. SQL is counted by an execute wrapper
+installed on each new database connection, and template rendering is
+timed by :class:`TimedDjangoTemplates`; both report to the request being
+measured through a context variable, so they cost nothing outside of it.
+The variable is copied into the threads ``sync_to_async`` runs ORM calls
+in, so queries made by async views are counted too.
+
+Each view keeps its last ``WINDOW`` samples in memory; :func:`view_stats`
+summarises them as percentiles for the staff-only stats endpoint. The
+measurements of the current request are also sent in a ``Server-Timing``
+header when ``SERVER_TIMING`` is set. ``QUERY_BUDGETS`` maps URL names to
+the most queries a request may run; going over is logged, or raises
+:class:`QueryBudgetExceeded` when ``FAIL_ON_BUDGET`` is set (as the tests
+do).
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {"ENABLED": True, "WINDOW": 1000, "SERVER_TIMING": False, "FAIL_ON_BUDGET": False}
+
+METRICS = ("queries", "db_ms", "template_ms", "total_ms")
+PERCENTILES = (50, 95, 99)
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+_samples = defaultdict(deque)
+_samples_lock = threading.Lock()
+
+
+class QueryBudgetExceeded(Exception):
+    """A request ran more queries than its view's budget allows."""
+
+
+class RequestMetrics:
+    """Measurements of a single request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self._rendering = False
+
+
+def instrumentation_settings():
+    return {**DEFAULTS, **getattr(settings, "INSTRUMENTATION", {})}
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper counting and timing queries."""
+
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+def install(connection):
+    """Install :func:`record_query` on a database connection."""
+
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedTemplate:
+    """A template of the Django backend, reporting its render time.
+
+    Wraps the backend's own template, so that loading and rendering
+    errors are reported by the backend as usual.
+    """
+
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        # Templates rendered inside another one are already being timed.
+        if metrics is None or metrics._rendering:
+            return self._template.render(context, request)
+        metrics._rendering = True
+        start = time.perf_counter()
+        try:
+            return self._template.render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - start
+            metrics._rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, reporting render time to the middleware."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class InstrumentationMiddleware:
+    """Measure each request and enforce the per-view query budgets.
+
+    Both sync and async capable, so that it never forces an async request
+    path through a thread (or the other way round).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        config = instrumentation_settings()
+        if not config["ENABLED"]:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, metrics, time.perf_counter() - start, config)
+
+    async def __acall__(self, request):
+        config = instrumentation_settings()
+        if not config["ENABLED"]:
+            return await self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, metrics, time.perf_counter() - start, config)
+
+    def _finish(self, request, response, metrics, total, config):
+        sample = (
+            metrics.queries,
+            metrics.db_time * 1000,
+            metrics.template_time * 1000,
+            total * 1000,
+        )
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        if view_name:
+            _record(view_name, sample, config["WINDOW"])
+        if config["SERVER_TIMING"]:
+            response["Server-Timing"] = server_timing(*sample)
+        if view_name:
+            _check_budget(view_name, metrics.queries, config)
+        return response
+
+
+def server_timing(queries, db_ms, template_ms, total_ms):
+    """Return the ``Server-Timing`` header value for one request."""
+
+    return (
+        f'db;dur={db_ms:.1f};desc="{queries} queries", '
+        f"tpl;dur={template_ms:.1f}, "
+        f"total;dur={total_ms:.1f}"
+    )
+
+
+def _check_budget(view_name, queries, config):
+    budget = getattr(settings, "QUERY_BUDGETS", {}).get(view_name)
+    if budget is None or queries <= budget:
+        return
+    message = f"{view_name} ran {queries} queries, over its budget of {budget}"
+    if config["FAIL_ON_BUDGET"]:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def _record(view_name, sample, window):
+    with _samples_lock:
+        samples = _samples[view_name]
+        samples.append(sample)
+        while len(samples) > window:
+            samples.popleft()
+
+
+def _percentile(ordered, percent):
+    # Nearest-rank percentile of an already sorted list.
+    index = max(0, -(-len(ordered) * percent // 100) - 1)
+    return ordered[index]
+
+
+def view_stats():
+    """Return rolling percentiles of every metric, per URL name."""
+
+    with _samples_lock:
+        snapshot = {name: list(samples) for name, samples in _samples.items()}
+    stats = {}
+    for name, samples in sorted(snapshot.items()):
+        stats[name] = {"count": len(samples)}
+        for position, metric in enumerate(METRICS):
+            ordered = sorted(sample[position] for sample in samples)
+            stats[name][metric] = {
+                f"p{percent}": round(_percentile(ordered, percent), 2) for percent in PERCENTILES
+            }
+    return stats
+
+
+def reset_stats():
+    """Forget every recorded sample."""
+
+    with _samples_lock:
+        _samples.clear()
@@ -0,0 +1,237 @@
+"""Live post updates, pushed to ``post_detail`` as server-sent events.
+
+``vote_post``, ``vote_batch`` and ``add_comment`` publish to the in-process
+:class:`LiveHub` once their write has committed, and every ``post_live``
+stream subscribed to that post is woken. A stream then waits out the rest
+of ``INTERVAL_MS`` since its last event, so a burst of votes becomes one
+event carrying the latest score and the comments added meanwhile go out
+together. Publishing to a post nobody watches costs a dictionary lookup.
+
+Streams are async and only served under ASGI (``config.asgi``); a slow
+client holds nothing but its own pending updates: the latest score and at
+most ``MAX_PENDING`` new comment ids, the oldest dropped first. Each
+stream ends after ``MAX_DURATION`` seconds, and EventSource reconnects on
+its own; the first event of every stream is the current score, so nothing
+is stale after a reconnect. At most ``MAX_CONNECTIONS`` streams are open
+per process, beyond which the endpoint answers 503.
+
+The hub lives in one process: with several ASGI worker processes a viewer
+only hears about writes handled by the same worker.
+"""
+
+import asyncio
+import threading
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import router
+from django.http import StreamingHttpResponse
+from django.template.loader import render_to_string
+
+from .models import Comment
+
+
+DEFAULTS = {
+    "INTERVAL_MS": 500,
+    "HEARTBEAT": 15,
+    "MAX_DURATION": 300,
+    "MAX_CONNECTIONS": 1000,
+    "MAX_PENDING": 50,
+}
+
+# How long EventSource waits before reconnecting, in milliseconds.
+RETRY_MS = 3000
+
+
+def live_settings():
+    return {**DEFAULTS, **getattr(settings, "LIVE_UPDATES", {})}
+
+
+class Subscription:
+    """The updates of one post not yet sent to one stream."""
+
+    def __init__(self, post_id, loop, max_pending):
+        self.post_id = post_id
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+        self._notified = False
+        self._score = None
+        self._comments = deque(maxlen=max_pending)
+
+    def push(self, score=None, comment_id=None):
+        """Record an update; safe to call from any thread."""
+
+        with self._lock:
+            if score is not None:
+                self._score = score
+            if comment_id is not None:
+                self._comments.append(comment_id)
+            wake = not self._notified
+            self._notified = True
+        if wake:
+            try:
+                self._loop.call_soon_threadsafe(self._ready.set)
+            except RuntimeError:
+                # The stream's event loop is gone; it is being unsubscribed.
+                pass
+
+    async def wait(self, timeout):
+        """Wait for an update; return ``False`` if none came within ``timeout``."""
+
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def take(self):
+        """Return and forget ``(score, comment_ids)``; ``score`` may be ``None``."""
+
+        with self._lock:
+            score, comments = self._score, list(self._comments)
+            self._score = None
+            self._comments.clear()
+            self._notified = False
+            self._ready.clear()
+        return score, comments
+
+
+class LiveHub:
+    """Fan updates of a post out to the streams subscribed to it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+        self._count = 0
+
+    def subscribe(self, post_id, max_connections, max_pending):
+        """Return a new :class:`Subscription`, or ``None`` when at capacity.
+
+        Must be called from the event loop that will read the subscription.
+        """
+
+        with self._lock:
+            if self._count >= max_connections:
+                return None
+            subscription = Subscription(post_id, asyncio.get_running_loop(), max_pending)
+            self._subscriptions[post_id].add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.post_id)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.post_id]
+            self._count -= 1
+
+    def publish(self, post_id, score=None, comment_id=None):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(post_id, ()))
+        for subscription in subscriptions:
+            subscription.push(score, comment_id)
+
+    def connection_count(self):
+        with self._lock:
+            return self._count
+
+
+hub = LiveHub()
+
+
+def publish_score(post_id, score):
+    """Tell the post's streams about its new score."""
+
+    hub.publish(post_id, score=score)
+
+
+def publish_comment(comment):
+    """Tell the post's streams about a new comment."""
+
+    hub.publish(comment.post_id, comment_id=comment.pk)
+
+
+class LiveStreamResponse(StreamingHttpResponse):
+    """An event stream that gives its hub subscription back when closed."""
+
+    def __init__(self, request, post, subscription, config):
+        super().__init__(
+            _events(request, post, subscription, config), content_type="text/event-stream"
+        )
+        self.subscription = subscription
+        self["Cache-Control"] = "no-cache"
+        # Keep reverse proxies (nginx) from buffering the stream.
+        self["X-Accel-Buffering"] = "no"
+
+    def close(self):
+        hub.unsubscribe(self.subscription)
+        super().close()
+
+
+def stream(request, post):
+    """Return the event stream for ``post``, or ``None`` at capacity.
+
+    ``post`` needs its current ``score`` loaded.
+    """
+
+    config = live_settings()
+    subscription = hub.subscribe(post.pk, config["MAX_CONNECTIONS"], config["MAX_PENDING"])
+    if subscription is None:
+        return None
+    return LiveStreamResponse(request, post, subscription, config)
+
+
+async def _events(request, post, subscription, config):
+    loop = asyncio.get_running_loop()
+    interval = config["INTERVAL_MS"] / 1000
+    deadline = loop.time() + config["MAX_DURATION"]
+    yield f"retry: {RETRY_MS}\n\n" + _score_event(post.pk, post.score)
+    last_sent = loop.time()
+    while (remaining := deadline - loop.time()) > 0:
+        if not await subscription.wait(min(config["HEARTBEAT"], remaining)):
+            yield ": keepalive\n\n"
+            continue
+        delay = last_sent + interval - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        score, comment_ids = subscription.take()
+        last_sent = loop.time()
+        events = []
+        if score is not None:
+            events.append(_score_event(post.pk, score))
+        if comment_ids:
+            # The ids were published once committed on the primary; a read
+            # replica may not have them yet.
+            comments = Comment.objects.using(router.db_for_write(Comment))
+            comments = comments.filter(pk__in=comment_ids).select_related("author")
+            can_comment = (await request.auser()).is_authenticated
+            async for comment in comments.order_by("path"):
+                events.append(_comment_event(request, comment, can_comment))
+        yield "".join(events)
+
+
+def _event(name, data):
+    lines = "".join(f"data: {line}\n" for line in data.splitlines())
+    return f"event: {name}\n{lines}\n"
+
+
+def _score_event(post_id, score):
+    # Same markup as the vote endpoint's response, so either can replace it.
+    return _event(f"post-score-{post_id}", f"<span id='post-score-{post_id}'>{score}</span>")
+
+
+def _comment_event(request, comment, can_comment):
+    comment.children = []
+    comment.more_replies = 0
+    context = {"votes": {}, "can_comment": can_comment}
+    if comment.parent_id is None:
+        html = render_to_string("core/_comment.html", {"comment": comment, **context}, request)
+        return _event("comment", html)
+    html = render_to_string(
+        "core/_comment_list.html", {"comments": [comment], **context}, request
+    )
+    return _event(f"reply-{comment.parent_id}", html)
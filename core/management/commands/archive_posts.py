@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from datetime import timedelta
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import moderation
+from core.models import Post
+
+from .remove_content import _reporter
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive the posts older than --older-than days (in --community only, "
+        "if given): write each post with its comments to a JSON lines file, "
+        "gzipped if it ends in .gz, then delete them with their comments and "
+        "votes in chunks of short transactions (see core.moderation)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than", type=float, metavar="DAYS", required=True)
+        parser.add_argument("--community", help="Community name.")
+        parser.add_argument(
+            "--output", help="Archive file; defaults to ARCHIVE_DIR/posts-<time>.jsonl.gz."
+        )
+        parser.add_argument("--chunk-size", type=int, help="Rows per transaction.")
+
+    def handle(self, *args, **options):
+        posts = Post.objects.filter(
+            created_at__lt=timezone.now() - timedelta(days=options["older_than"])
+        )
+        if options["community"]:
+            posts = posts.filter(community__name=options["community"])
+        path = Path(options["output"] or moderation.archive_path())
+        with moderation.open_archive(path) as stream:
+            tally = moderation.remove_posts(
+                posts,
+                options["chunk_size"],
+                _reporter(self, options["verbosity"]),
+                archive=moderation.archive_writer(stream),
+            )
+        self.stdout.write(self.style.SUCCESS(f"Archived to {path}: {tally}."))
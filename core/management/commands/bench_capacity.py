@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import json
+import multiprocessing
+import random
+import threading
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections
+from django.test.utils import override_settings
+
+from .bench_endpoints import (
+    SCENARIOS,
+    Command as EndpointsCommand,
+    HttpTransport,
+    _git_commit,
+    start_server,
+)
+
+
+class Command(EndpointsCommand):
+    help = (
+        "Measure how throughput and latency hold up as the number of concurrent "
+        "keep-alive connections grows. The project is served from a child "
+        "process by the built-in threaded WSGI server or the asyncio ASGI "
+        "server (or any running server with --url), and each connection level "
+        "sends --requests requests per connection. Results are saved as JSON."
+    )
+    output_prefix = "capacity"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenario", choices=SCENARIOS, default="home")
+        parser.add_argument("--connections", nargs="+", type=int, default=[1, 8, 32, 64, 128])
+        parser.add_argument("--requests", type=int, default=20, help="Per connection.")
+        parser.add_argument(
+            "--warmup", type=int, default=2, help="Untimed requests per connection."
+        )
+        parser.add_argument("--server", choices=["wsgi", "asgi"], default="asgi")
+        parser.add_argument("--url", help="Base URL of a running server using this database.")
+        parser.add_argument("--anonymous", action="store_true")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="JSON results file.")
+        parser.add_argument("--compare", help="Earlier JSON results to compare against.")
+
+    def handle(self, *args, **options):
+        name = options["scenario"]
+        targets = self._targets(max(options["connections"]))
+        users = targets["users"]
+        if options["anonymous"]:
+            users = [None]
+        build = getattr(self, f"_{name}")
+        rng = random.Random(options["seed"])
+
+        results = {}
+        timing = {**getattr(settings, "INSTRUMENTATION", {}), "SERVER_TIMING": True}
+        with override_settings(INSTRUMENTATION=timing):
+            server = None
+            if options["url"]:
+                transport = HttpTransport(options["url"])
+            else:
+                server = _ServerProcess(options["server"])
+                transport = HttpTransport(f"http://127.0.0.1:{server.port}")
+            try:
+                for count in options["connections"]:
+                    warmup = [build(rng, targets) for _ in range(options["warmup"] * count)]
+                    self._run(transport, warmup, count, users)
+                    requests = [build(rng, targets) for _ in range(options["requests"] * count)]
+                    results[str(count)] = self._run(transport, requests, count, users)
+                    self._report(f"{count} conns", results[str(count)])
+            finally:
+                if server is not None:
+                    server.stop()
+
+        document = {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(dt_timezone.utc).isoformat(timespec="seconds"),
+            "transport": options["url"] or options["server"],
+            "scenario": name,
+            "requests_per_connection": options["requests"],
+            "anonymous": options["anonymous"],
+            "database": connections["default"].vendor,
+            "posts": targets["post_count"],
+            # Keyed by connection count, in the shape _compare expects.
+            "scenarios": results,
+        }
+        path = options["output"] or self._default_output()
+        with open(path, "w") as f:
+            json.dump(document, f, indent=2)
+        self.stdout.write(f"Results written to {path}")
+        if options["compare"]:
+            self._compare(options["compare"], results)
+
+
+class _ServerProcess:
+    """A server from :func:`start_server` running in a forked child process.
+
+    Keeping the server out of this process means the client threads do not
+    compete with it for the GIL.
+    """
+
+    def __init__(self, kind):
+        # The child must open its own database connections.
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        receiver, sender = context.Pipe(duplex=False)
+        self.process = context.Process(target=_serve, args=(kind, sender), daemon=True)
+        self.process.start()
+        self.port = receiver.recv()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+
+
+def _serve(kind, pipe):
+    server = start_server(kind)
+    pipe.send(server.server_port)
+    threading.Event().wait()
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.template.loader import render_to_string
+from django.test import Client, RequestFactory
+from django.urls import reverse
+
+from core import threads
+from core.models import Comment, Community, Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure time to first byte and peak memory of post_detail on a post "
+        "with many comments, paged versus rendering the whole thread."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--comments", type=int, default=100_000)
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        post = self._seed(options["comments"], options["batch_size"])
+
+        client = Client()
+        request = RequestFactory().get("/")
+
+        def paged():
+            response = client.get(reverse("post_detail", args=[post.pk]))
+            return b"".join(response)
+
+        def unpaged():
+            comments = threads.load_thread(post, depth=None, limit=None)
+            return render_to_string(
+                "core/_comment_list.html", {"comments": comments}, request=request
+            ).encode()
+
+        paged()  # Warm up URL resolution and template loading.
+        self.stdout.write(f"{'mode':>8} {'ttfb ms':>10} {'peak MiB':>10} {'bytes':>12}")
+        for label, fn in (("paged", paged), ("unpaged", unpaged)):
+            start = time.perf_counter()
+            body = fn()
+            elapsed = (time.perf_counter() - start) * 1000
+            # Memory is traced in a separate run since tracing slows it down.
+            tracemalloc.start()
+            fn()
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            self.stdout.write(f"{label:>8} {elapsed:>10.1f} {peak:>10.1f} {len(body):>12}")
+
+    def _seed(self, total, batch_size):
+        User = get_user_model()
+        author, _ = User.objects.get_or_create(username="bench-comments")
+        community, _ = Community.objects.get_or_create(
+            name="bench-comments", defaults={"title": "Comment benchmark"}
+        )
+        post, _ = Post.objects.get_or_create(
+            community=community,
+            title="Comment benchmark",
+            defaults={"author": author, "post_type": "text"},
+        )
+        existing = post.comments.count()
+        next_pk = (Comment.objects.aggregate(Max("pk"))["pk__max"] or 0) + 1
+        for start in range(existing, total, batch_size):
+            # Ids are assigned up front so each path is known at insert time.
+            with transaction.atomic():
+                Comment.objects.bulk_create(
+                    Comment(
+                        pk=next_pk + offset,
+                        post=post,
+                        author=author,
+                        body=f"Comment {start + offset}",
+                        path=threads.encode_segment(next_pk + offset),
+                    )
+                    for offset in range(min(batch_size, total - start))
+                )
+            next_pk += batch_size
+        Post.objects.filter(pk=post.pk).update(comment_count=total)
+        return post
@@ -0,0 +1,492 @@
+from __future__ import annotations
+
+import asyncio
+import http.client
+import json
+import random
+import re
+import statistics
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from http import HTTPStatus
+from socketserver import ThreadingMixIn
+from urllib.parse import unquote, urlencode, urlsplit
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.conf import settings
+from django.contrib.auth import (
+    BACKEND_SESSION_KEY,
+    HASH_SESSION_KEY,
+    SESSION_KEY,
+    get_user_model,
+)
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from core.models import Community, Post
+
+
+SCENARIOS = ("home", "community", "post_detail", "submit_post", "add_comment", "vote_post")
+WRITE_SCENARIOS = {"submit_post", "add_comment", "vote_post"}
+# Posts requests are drawn from, newest first.
+POST_SAMPLE = 10_000
+
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the core endpoints against the current (seeded) database: "
+        "requests per second, latency percentiles and queries per request, "
+        "saved as JSON. Requests go through the Django test client by default, "
+        "through a built-in threaded WSGI server (--server wsgi) or asyncio "
+        "ASGI server (--server asgi), or to a running server (gunicorn, "
+        "uvicorn...) with --url."
+    )
+    output_prefix = "endpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument("--requests", type=int, default=200, help="Per scenario.")
+        parser.add_argument(
+            "--warmup", type=int, default=10, help="Untimed requests per scenario."
+        )
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--server", choices=["client", "wsgi", "asgi"], default="client")
+        parser.add_argument(
+            "--url",
+            help=(
+                "Base URL of a running server using this database. Query counts "
+                "are only reported if it sends Server-Timing headers."
+            ),
+        )
+        parser.add_argument(
+            "--anonymous",
+            action="store_true",
+            help="Send read requests without logging in.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--output",
+            help="JSON results file; defaults to benchmarks/endpoints-<time>.json.",
+        )
+        parser.add_argument("--compare", help="Earlier JSON results to compare against.")
+
+    def handle(self, *args, **options):
+        targets = self._targets(options["concurrency"])
+        rng = random.Random(options["seed"])
+        server = None
+        if options["url"]:
+            transport = HttpTransport(options["url"])
+        elif options["server"] != "client":
+            server = start_server(options["server"])
+            transport = HttpTransport(f"http://127.0.0.1:{server.server_port}")
+        else:
+            transport = ClientTransport()
+
+        results = {}
+        timing = {**getattr(settings, "INSTRUMENTATION", {}), "SERVER_TIMING": True}
+        try:
+            with override_settings(INSTRUMENTATION=timing):
+                for name in options["scenarios"]:
+                    users = targets["users"]
+                    if options["anonymous"] and name not in WRITE_SCENARIOS:
+                        users = [None]
+                    build = getattr(self, f"_{name}")
+                    warmup = [build(rng, targets) for _ in range(options["warmup"])]
+                    self._run(transport, warmup, 1, users)
+                    requests = [build(rng, targets) for _ in range(options["requests"])]
+                    results[name] = self._run(transport, requests, options["concurrency"], users)
+                    self._report(name, results[name])
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        document = {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(dt_timezone.utc).isoformat(timespec="seconds"),
+            "transport": options["url"] or options["server"],
+            "concurrency": options["concurrency"],
+            "requests": options["requests"],
+            "anonymous": options["anonymous"],
+            "database": connections["default"].vendor,
+            "posts": targets["post_count"],
+            "scenarios": results,
+        }
+        path = options["output"] or self._default_output()
+        with open(path, "w") as f:
+            json.dump(document, f, indent=2)
+        self.stdout.write(f"Results written to {path}")
+        if options["compare"]:
+            self._compare(options["compare"], results)
+
+    def _targets(self, concurrency):
+        # Draw from the newest posts, as real traffic mostly does.
+        posts = list(Post.objects.order_by("-pk").values_list("pk", flat=True)[:POST_SAMPLE])
+        communities = list(Community.objects.values_list("name", flat=True))
+        users = list(
+            get_user_model().objects.filter(is_active=True).order_by("pk")[: max(concurrency, 1)]
+        )
+        if not (posts and communities and users):
+            raise CommandError("Nothing to benchmark; run seed_demo first.")
+        return {
+            "posts": posts,
+            "communities": communities,
+            "users": users,
+            "post_count": Post.objects.count(),
+        }
+
+    # Request builders: each returns (method, path, data).
+
+    def _home(self, rng, targets):
+        return "GET", reverse("home"), None
+
+    def _community(self, rng, targets):
+        return "GET", reverse("community", args=[rng.choice(targets["communities"])]), None
+
+    def _post_detail(self, rng, targets):
+        return "GET", reverse("post_detail", args=[rng.choice(targets["posts"])]), None
+
+    def _submit_post(self, rng, targets):
+        path = reverse("submit_post", args=[rng.choice(targets["communities"])])
+        data = {"post_type": "text", "title": f"Bench post {rng.random()}", "body": "Benchmark"}
+        return "POST", path, data
+
+    def _add_comment(self, rng, targets):
+        path = reverse("add_comment", args=[rng.choice(targets["posts"])])
+        return "POST", path, {"body": f"Bench comment {rng.random()}"}
+
+    def _vote_post(self, rng, targets):
+        path = reverse("vote_post", args=[rng.choice(targets["posts"])])
+        return "POST", path, {"v": rng.choice([1, -1])}
+
+    def _run(self, transport, requests, concurrency, users):
+        """Send ``requests`` from ``concurrency`` threads and summarise them."""
+
+        samples = []
+        lock = threading.Lock()
+
+        def worker(index):
+            user = users[index % len(users)]
+            session = transport.session(user)
+            own = []
+            try:
+                for method, path, data in requests[index::concurrency]:
+                    start = time.perf_counter()
+                    status, server_timing = transport.send(session, method, path, data)
+                    elapsed = (time.perf_counter() - start) * 1000
+                    match = QUERIES_RE.search(server_timing or "")
+                    own.append((elapsed, status, int(match.group(1)) if match else None))
+            finally:
+                if concurrency > 1:
+                    connections.close_all()
+            with lock:
+                samples.extend(own)
+
+        start = time.perf_counter()
+        if concurrency > 1:
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            worker(0)
+        wall = time.perf_counter() - start
+        return _summarise(samples, wall)
+
+    def _report(self, name, result):
+        if not result["requests"]:
+            return
+        queries = result["queries"]
+        self.stdout.write(
+            f"{name:>12} {result['rps']:>8.1f} req/s"
+            f"  p50 {result['p50_ms']:>7.2f}  p95 {result['p95_ms']:>7.2f}"
+            f"  p99 {result['p99_ms']:>7.2f} ms"
+            f"  {'-' if queries is None else f'{queries:.1f}':>5} queries"
+            f"  {result['errors']} errors"
+        )
+
+    def _default_output(self):
+        directory = settings.BASE_DIR / "benchmarks"
+        directory.mkdir(exist_ok=True)
+        return directory / f"{self.output_prefix}-{datetime.now():%Y%m%d-%H%M%S}.json"
+
+    def _compare(self, path, results):
+        with open(path) as f:
+            baseline = json.load(f)
+        commit = baseline.get("commit") or "unknown commit"
+        self.stdout.write(f"Compared with {path} ({commit}):")
+        for name, result in results.items():
+            before = baseline["scenarios"].get(name)
+            if not before or not before["requests"] or not result["requests"]:
+                continue
+            self.stdout.write(
+                f"{name:>12} req/s {_change(before['rps'], result['rps'])}"
+                f"  p50 {_change(before['p50_ms'], result['p50_ms'])}"
+                f"  p99 {_change(before['p99_ms'], result['p99_ms'])}"
+                f"  queries {before['queries']} -> {result['queries']}"
+            )
+
+
+class ClientTransport:
+    """Requests through the Django test client, in this process."""
+
+    def session(self, user):
+        client = Client(raise_request_exception=False)
+        if user is not None:
+            client.force_login(user)
+        return client
+
+    def send(self, client, method, path, data):
+        if method == "POST":
+            response = client.post(path, data)
+        else:
+            response = client.get(path)
+        if response.streaming:
+            # Consume the stream, as a real client would.
+            b"".join(response.streaming_content)
+        return response.status_code, response.get("Server-Timing")
+
+
+class HttpTransport:
+    """Requests over HTTP keep-alive connections, one per worker."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+
+    def session(self, user):
+        csrf = get_random_string(32)
+        cookies = {settings.CSRF_COOKIE_NAME: csrf}
+        if user is not None:
+            cookies[settings.SESSION_COOKIE_NAME] = _session_key(user)
+        return {
+            "connection": http.client.HTTPConnection(self.host, self.port, timeout=60),
+            "headers": {
+                "Cookie": "; ".join(f"{name}={value}" for name, value in cookies.items()),
+                "X-CSRFToken": csrf,
+            },
+        }
+
+    def send(self, session, method, path, data):
+        headers = dict(session["headers"])
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        connection = session["connection"]
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status, response.getheader("Server-Timing")
+
+
+def _session_key(user):
+    # The session a login would create, without going through the login view.
+    session = SessionStore()
+    session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return session.session_key
+
+
+def start_server(kind):
+    """Serve the project on a free local port from a background thread.
+
+    ``kind`` is ``"wsgi"`` or ``"asgi"``. The returned server has a
+    ``server_port`` and is stopped with ``shutdown()`` and ``server_close()``.
+    """
+
+    if kind == "asgi":
+        server = _ASGIServer(get_asgi_application())
+    else:
+        server = make_server(
+            "127.0.0.1",
+            0,
+            get_wsgi_application(),
+            server_class=_ThreadingWSGIServer,
+            handler_class=_QuietHandler,
+        )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class _ASGIServer:
+    """An HTTP/1.1 keep-alive server for an ASGI app on one event loop.
+
+    Only as much HTTP as the benchmark clients speak: request bodies are
+    read by Content-Length, and responses go out with a Content-Length or,
+    when streamed, chunked.
+    """
+
+    def __init__(self, app, host="127.0.0.1", port=0):
+        self.app = app
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self._connection, host, port, backlog=1024)
+        )
+        self.server_port = self.server.sockets[0].getsockname()[1]
+        self._stopped = threading.Event()
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self._stopped.set()
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._stopped.wait()
+
+    def server_close(self):
+        self.server.close()
+        self.loop.run_until_complete(self._cancel_connections())
+        self.loop.close()
+
+    async def _cancel_connections(self):
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _connection(self, reader, writer):
+        try:
+            while request_line := (await reader.readline()).strip():
+                method, target, _ = request_line.decode("latin-1").split()
+                headers = []
+                while line := (await reader.readline()).strip():
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers.append((name.strip().lower().encode(), value.strip().encode()))
+                body = await reader.readexactly(int(dict(headers).get(b"content-length", 0)))
+                await self._respond(method, target, headers, body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, method, target, headers, body, writer):
+        path, _, query = target.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": unquote(path),
+            "raw_path": path.encode("latin-1"),
+            "query_string": query.encode("latin-1"),
+            "root_path": "",
+            "headers": headers,
+            "client": writer.get_extra_info("peername")[:2],
+            "server": writer.get_extra_info("sockname")[:2],
+        }
+        incoming = [{"type": "http.request", "body": body, "more_body": False}]
+        start = {}
+
+        async def receive():
+            if incoming:
+                return incoming.pop()
+            # Clients never disconnect mid-request; Django cancels this wait
+            # once the response is sent.
+            return await asyncio.get_running_loop().create_future()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                start.update(message, chunked=None)
+                return
+            content = message.get("body", b"")
+            more = message.get("more_body", False)
+            if start["chunked"] is None:
+                # A response sent in one message gets a Content-Length and
+                # anything else (event streams) is sent chunked as it comes.
+                start["chunked"] = more
+                writer.write(_head(start, None if more else len(content)))
+            if not start["chunked"]:
+                writer.write(content)
+            elif content:
+                writer.write(b"%x\r\n%s\r\n" % (len(content), content))
+            if start["chunked"] and not more:
+                writer.write(b"0\r\n\r\n")
+            await writer.drain()
+
+        await self.app(scope, receive, send)
+
+
+def _head(start, length):
+    status = start["status"]
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}".encode()]
+    lines += [
+        name + b": " + value
+        for name, value in start.get("headers", [])
+        if name.lower() not in (b"content-length", b"transfer-encoding")
+    ]
+    if length is None:
+        lines.append(b"transfer-encoding: chunked")
+    else:
+        lines.append(b"content-length: %d" % length)
+    return b"\r\n".join(lines) + b"\r\n\r\n"
+
+
+def _summarise(samples, wall):
+    if not samples:
+        return {"requests": 0}
+    latencies = sorted(elapsed for elapsed, _, _ in samples)
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    else:
+        cuts = latencies * 99
+    queries = [count for _, _, count in samples if count is not None]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, status, _ in samples if status >= 400),
+        "seconds": round(wall, 3),
+        "rps": round(len(samples) / wall, 1),
+        "mean_ms": round(statistics.fmean(latencies), 2),
+        "p50_ms": round(cuts[49], 2),
+        "p95_ms": round(cuts[94], 2),
+        "p99_ms": round(cuts[98], 2),
+        "max_ms": round(latencies[-1], 2),
+        "queries": round(statistics.fmean(queries), 1) if queries else None,
+    }
+
+
+def _change(before, after):
+    if not before:
+        return f"{after}"
+    return f"{before} -> {after} ({(after - before) / before:+.0%})"
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
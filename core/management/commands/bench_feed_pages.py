@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import feeds
+from core.models import Community, Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare feed page latency at increasing depth for keyset cursors and "
+        "OFFSET paging. Seeds the bench-feed community on first run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=1_000_000)
+        parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100, 1000])
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        community = self._seed(options["posts"], options["batch_size"])
+        queryset = feeds.sort_posts(community.posts.select_related("author"), "new")
+        page_size = feeds.PAGE_SIZE
+
+        self.stdout.write(f"{'page':>6} {'keyset ms':>10} {'offset ms':>10}")
+        for page in options["pages"]:
+            offset = (page - 1) * page_size
+            cursor = None
+            if offset:
+                # Position the cursor on the last row of the previous page.
+                previous = queryset[offset - 1 : offset].get()
+                cursor = feeds.encode_cursor("new", previous)
+
+            keyset = self._time(
+                lambda: feeds.paginate(queryset, "new", cursor, page_size), options["repeat"]
+            )
+            offset_paging = self._time(
+                lambda: list(queryset[offset : offset + page_size]), options["repeat"]
+            )
+            self.stdout.write(f"{page:>6} {keyset:>10.2f} {offset_paging:>10.2f}")
+
+    def _time(self, fn, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples)
+
+    def _seed(self, total, batch_size):
+        User = get_user_model()
+        author, _ = User.objects.get_or_create(username="bench-feed")
+        community, _ = Community.objects.get_or_create(
+            name="bench-feed", defaults={"title": "Feed benchmark"}
+        )
+        existing = community.posts.count()
+        for start in range(existing, total, batch_size):
+            with transaction.atomic():
+                Post.objects.bulk_create(
+                    Post(
+                        community=community,
+                        author=author,
+                        post_type="text",
+                        title=f"Bench post {i}",
+                    )
+                    for i in range(start, min(start + batch_size, total))
+                )
+            self.stdout.write(f"Seeded {min(start + batch_size, total)}/{total} posts", ending="\r")
+        if existing < total:
+            self.stdout.write("")
+        return community
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from core import feeds, subscriptions
+from core.models import Community, Post, Subscription
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the personalized home feed for users subscribed to 1, 50 and 500 "
+        "communities: the k-way merge, the merge behind the feed cache, and a "
+        "single IN (...) ORDER BY query for comparison. Each sample walks "
+        "--pages pages. Subscribes the bench-subs-N users to the N busiest "
+        "communities on first run; seed_demo --communities sets how many exist."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subscriptions", type=int, nargs="+", default=[1, 50, 500])
+        parser.add_argument(
+            "--sorts", nargs="+", choices=list(feeds.SORT_ORDERINGS), default=["new", "hot"]
+        )
+        parser.add_argument("--pages", type=int, default=3)
+        parser.add_argument("--repeat", type=int, default=10)
+
+    def handle(self, *args, **options):
+        available = Community.objects.count()
+        if max(options["subscriptions"]) > available:
+            raise CommandError(
+                f"Only {available} communities; run seed_demo with more --communities."
+            )
+
+        self.stdout.write(
+            f"{'subs':>5} {'sort':>6} {'merge ms':>9} {'queries':>8} "
+            f"{'cached ms':>10} {'IN ms':>8}"
+        )
+        for count in options["subscriptions"]:
+            community_ids = self._subscribe(count)
+            for sort in options["sorts"]:
+                walk = lambda: self._walk(community_ids, sort, options["pages"])  # noqa: E731
+                with override_settings(PERSONAL_FEED={"CACHE_MIN_SUBSCRIPTIONS": None}):
+                    merge = self._time(walk, options["repeat"])
+                    with CaptureQueriesContext(connection) as queries:
+                        walk()
+                with override_settings(PERSONAL_FEED={"CACHE_MIN_SUBSCRIPTIONS": 1}):
+                    caches[subscriptions.feed_settings()["ALIAS"]].clear()
+                    # The first walk fills the cache.
+                    walk()
+                    cached = self._time(walk, options["repeat"])
+                single = self._time(
+                    lambda: self._walk_single(community_ids, sort, options["pages"]),
+                    options["repeat"],
+                )
+                per_page = len(queries) / options["pages"]
+                self.stdout.write(
+                    f"{count:>5} {sort:>6} {merge:>9.2f} {per_page:>8.1f} "
+                    f"{cached:>10.2f} {single:>8.2f}"
+                )
+
+    def _subscribe(self, count):
+        user, _ = get_user_model().objects.get_or_create(username=f"bench-subs-{count}")
+        if Subscription.objects.filter(user=user).count() < count:
+            busiest = Community.objects.order_by("-stats__post_count", "pk")[:count]
+            for community in busiest:
+                subscriptions.subscribe(user, community)
+        return sorted(Subscription.objects.filter(user=user).values_list("community_id", flat=True))
+
+    def _walk(self, community_ids, sort, pages):
+        cursor = None
+        for _ in range(pages):
+            _, cursor = subscriptions.personal_page(community_ids, sort, "all", cursor)
+            if cursor is None:
+                break
+
+    def _walk_single(self, community_ids, sort, pages):
+        queryset = Post.objects.select_related("community", "author").filter(
+            community_id__in=community_ids
+        )
+        queryset = feeds.sort_posts(queryset, sort, "all")
+        cursor = None
+        for _ in range(pages):
+            _, cursor = feeds.paginate(queryset, sort, cursor)
+            if cursor is None:
+                break
+
+    def _time(self, fn, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples)
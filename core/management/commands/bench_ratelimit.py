@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import asyncio
+import tempfile
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from core.ratelimit import rate_limit
+
+
+POLICY = {"user": "1000000/m", "ip": "1000000/m"}
+
+
+def _view(request):
+    return HttpResponse()
+
+
+async def _async_view(request):
+    return HttpResponse()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure what a rate limit check adds to a request: a trivial sync and "
+        "async view are called --requests times with and without @rate_limit, "
+        "spread over --clients users and addresses, with the counters in "
+        "local memory and in a file-based cache. Limits are set high enough "
+        "that every request passes. Also counts the SQL queries the checks run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=5000)
+        parser.add_argument("--clients", type=int, default=500)
+
+    def handle(self, *args, **options):
+        requests = self._requests(options["requests"], options["clients"])
+        limited, alimited = rate_limit("bench")(_view), rate_limit("bench")(_async_view)
+
+        self.stdout.write(
+            f"{'store':>8} {'view':>6} {'bare us':>8} {'limited us':>11} "
+            f"{'overhead us':>12} {'queries':>8}"
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            stores = {
+                "locmem": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+                "file": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": directory,
+                    "OPTIONS": {"MAX_ENTRIES": 10 * options["clients"]},
+                },
+            }
+            for name, store in stores.items():
+                with override_settings(
+                    CACHES={"default": store},
+                    RATE_LIMITS={"ENABLED": True, "POLICIES": {"bench": POLICY}},
+                ):
+                    caches["default"].clear()
+                    for kind, bare, view, run in (
+                        ("sync", _view, limited, self._run),
+                        ("async", _async_view, alimited, self._arun),
+                    ):
+                        bare_us = run(bare, requests)
+                        with CaptureQueriesContext(connection) as queries:
+                            limited_us = run(view, requests)
+                        self.stdout.write(
+                            f"{name:>8} {kind:>6} {bare_us:>8.2f} {limited_us:>11.2f} "
+                            f"{limited_us - bare_us:>12.2f} {len(queries):>8}"
+                        )
+
+    def _requests(self, count, clients):
+        factory = RequestFactory()
+        users = [get_user_model()(pk=i + 1, username=f"bench-{i}") for i in range(clients)]
+        requests = []
+        for i in range(count):
+            user = users[i % clients]
+            request = factory.post("/", REMOTE_ADDR=f"10.0.{i % clients // 256}.{i % 256}")
+            request.user = user
+
+            async def auser(user=user):
+                return user
+
+            request.auser = auser
+            requests.append(request)
+        return requests
+
+    def _run(self, view, requests):
+        start = time.perf_counter()
+        for request in requests:
+            view(request)
+        return (time.perf_counter() - start) * 1e6 / len(requests)
+
+    def _arun(self, view, requests):
+        async def run():
+            start = time.perf_counter()
+            for request in requests:
+                await view(request)
+            return (time.perf_counter() - start) * 1e6 / len(requests)
+
+        return asyncio.run(run())
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.utils import timezone
+
+from config.templates import PROFILES, django_templates
+from core import feedcache
+from core.instrumentation import TimedDjangoTemplates
+from core.models import Comment, Community, Post
+
+
+class Command(BaseCommand):
+    help = (
+        "Time rendering feed and comment rows, without the database: a feed "
+        "page as the feed cache renders it (placeholders filled afterwards), "
+        "as rendered for one viewer (the personalized feed), and a list of "
+        "comments, for each --rows count and template profile."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, nargs="+", default=[50, 500])
+        parser.add_argument(
+            "--profiles", nargs="+", choices=list(PROFILES), default=list(PROFILES)
+        )
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        template = settings.TEMPLATES[0]
+        request = RequestFactory().get("/")
+        self.stdout.write(
+            f"{'profile':>12} {'rows':>5} {'cached ms':>10} {'viewer ms':>10} "
+            f"{'comments ms':>12}"
+        )
+        for profile in options["profiles"]:
+            params = django_templates(
+                template["BACKEND"],
+                template["DIRS"],
+                profile,
+                context_processors=template["OPTIONS"]["context_processors"],
+            )
+            del params["BACKEND"]
+            engine = TimedDjangoTemplates({"NAME": f"bench-{profile}", **params})
+            feed_page = engine.get_template("core/_feed_page.html")
+            comment_list = engine.get_template("core/_comment_list.html")
+            for rows in options["rows"]:
+                posts, comments = self._rows(rows)
+                votes = {("post", post.pk): 1 for post in posts[::3]}
+                votes.update({("comment", comment.pk): -1 for comment in comments[::3]})
+                values = {post.pk: (post.score, post.comment_count) for post in posts}
+                feed = {"posts": posts, "next_cursor": "x", "sort": "new", "period": None}
+
+                def cached():
+                    html = feed_page.render({**feed, "placeholders": True}, request)
+                    feedcache._fill_placeholders(html, values, votes)
+
+                timings = [
+                    self._time(cached, options["repeat"]),
+                    self._time(
+                        lambda: feed_page.render({**feed, "votes": votes}, request),
+                        options["repeat"],
+                    ),
+                    self._time(
+                        lambda: comment_list.render(
+                            {"comments": comments, "votes": votes, "can_comment": True}, request
+                        ),
+                        options["repeat"],
+                    ),
+                ]
+                self.stdout.write(
+                    f"{profile:>12} {rows:>5} {timings[0]:>10.2f} {timings[1]:>10.2f} "
+                    f"{timings[2]:>12.2f}"
+                )
+
+    def _rows(self, count):
+        now = timezone.now()
+        author = get_user_model()(pk=1, username="bench")
+        community = Community(pk=1, name="bench", title="Bench")
+        posts = [
+            Post(
+                pk=i + 1,
+                community=community,
+                author=author,
+                post_type="text",
+                title=f"Post number {i}",
+                score=i % 50,
+                comment_count=i % 7,
+                created_at=now,
+            )
+            for i in range(count)
+        ]
+        comments = []
+        for i in range(count):
+            comment = Comment(
+                pk=i + 1, post=posts[0], author=author, body=f"Comment {i}", score=i % 9
+            )
+            comment.created_at = now
+            comment.children, comment.more_replies = [], 0
+            comments.append(comment)
+        return posts, comments
+
+    def _time(self, fn, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples)
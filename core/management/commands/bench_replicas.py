@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, router
+
+from config.sqlite import copy_database, sqlite_database
+from core import search, threads
+from core.feeds import paginate, sort_posts
+from core.models import Post
+from core.routers import ReplicaRouter
+from core.votes import cast_vote
+
+from .stress_sqlite import POST_SAMPLE, USER_SAMPLE
+
+
+SEARCH_TERMS = ["python", "django", "release", "question", "help", "news"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure how read throughput scales as read replicas are added. For "
+        "each replica count the database is copied to a primary and that "
+        "many replicas; --workers processes then read feed pages, post pages "
+        "and search results through ReplicaRouter while --writers processes "
+        "vote on the primary. With 0 replicas every read goes to the primary."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--replicas", nargs="+", type=int, default=[0, 1, 2, 4])
+        parser.add_argument("--workers", type=int, default=8, help="Reading processes.")
+        parser.add_argument("--writers", type=int, default=1, help="Voting processes.")
+        parser.add_argument("--seconds", type=float, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        source = connections[DEFAULT_DB_ALIAS].settings_dict
+        if source["ENGINE"] != "django.db.backends.sqlite3":
+            raise CommandError("bench_replicas copies SQLite files; it only runs against SQLite.")
+        posts = list(Post.objects.order_by("-pk").values_list("pk", flat=True)[:POST_SAMPLE])
+        users = list(get_user_model().objects.values_list("pk", flat=True)[:USER_SAMPLE])
+        if not (posts and users):
+            raise CommandError("Nothing to read; run seed_demo first.")
+        profile = settings.SQLITE_PROFILE
+        seconds, seed = options["seconds"], options["seed"]
+
+        with tempfile.TemporaryDirectory() as directory:
+            for count in options["replicas"]:
+                primary = Path(directory) / "primary.sqlite3"
+                replicas = [Path(directory) / f"replica_{i}.sqlite3" for i in range(count)]
+                for path in [primary, *replicas]:
+                    copy_database(source["NAME"], path, profile)
+                # Forked workers must open their own connections.
+                connections.close_all()
+                with ProcessPoolExecutor(
+                    options["workers"] + options["writers"],
+                    initializer=_init_worker,
+                    initargs=(profile, primary, replicas),
+                ) as pool:
+                    reads = [
+                        pool.submit(_read, seconds, seed + i, posts)
+                        for i in range(options["workers"])
+                    ]
+                    writes = [
+                        pool.submit(_write, seconds, seed - i - 1, posts, users)
+                        for i in range(options["writers"])
+                    ]
+                    self._report(
+                        count,
+                        [future.result() for future in reads],
+                        [future.result() for future in writes],
+                        seconds,
+                    )
+
+    def _report(self, count, reads, writes, seconds):
+        latencies = sorted(ms for result in reads for ms in result)
+        p50 = p99 = 0.0
+        if len(latencies) > 1:
+            cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+            p50, p99 = cuts[49], cuts[98]
+        self.stdout.write(
+            f"{count:>2} replicas: {len(latencies) / seconds:8.1f} reads/s"
+            f"  read p50 {p50:.1f} ms  p99 {p99:.1f} ms"
+            f"  {sum(writes) / seconds:8.1f} writes/s"
+        )
+
+
+def _init_worker(profile, primary, replicas):
+    django.setup()
+    default = connections.settings[DEFAULT_DB_ALIAS]
+    database = sqlite_database(primary, profile)
+    for key in ("NAME", "CONN_MAX_AGE", "CONN_HEALTH_CHECKS", "OPTIONS"):
+        default[key] = database[key]
+    aliases = []
+    for i, path in enumerate(replicas):
+        alias = f"replica_{i}"
+        connections.settings[alias] = {
+            **default,
+            **sqlite_database(path, profile, read_only=True),
+        }
+        aliases.append(alias)
+    settings.REPLICATION = {**getattr(settings, "REPLICATION", {}), "REPLICAS": aliases}
+    router.routers = [ReplicaRouter()]
+
+
+def _read(seconds, seed, posts):
+    """Make reads until ``seconds`` have passed; return their latencies in ms."""
+
+    rng = random.Random(seed)
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while (start := time.perf_counter()) < deadline:
+        kind = rng.random()
+        if kind < 0.5:
+            sort = rng.choice(["hot", "new", "top"])
+            paginate(sort_posts(Post.objects.select_related("community", "author"), sort), sort)
+        elif kind < 0.8:
+            post = Post.objects.select_related("community", "author").get(pk=rng.choice(posts))
+            threads.load_page(post)
+        else:
+            search.search_posts(rng.choice(SEARCH_TERMS))
+        latencies.append((time.perf_counter() - start) * 1000)
+        # The end of a request.
+        close_old_connections()
+    connections.close_all()
+    return latencies
+
+
+def _write(seconds, seed, posts, users):
+    """Vote until ``seconds`` have passed; return the number of votes."""
+
+    rng = random.Random(seed)
+    user_model = get_user_model()
+    votes = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        cast_vote(user_model(pk=rng.choice(users)), "post", rng.choice(posts), rng.choice([1, -1]))
+        votes += 1
+        close_old_connections()
+    connections.close_all()
+    return votes
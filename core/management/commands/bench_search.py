@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import itertools
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from core.models import Community, Post
+from core.search import search_posts
+
+
+SYLLABLES = ["ka", "lo", "mi", "re", "tu", "zen", "bar", "qui", "sol", "vex", "dra", "pon"]
+# 12**4 = 20736 distinct words; drawn with Zipfian (1/rank) frequencies.
+VOCABULARY = ["".join(parts) for parts in itertools.product(SYLLABLES, repeat=4)]
+WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+
+
+class Command(BaseCommand):
+    help = "Compare FTS5 search against LIKE '%%q%%' scans. Seeds bench-search on first run."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=1_000_000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--queries",
+            nargs="+",
+            help="Defaults to words of decreasing frequency and one two-word query.",
+        )
+
+    def handle(self, *args, **options):
+        community = self._seed(options["posts"], options["batch_size"], options["seed"])
+
+        self.stdout.write(f"{'query':>20} {'fts ms':>10} {'like ms':>10} {'hits':>6}")
+        queries = options["queries"] or [
+            VOCABULARY[10],
+            VOCABULARY[1000],
+            VOCABULARY[15000],
+            f"{VOCABULARY[5]} {VOCABULARY[500]}",
+        ]
+        for query in queries:
+            terms = query.split()
+
+            def like():
+                condition = Q()
+                for term in terms:
+                    condition &= Q(title__icontains=term) | Q(body__icontains=term)
+                return list(
+                    Post.objects.filter(condition, community=community)
+                    .order_by("-created_at")
+                    .values_list("pk", flat=True)[:50]
+                )
+
+            fts = self._time(lambda: search_posts(query, community), options["repeat"])
+            scan = self._time(like, options["repeat"])
+            hits = len(search_posts(query, community))
+            self.stdout.write(f"{query:>20} {fts:>10.2f} {scan:>10.2f} {hits:>6}")
+
+    def _time(self, fn, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples)
+
+    def _seed(self, total, batch_size, seed):
+        rng = random.Random(seed)
+        User = get_user_model()
+        author, _ = User.objects.get_or_create(username="bench-search")
+        community, _ = Community.objects.get_or_create(
+            name="bench-search", defaults={"title": "Search benchmark"}
+        )
+
+        cumulative = list(itertools.accumulate(WEIGHTS))
+
+        def words(count):
+            return " ".join(rng.choices(VOCABULARY, cum_weights=cumulative, k=count))
+
+        existing = community.posts.count()
+        for start in range(existing, total, batch_size):
+            with transaction.atomic():
+                Post.objects.bulk_create(
+                    Post(
+                        community=community,
+                        author=author,
+                        post_type="text",
+                        title=words(6),
+                        body=words(40),
+                    )
+                    for _ in range(start, min(start + batch_size, total))
+                )
+        return community
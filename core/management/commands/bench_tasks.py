@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import os
+import random
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test.utils import override_settings
+
+from core import tasks
+from core.models import Job
+
+from .bench_endpoints import WRITE_SCENARIOS, ClientTransport, Command as EndpointsCommand
+
+
+class Command(EndpointsCommand):
+    help = (
+        "Compare the latency of the write endpoints (submit_post, add_comment, "
+        "vote_post) with their side effects run inline and queued as "
+        "background tasks, through the Django test client against the current "
+        "(seeded) database, then time run_tasks draining the queued jobs. "
+        "Rate limits are off for the run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=300, help="Per scenario.")
+        parser.add_argument(
+            "--warmup", type=int, default=10, help="Untimed requests per scenario."
+        )
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--processes", type=int, default=os.cpu_count())
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        targets = self._targets(options["concurrency"])
+        transport = ClientTransport()
+        timing = {**getattr(settings, "INSTRUMENTATION", {}), "SERVER_TIMING": True}
+        # Whatever an earlier run left queued must not be counted.
+        call_command("run_tasks", once=True, processes=0, stdout=StringIO())
+        for index, (mode, eager) in enumerate((("inline", True), ("queued", False))):
+            self.stdout.write(f"Side effects {mode}:")
+            # Fresh targets: repeating the first run's votes would change nothing.
+            rng = random.Random(options["seed"] + index)
+            with override_settings(
+                TASKS={**tasks.task_settings(), "EAGER": eager},
+                RATE_LIMITS={"ENABLED": False},
+                INSTRUMENTATION=timing,
+            ):
+                for name in sorted(WRITE_SCENARIOS):
+                    build = getattr(self, f"_{name}")
+                    warmup = [build(rng, targets) for _ in range(options["warmup"])]
+                    self._run(transport, warmup, 1, targets["users"])
+                    requests = [build(rng, targets) for _ in range(options["requests"])]
+                    result = self._run(
+                        transport, requests, options["concurrency"], targets["users"]
+                    )
+                    self._report(name, result)
+                if not eager:
+                    queued = Job.objects.count()
+                    start = time.perf_counter()
+                    call_command(
+                        "run_tasks",
+                        once=True,
+                        processes=options["processes"],
+                        stdout=StringIO(),
+                    )
+                    self.stdout.write(
+                        f"Drained {queued} jobs in {time.perf_counter() - start:.2f} s "
+                        f"with {options['processes']} processes."
+                    )
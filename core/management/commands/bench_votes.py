@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.models import Community, Post, Vote
+from core.votebuffer import VoteBuffer
+from core.votes import cast_vote
+
+
+class Command(BaseCommand):
+    help = "Compare votes/sec of the direct vote path against the write-behind buffer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--voters", type=int, default=2000)
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--flush-interval-ms", type=int, default=250)
+        parser.add_argument("--max-pending", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        voters = options["voters"]
+
+        community, _ = Community.objects.get_or_create(
+            name="bench-votes", defaults={"title": "Vote benchmark"}
+        )
+        User.objects.bulk_create(
+            [User(username=f"bench-voter-{i}") for i in range(voters)],
+            ignore_conflicts=True,
+        )
+        users = list(User.objects.filter(username__startswith="bench-voter-")[:voters])
+        author = users[0]
+
+        def run(label, vote):
+            post = Post.objects.create(
+                community=community, author=author, post_type="text", title=label
+            )
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(
+                max_workers=options["threads"], initializer=connections.close_all
+            ) as pool:
+                list(pool.map(lambda user: vote(user, post.pk), users))
+            return post, time.perf_counter() - start
+
+        direct_post, direct = run("direct", lambda user, pk: cast_vote(user, "post", pk, 1))
+
+        buffer = VoteBuffer(options["flush_interval_ms"], options["max_pending"])
+        buffered_post, buffered = run(
+            "buffered", lambda user, pk: buffer.add(user.pk, "post", pk, 1)
+        )
+        start = time.perf_counter()
+        buffer.stop()
+        drain = time.perf_counter() - start
+
+        for label, post, elapsed in (
+            ("direct", direct_post, direct),
+            ("buffered", buffered_post, buffered),
+        ):
+            post.refresh_from_db()
+            self.stdout.write(
+                f"{label:>8}: {voters / elapsed:10.0f} votes/s "
+                f"({elapsed:.3f}s, final score {post.score})"
+            )
+        self.stdout.write(f"   drain: {drain:.3f}s to flush the remaining buffer")
+
+        Vote.objects.filter(
+            target_type="post", target_id__in=[direct_post.pk, buffered_post.pk]
+        ).delete()
+        community.delete()
+        User.objects.filter(username__startswith="bench-voter-").delete()
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import moderation
+from core.models import Community
+
+from .remove_content import _reporter
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete a community with all its posts, comments, votes, subscriptions "
+        "and statistics, in chunks of short transactions (see core.moderation)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("name", help="Community name.")
+        parser.add_argument("--chunk-size", type=int, help="Rows per transaction.")
+        parser.add_argument(
+            "--noinput",
+            "--no-input",
+            action="store_false",
+            dest="interactive",
+            help="Do not ask for confirmation.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            community = Community.objects.get(name=options["name"])
+        except Community.DoesNotExist:
+            raise CommandError(f"No community named {options['name']!r}.")
+        if options["interactive"]:
+            answer = input(f"Delete {community} and everything in it? Type 'yes' to continue: ")
+            if answer != "yes":
+                raise CommandError("Purge cancelled.")
+        tally = moderation.purge_community(
+            community, options["chunk_size"], _reporter(self, options["verbosity"])
+        )
+        self.stdout.write(self.style.SUCCESS(f"Purged {community}: {tally}."))
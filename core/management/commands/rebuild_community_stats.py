@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+
+from core import communitystats
+from core.models import (
+    Comment,
+    Community,
+    CommunityActiveUser,
+    CommunityActivity,
+    CommunityStats,
+    Job,
+    Post,
+    Subscription,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute CommunityStats and the hourly activity buckets of the "
+        "current window from the Post, Comment and Subscription tables, then "
+        "prune the buckets that have left the window. Pending background jobs "
+        "adding posts or comments to the rebuilt communities are dropped, as "
+        "the rebuild counts them. Active voters cannot be recomputed (votes "
+        "have no timestamp) and are kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=50,
+            help="Number of communities recomputed per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        since = communitystats.window_start()
+        last_pk = 0
+        communities = 0
+
+        while True:
+            # One short transaction per chunk, so that the counts written
+            # match the rows they were computed from.
+            with transaction.atomic():
+                ids = list(
+                    Community.objects.filter(pk__gt=last_pk)
+                    .order_by("pk")
+                    .values_list("pk", flat=True)[:chunk_size]
+                )
+                if not ids:
+                    break
+                last_pk = ids[-1]
+                self._rebuild(ids, since)
+
+            communities += len(ids)
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Rebuilt up to community {last_pk} ({communities} communities)")
+
+        pruned = communitystats.prune()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt stats for {communities} communities, pruned {pruned} old bucket rows."
+            )
+        )
+
+    def _rebuild(self, ids, since):
+        # Queued posts and comments are already in the tables counted
+        # below; applied later, they would count twice. Events that only
+        # mark a voter active are not recomputed here and stay queued.
+        Job.objects.filter(
+            task="core.communitystats.record_activity",
+            status=Job.PENDING,
+            args__community__in=ids,
+        ).exclude(args__posts=0, args__comments=0).delete()
+
+        posts = Post.objects.filter(community_id__in=ids)
+        comments = Comment.objects.filter(post__community_id__in=ids)
+        post_counts = _counts(posts, "community_id")
+        comment_counts = _counts(comments, "post__community_id")
+        subscriber_counts = _counts(
+            Subscription.objects.filter(community_id__in=ids), "community_id"
+        )
+        CommunityStats.objects.bulk_create(
+            [
+                CommunityStats(
+                    community_id=pk,
+                    post_count=post_counts.get(pk, 0),
+                    comment_count=comment_counts.get(pk, 0),
+                    subscriber_count=subscriber_counts.get(pk, 0),
+                )
+                for pk in ids
+            ],
+            update_conflicts=True,
+            unique_fields=["community"],
+            update_fields=["post_count", "comment_count", "subscriber_count"],
+        )
+
+        hour = TruncHour("created_at", tzinfo=dt_timezone.utc)
+        recent_posts = posts.filter(created_at__gte=since).annotate(hour=hour)
+        recent_comments = comments.filter(created_at__gte=since).annotate(hour=hour)
+        buckets = defaultdict(lambda: CommunityActivity(posts=0, comments=0))
+        for key, count in _counts(recent_posts, "community_id", "hour").items():
+            buckets[key].posts = count
+        for key, count in _counts(recent_comments, "post__community_id", "hour").items():
+            buckets[key].comments = count
+        for (community_id, bucket_hour), bucket in buckets.items():
+            bucket.community_id, bucket.hour = community_id, bucket_hour
+        CommunityActivity.objects.filter(community_id__in=ids, hour__gte=since).delete()
+        CommunityActivity.objects.bulk_create(buckets.values(), batch_size=500)
+
+        active = set(recent_posts.values_list("community_id", "hour", "author_id"))
+        active.update(recent_comments.values_list("post__community_id", "hour", "author_id"))
+        CommunityActiveUser.objects.bulk_create(
+            [
+                CommunityActiveUser(community_id=community_id, hour=bucket_hour, user_id=user_id)
+                for community_id, bucket_hour, user_id in active
+            ],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+
+
+def _counts(queryset, *fields):
+    """Return ``{group: count}`` for ``queryset`` grouped by ``fields``."""
+
+    rows = queryset.values_list(*fields).annotate(count=Count("pk")).order_by()
+    if len(fields) == 1:
+        return {row[0]: row[1] for row in rows}
+    return {row[:-1]: row[-1] for row in rows}
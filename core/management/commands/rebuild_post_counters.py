@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max
+
+from core.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = "Recompute Post.comment_count and Post.last_comment_at from the Comment table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of posts recomputed per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        last_pk = 0
+        scanned = repaired = 0
+
+        while True:
+            # Read and repair each chunk in one short transaction so comments
+            # added meanwhile are not overwritten by stale counts.
+            with transaction.atomic():
+                posts = list(
+                    Post.objects.filter(pk__gt=last_pk)
+                    .order_by("pk")
+                    .only("pk", "comment_count", "last_comment_at")[:chunk_size]
+                )
+                if not posts:
+                    break
+                last_pk = posts[-1].pk
+
+                stats = {
+                    row["post_id"]: row
+                    for row in Comment.objects.filter(
+                        post_id__gte=posts[0].pk, post_id__lte=last_pk
+                    )
+                    .values("post_id")
+                    .annotate(count=Count("id"), latest=Max("created_at"))
+                    .order_by()
+                }
+                drifted = []
+                for post in posts:
+                    row = stats.get(post.pk, {"count": 0, "latest": None})
+                    current = (post.comment_count, post.last_comment_at)
+                    if current != (row["count"], row["latest"]):
+                        post.comment_count = row["count"]
+                        post.last_comment_at = row["latest"]
+                        drifted.append(post)
+                Post.objects.bulk_update(drifted, ["comment_count", "last_comment_at"])
+
+            scanned += len(posts)
+            repaired += len(drifted)
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Scanned up to post {last_pk} ({scanned} posts)")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Scanned {scanned} posts, repaired {repaired}.")
+        )
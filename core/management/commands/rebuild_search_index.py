@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core.search import FTS_TABLES, fts_available
+
+
+class Command(BaseCommand):
+    help = "Rebuild the SQLite FTS5 search indexes from the post and comment tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="Rows indexed per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError("Full-text indexes are only maintained on SQLite.")
+        chunk_size = options["chunk_size"]
+
+        for fts, (table, columns) in FTS_TABLES.items():
+            cols = ", ".join(columns)
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('delete-all')")
+
+            last_id = indexed = 0
+            while True:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute(
+                        f"SELECT MAX(id), COUNT(*) FROM (SELECT id FROM {table} "
+                        f"WHERE id > %s ORDER BY id LIMIT %s)",
+                        [last_id, chunk_size],
+                    )
+                    upper, count = cursor.fetchone()
+                    if not count:
+                        break
+                    cursor.execute(
+                        f"INSERT INTO {fts}(rowid, {cols}) SELECT id, {cols} FROM {table} "
+                        f"WHERE id > %s AND id <= %s",
+                        [last_id, upper],
+                    )
+                last_id = upper
+                indexed += count
+                if options["verbosity"] > 1:
+                    self.stdout.write(f"{fts}: indexed {indexed} rows")
+
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('optimize')")
+            self.stdout.write(self.style.SUCCESS(f"{fts}: indexed {indexed} rows."))
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import moderation
+from core.models import Comment, Post
+
+
+# Seconds between progress lines, unless every chunk is reported (-v 2).
+PROGRESS_INTERVAL = 5
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete posts or comments, with their comments, replies and votes, in "
+        "chunks of short transactions (see core.moderation). Select them with "
+        "--community, --user and --older-than; at least one is required."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=["posts", "comments"])
+        parser.add_argument("--community", help="Community name.")
+        parser.add_argument("--user", help="Author's username.")
+        parser.add_argument("--older-than", type=float, metavar="DAYS")
+        parser.add_argument("--chunk-size", type=int, help="Rows per transaction.")
+
+    def handle(self, *args, **options):
+        filters = {}
+        prefix = "" if options["kind"] == "posts" else "post__"
+        if options["community"]:
+            filters[f"{prefix}community__name"] = options["community"]
+        if options["user"]:
+            filters["author__username"] = options["user"]
+        if options["older_than"] is not None:
+            filters["created_at__lt"] = timezone.now() - timedelta(days=options["older_than"])
+        if not filters:
+            raise CommandError("Select what to remove with --community, --user or --older-than.")
+
+        progress = _reporter(self, options["verbosity"])
+        if options["kind"] == "posts":
+            tally = moderation.remove_posts(
+                Post.objects.filter(**filters), options["chunk_size"], progress
+            )
+        else:
+            tally = moderation.remove_comments(
+                Comment.objects.filter(**filters), options["chunk_size"], progress
+            )
+        self.stdout.write(self.style.SUCCESS(f"Removed {tally}."))
+
+
+def _reporter(command, verbosity):
+    """Return a progress callback writing to ``command``'s output."""
+
+    last = time.perf_counter()
+
+    def report(tally):
+        nonlocal last
+        now = time.perf_counter()
+        if verbosity > 1 or (verbosity and now - last >= PROGRESS_INTERVAL):
+            command.stdout.write(f"... {tally}")
+            last = now
+
+    return report
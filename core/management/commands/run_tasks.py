@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import tasks
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background tasks (see core.tasks): claim up to "
+        "--batch-size due jobs, run each task's jobs as one batch in a pool "
+        "of --processes workers, retry or give up the failures, and repeat, "
+        "waiting POLL_INTERVAL seconds whenever nothing is due. With --once, "
+        "stop as soon as nothing is due. --processes 0 runs the batches in "
+        "this process."
+    )
+
+    def add_arguments(self, parser):
+        config = tasks.task_settings()
+        parser.add_argument("--processes", type=int, default=os.cpu_count())
+        parser.add_argument("--batch-size", type=int, default=config["BATCH_SIZE"])
+        parser.add_argument("--once", action="store_true")
+
+    def handle(self, *args, **options):
+        pool = None
+        if options["processes"]:
+            pool = ProcessPoolExecutor(options["processes"])
+        ran = failed = 0
+        try:
+            while True:
+                batches = tasks.claim(options["batch_size"])
+                if not batches:
+                    if options["once"]:
+                        break
+                    time.sleep(tasks.task_settings()["POLL_INTERVAL"])
+                    continue
+                if pool is not None:
+                    # Forked workers must open their own connections.
+                    connections.close_all()
+                    results = pool.map(tasks.run_batch, batches.keys(), batches.values())
+                else:
+                    results = map(tasks.run_batch, batches.keys(), batches.values())
+                failures = [failure for result in results for failure in result]
+                tasks.fail(failures)
+                ran += sum(len(jobs) for jobs in batches.values())
+                failed += len(failures)
+                if options["verbosity"] > 1:
+                    self.stdout.write(f"Ran {len(batches)} batches, {len(failures)} failures.")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.stdout.write(f"Ran {ran} jobs, {failed} failed.")
@@ -1,76 +1,408 @@
 from __future__ import annotations
 
+import itertools
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import lru_cache
+
+import django
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
-from core.models import Community, Post
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core import feedcache, httpcache, ranking, threads
+from core.models import Comment, Community, Post, Vote
+
+
+DEMO_PASSWORD = "pass12345!"
+DEMO_USERS = [("alice", "alice@example.com"), ("bob", "bob@example.com")]
+
+SYLLABLES = ["ka", "lo", "mi", "re", "tu", "zen", "bar", "qui", "sol", "vex", "dra", "pon"]
+VOCABULARY = ["".join(parts) for parts in itertools.product(SYLLABLES, repeat=3)]
+
+# Popularity rank r belongs to row index (r + 1) * STRIDE % n, a cheap
+# permutation (STRIDE is prime) that spreads popular rows over the table
+# instead of making the oldest ones the most popular.
+STRIDE = 2_654_435_761
+
+LINK_RATIO = 0.2
+REPLY_RATIO = 0.6
+COMMENT_VOTE_RATIO = 0.3
+UPVOTE_RATIO = 0.75
+# Mean delay between a post (or comment) and a reply to it.
+REPLY_DELAY_SECONDS = 6 * 3600
+
+WORKER_LOCK_TIMEOUT = 600
 
 
 class Command(BaseCommand):
-    help = "Seed the database with demo users, communities, and posts."
+    help = (
+        "Generate a synthetic dataset with bulk inserts: users, communities, "
+        "posts, threaded comments and votes, with Zipfian popularity. The same "
+        "--seed always produces the same rows, whatever the number of workers. "
+        "New ids continue from the current maximum, so it can be run again to "
+        "grow the dataset. Also creates the alice and bob demo logins."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--communities", type=int, default=50)
+        parser.add_argument("--posts", type=int, default=20_000)
+        parser.add_argument("--comments", type=int, default=100_000)
+        parser.add_argument("--votes", type=int, default=200_000)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Rows per transaction; for posts, posts with their comments and votes.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=30,
+            help="Posts are spread evenly over this many days up to now.",
+        )
+        parser.add_argument(
+            "--zipf",
+            type=float,
+            default=1.1,
+            help="Exponent of the popularity distributions (higher is more skewed).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help=(
+                "Generate and insert batches in this many processes. On SQLite "
+                "the inserts themselves are serialized by the write lock."
+            ),
+        )
 
     def handle(self, *args, **options):
-        User = get_user_model()
+        started = time.perf_counter()
+        self._demo_users()
+        spec = self._spec(options)
+        batch_size = options["batch_size"]
+        totals = {}
+        for phase in ("users", "communities", "posts"):
+            if phase == "posts":
+                batches = self._post_batches(spec, batch_size)
+            else:
+                batches = [
+                    (start, min(batch_size, spec[phase] - start))
+                    for start in range(0, spec[phase], batch_size)
+                ]
+            totals.update(self._run(phase, spec, batches, options["workers"]))
 
-        # Users
-        user_specs = [
-            ("alice", "alice@example.com"),
-            ("bob", "bob@example.com"),
-        ]
-        users = []
-        for username, email in user_specs:
+        # Bulk inserts send no signals, so invalidate the feeds explicitly.
+        community_ids = Community.objects.values_list("pk", flat=True)
+        feedcache.bump_feed_version(
+            feedcache.home_scope(), *(feedcache.community_scope(pk) for pk in community_ids)
+        )
+        httpcache.touch(
+            httpcache.home_scope(), *(httpcache.community_scope(pk) for pk in community_ids)
+        )
+        # Nor do they update the community statistics.
+        call_command("rebuild_community_stats", stdout=self.stdout)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {totals.get('users', 0)} users, "
+                f"{totals.get('communities', 0)} communities, {totals.get('posts', 0)} posts, "
+                f"{totals.get('comments', 0)} comments and {totals.get('votes', 0)} votes "
+                f"in {time.perf_counter() - started:.1f}s."
+            )
+        )
+
+    def _demo_users(self):
+        User = get_user_model()
+        for username, email in DEMO_USERS:
             user, created = User.objects.get_or_create(
                 username=username, defaults={"email": email}
             )
             if created:
+                user.set_password(DEMO_PASSWORD)
+                user.save()
                 self.stdout.write(f"Created user {username}")
-            user.set_password("pass12345!")
-            user.save()
-            users.append(user)
-
-        # Communities
-        community_specs = [
-            ("news", "News", "Latest news"),
-            ("pics", "Pics", "Photos and images"),
-            ("tech", "Tech", "Technology discussions"),
-        ]
-        communities = []
-        for name, title, description in community_specs:
-            community, created = Community.objects.get_or_create(
-                name=name,
-                defaults={"title": title, "description": description},
-            )
-            if created:
-                self.stdout.write(f"Created community {name}")
-            communities.append(community)
-
-        # Posts
-        post_types = [pt[0] for pt in Post.POST_TYPES]
-        posts = []
-        for i in range(30):
-            community = random.choice(communities)
-            author = random.choice(users)
-            post_type = random.choice(post_types)
-            title = f"Post {i + 1}"
-            body = ""
-            url = ""
-            if post_type == "text":
-                body = "Sample body"
-            elif post_type == "link":
-                url = f"https://example.com/{i + 1}"
-            post = Post.objects.create(
-                community=community,
-                author=author,
-                post_type=post_type,
-                title=title,
-                body=body,
-                url=url,
-                score=random.randint(0, 100),
-            )
-            posts.append(post)
 
-        self.stdout.write(
-            self.style.SUCCESS(
-                f"Created {len(users)} users, {len(communities)} communities, and {len(posts)} posts."
+    def _spec(self, options):
+        # Everything a batch needs to generate its rows on its own, in any
+        # process and in any order.
+        spec = {
+            "seed": options["seed"],
+            "zipf": options["zipf"],
+            "now": timezone.now(),
+            "days": options["days"],
+            "password": make_password(DEMO_PASSWORD),
+            "votes": options["votes"],
+        }
+        for name in ("users", "communities", "posts", "comments"):
+            model = _models()[name]
+            spec[name] = options[name]
+            spec[f"{name}_base"] = (model.objects.aggregate(Max("pk"))["pk__max"] or 0) + 1
+        if not (spec["users"] and spec["communities"]):
+            spec["posts"] = 0
+        if not spec["posts"]:
+            spec["comments"] = spec["votes"] = 0
+        return spec
+
+    def _post_batches(self, spec, batch_size):
+        # Comments and votes are shared out over the posts by popularity up
+        # front, so every batch knows how many it creates and which comment
+        # ids are its own.
+        comments = _allocate(spec["comments"], spec["posts"], spec["zipf"])
+        votes = _allocate(spec["votes"], spec["posts"], spec["zipf"])
+        batches = []
+        comment_offset = 0
+        for start in range(0, spec["posts"], batch_size):
+            end = min(start + batch_size, spec["posts"])
+            batch_comments = comments[start:end]
+            batches.append((start, end - start, comment_offset, batch_comments, votes[start:end]))
+            comment_offset += sum(batch_comments)
+        return batches
+
+    def _run(self, phase, spec, batches, workers):
+        totals = {}
+
+        def collect(counts):
+            for name, count in counts.items():
+                totals[name] = totals.get(name, 0) + count
+            self.stdout.write(f"Seeded {totals[phase]}/{spec[phase]} {phase}", ending="\r")
+
+        if workers > 1 and len(batches) > 1:
+            # Forked workers must open their own connections.
+            connections.close_all()
+            with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+                futures = [pool.submit(seed_batch, phase, spec, *batch) for batch in batches]
+                for future in as_completed(futures):
+                    collect(future.result())
+        else:
+            for batch in batches:
+                collect(seed_batch(phase, spec, *batch))
+        if batches:
+            self.stdout.write("")
+        return totals
+
+
+def _init_worker():
+    django.setup()
+    database = connections["default"].settings_dict
+    if database["ENGINE"] == "django.db.backends.sqlite3":
+        # Batches queue for the write lock. Taking it at BEGIN avoids the
+        # deadlock between deferred transactions, and the long timeout
+        # makes workers wait for it instead of failing after five seconds.
+        database["OPTIONS"] = {
+            **database.get("OPTIONS", {}),
+            "timeout": WORKER_LOCK_TIMEOUT,
+            "transaction_mode": "IMMEDIATE",
+        }
+
+
+def seed_batch(phase, spec, start, count, *args):
+    """Insert one batch of ``phase`` and return the number of rows per table.
+
+    Each batch draws from its own generator seeded with the phase and the
+    batch's position, so the result does not depend on how batches are
+    spread over worker processes.
+    """
+
+    rng = random.Random(f"{spec['seed']}:{phase}:{start}")
+    # Rows are generated before the transaction starts, so that workers
+    # only hold the write lock while inserting.
+    rows = GENERATORS[phase](spec, rng, start, count, *args)
+    with transaction.atomic(), _explicit_timestamps():
+        for name, objs in rows.items():
+            _models()[name].objects.bulk_create(objs)
+    return {name: len(objs) for name, objs in rows.items()}
+
+
+def _users(spec, rng, start, count):
+    User = get_user_model()
+    users = [
+        User(
+            pk=spec["users_base"] + i,
+            username=f"user{spec['users_base'] + i}",
+            email=f"user{spec['users_base'] + i}@example.com",
+            password=spec["password"],
+        )
+        for i in range(start, start + count)
+    ]
+    return {"users": users}
+
+
+def _communities(spec, rng, start, count):
+    communities = [
+        Community(
+            pk=spec["communities_base"] + i,
+            name=f"c{spec['communities_base'] + i}",
+            title=_words(rng, 2).title(),
+            description=_words(rng, 12),
+            created_at=spec["now"] - timedelta(days=spec["days"] + 1),
+        )
+        for i in range(start, start + count)
+    ]
+    return {"communities": communities}
+
+
+def _posts(spec, rng, start, count, comment_offset, comment_counts, vote_counts):
+    """Generate posts together with their comment threads and votes.
+
+    Scores, comment counters and ranks are computed here, so the rows are
+    consistent as inserted and need no rebuild afterwards.
+    """
+
+    span = timedelta(days=spec["days"])
+    communities = _popular(rng, spec, "communities", count)
+    authors = _popular(rng, spec, "users", count + sum(comment_counts))
+    posts, comments, votes = [], [], []
+    next_comment = spec["comments_base"] + comment_offset
+
+    for i in range(count):
+        pk = spec["posts_base"] + start + i
+        is_link = rng.random() < LINK_RATIO
+        post = Post(
+            pk=pk,
+            community_id=communities[i],
+            author_id=authors.pop(),
+            post_type="link" if is_link else "text",
+            title=_words(rng, rng.randint(3, 12)).capitalize(),
+            body="" if is_link else _words(rng, rng.randint(0, 80)),
+            url=f"https://example.com/{pk}" if is_link else "",
+            # Evenly spaced in id order, as ids grow with time.
+            created_at=spec["now"] - span + span * (start + i + 0.5) / spec["posts"],
+        )
+
+        thread = []
+        for _ in range(comment_counts[i]):
+            parent = None
+            if thread and rng.random() < REPLY_RATIO:
+                parent = rng.choice(thread)
+                while parent.depth >= threads.MAX_DEPTH:
+                    parent = parent.parent
+            after = parent.created_at if parent else post.created_at
+            delay = timedelta(seconds=rng.expovariate(1 / REPLY_DELAY_SECONDS))
+            comment = Comment(
+                pk=next_comment,
+                post_id=pk,
+                parent=parent,
+                author_id=authors.pop(),
+                body=_words(rng, rng.randint(3, 60)),
+                path=(parent.path if parent else "") + threads.encode_segment(next_comment),
+                depth=parent.depth + 1 if parent else 0,
+                created_at=min(spec["now"], after + delay),
             )
+            next_comment += 1
+            if parent is not None:
+                parent.reply_count += 1
+            thread.append(comment)
+
+        comment_votes = round(vote_counts[i] * COMMENT_VOTE_RATIO) if thread else 0
+        post.score = _vote(rng, spec, "post", post, vote_counts[i] - comment_votes, votes)
+        for comment, share in _split(rng, thread, comment_votes).items():
+            comment.score = _vote(rng, spec, "comment", comment, share, votes)
+
+        post.comment_count = len(thread)
+        post.last_comment_at = max((comment.created_at for comment in thread), default=None)
+        post.hot_rank = ranking.hot_rank(post.score, post.created_at)
+        post.rising_rank = ranking.rising_rank(
+            post.score, post.comment_count, post.created_at, spec["now"]
         )
+        posts.append(post)
+        comments.extend(thread)
+
+    return {"posts": posts, "comments": comments, "votes": votes}
+
+
+def _vote(rng, spec, target_type, target, count, votes):
+    """Append ``count`` votes by distinct users on ``target``; return the score."""
+
+    score = 0
+    base = spec["users_base"]
+    for user_id in rng.sample(range(base, base + spec["users"]), min(count, spec["users"])):
+        value = 1 if rng.random() < UPVOTE_RATIO else -1
+        votes.append(
+            Vote(user_id=user_id, target_type=target_type, target_id=target.pk, value=value)
+        )
+        score += value
+    return score
+
+
+def _split(rng, items, count):
+    """Share ``count`` out over ``items``, weighted towards the first ones."""
+
+    shares = {}
+    if items and count:
+        weights = _cumulative_weights(len(items), 1.0)
+        for item in rng.choices(items, cum_weights=weights, k=count):
+            shares[item] = shares.get(item, 0) + 1
+    return shares
+
+
+GENERATORS = {"users": _users, "communities": _communities, "posts": _posts}
+
+
+def _models():
+    return {
+        "users": get_user_model(),
+        "communities": Community,
+        "posts": Post,
+        "comments": Comment,
+        "votes": Vote,
+    }
+
+
+def _allocate(total, size, exponent):
+    """Share ``total`` out over ``size`` rows by Zipfian popularity.
+
+    Deterministic, and the shares add up to exactly ``total``.
+    """
+
+    weights = [0.0] * size
+    for rank in range(size):
+        weights[(rank + 1) * STRIDE % size] = 1 / (rank + 1) ** exponent
+    scale = total / sum(weights)
+    shares = []
+    previous = 0
+    for cumulative in itertools.accumulate(weights):
+        current = round(cumulative * scale)
+        shares.append(current - previous)
+        previous = current
+    return shares
+
+
+@lru_cache(maxsize=8)
+def _cumulative_weights(size, exponent):
+    return list(itertools.accumulate(1 / rank**exponent for rank in range(1, size + 1)))
+
+
+def _popular(rng, spec, name, count):
+    """Draw ``count`` ids of ``name`` rows with Zipfian popularity."""
+
+    size = spec[name]
+    ranks = rng.choices(range(size), cum_weights=_cumulative_weights(size, spec["zipf"]), k=count)
+    return [spec[f"{name}_base"] + (rank + 1) * STRIDE % size for rank in ranks]
+
+
+def _words(rng, count):
+    weights = _cumulative_weights(len(VOCABULARY), 1.0)
+    return " ".join(rng.choices(VOCABULARY, cum_weights=weights, k=count))
+
+
+@contextmanager
+def _explicit_timestamps():
+    # auto_now_add would overwrite the generated created_at values.
+    fields = [model._meta.get_field("created_at") for model in (Community, Post, Comment)]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connections, transaction
+
+from config.sqlite import PROFILES, copy_database, sqlite_database
+from core import ranking, threads
+from core.feeds import paginate, sort_posts
+from core.models import Post
+from core.votes import cast_vote
+
+
+# Ids the workers vote and comment on, newest first.
+POST_SAMPLE = 2000
+USER_SAMPLE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer a copy of the SQLite database with concurrent votes, comments "
+        "and feed reads from several processes, once per connection profile "
+        "(see config/sqlite.py), and report write throughput, lock errors "
+        "and latency. Each operation is one simulated request: it ends by "
+        "closing the connection unless the profile keeps it (CONN_MAX_AGE)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--seconds", type=float, default=10)
+        parser.add_argument(
+            "--read-ratio", type=float, default=0.5, help="Share of operations that are reads."
+        )
+        parser.add_argument(
+            "--profiles", nargs="+", choices=list(PROFILES), default=list(PROFILES)
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        source = connections["default"].settings_dict
+        if source["ENGINE"] != "django.db.backends.sqlite3":
+            raise CommandError("stress_sqlite only runs against SQLite.")
+        posts = list(Post.objects.order_by("-pk").values_list("pk", flat=True)[:POST_SAMPLE])
+        users = list(get_user_model().objects.values_list("pk", flat=True)[:USER_SAMPLE])
+        if not (posts and users):
+            raise CommandError("Nothing to write to; run seed_demo first.")
+
+        with tempfile.TemporaryDirectory() as directory:
+            for profile in options["profiles"]:
+                path = Path(directory) / f"{profile}.sqlite3"
+                copy_database(source["NAME"], path, profile)
+                # Forked workers must open their own connections.
+                connections.close_all()
+                work = [
+                    (options["seconds"], options["read_ratio"], options["seed"] + i, posts, users)
+                    for i in range(options["workers"])
+                ]
+                with ProcessPoolExecutor(
+                    options["workers"], initializer=_init_worker, initargs=(profile, path)
+                ) as pool:
+                    results = list(pool.map(_stress, *zip(*work)))
+                self._report(profile, results, options["seconds"])
+
+    def _report(self, profile, results, seconds):
+        writes = sum(result["writes"] for result in results)
+        reads = sum(result["reads"] for result in results)
+        locked = sum(result["locked"] for result in results)
+        latencies = sorted(ms for result in results for ms in result["write_ms"])
+        attempts = writes + locked
+        p50 = p99 = 0.0
+        if len(latencies) > 1:
+            cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+            p50, p99 = cuts[49], cuts[98]
+        self.stdout.write(
+            f"{profile:>12}: {writes / seconds:8.1f} writes/s  {reads / seconds:8.1f} reads/s"
+            f"  {locked} locked ({locked / attempts if attempts else 0:.1%} of writes)"
+            f"  write p50 {p50:.1f} ms  p99 {p99:.1f} ms"
+        )
+
+
+def _init_worker(profile, path):
+    django.setup()
+    database = sqlite_database(path, profile)
+    settings_dict = connections["default"].settings_dict
+    for key in ("NAME", "CONN_MAX_AGE", "CONN_HEALTH_CHECKS", "OPTIONS"):
+        settings_dict[key] = database[key]
+
+
+def _stress(seconds, read_ratio, seed, posts, users):
+    rng = random.Random(seed)
+    user_model = get_user_model()
+    result = {"writes": 0, "reads": 0, "locked": 0, "write_ms": []}
+    deadline = time.perf_counter() + seconds
+    while (start := time.perf_counter()) < deadline:
+        post = Post(pk=rng.choice(posts))
+        read = rng.random() < read_ratio
+        try:
+            if read:
+                queryset = Post.objects.select_related("community", "author")
+                paginate(sort_posts(queryset, "new"), "new")
+            elif rng.random() < 0.7:
+                cast_vote(user_model(pk=rng.choice(users)), "post", post.pk, rng.choice([1, -1]))
+            else:
+                # What add_comment does.
+                with transaction.atomic():
+                    threads.create_comment(post, user_model(pk=rng.choice(users)), "Stress")
+                    ranking.refresh_post_ranks([post.pk])
+        except OperationalError as exc:
+            if "locked" not in str(exc):
+                raise
+            result["locked"] += 1
+        else:
+            if read:
+                result["reads"] += 1
+            else:
+                result["writes"] += 1
+                result["write_ms"].append((time.perf_counter() - start) * 1000)
+        finally:
+            # The end of a request.
+            close_old_connections()
+    connections.close_all()
+    return result
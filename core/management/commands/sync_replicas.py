@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from config.sqlite import copy_database
+from core.routers import replication_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database over each read replica listed in "
+        "REPLICATION['REPLICAS'], as a stand-in for real replication when "
+        "testing ReplicaRouter locally. Run it again (or from cron) to "
+        "refresh the replicas; until then they lag behind the primary."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "aliases", nargs="*", help="Replicas to refresh (default: all of them)."
+        )
+
+    def handle(self, *args, **options):
+        replicas = replication_settings()["REPLICAS"]
+        aliases = options["aliases"] or replicas
+        unknown = sorted(set(aliases) - set(replicas))
+        if unknown:
+            raise CommandError(f"Not a configured replica: {', '.join(unknown)}")
+        if not aliases:
+            raise CommandError("No replicas are configured in REPLICATION['REPLICAS'].")
+        source = connections[DEFAULT_DB_ALIAS].settings_dict
+        for alias in [DEFAULT_DB_ALIAS, *aliases]:
+            if connections[alias].vendor != "sqlite":
+                raise CommandError(
+                    "sync_replicas only copies SQLite files; use the database's own replication."
+                )
+
+        for alias in aliases:
+            start = time.perf_counter()
+            connections[alias].close()
+            target = connections[alias].settings_dict["NAME"]
+            copy_database(source["NAME"], target, settings.SQLITE_PROFILE)
+            self.stdout.write(f"{alias}: copied in {time.perf_counter() - start:.2f}s")
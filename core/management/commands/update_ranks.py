@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Post
+from core.ranking import decay_rising_ranks, update_post_ranks
+
+
+class Command(BaseCommand):
+    help = (
+        "Decay rising ranks of recent posts. Run periodically (e.g. every few "
+        "minutes); pass --all to recompute every post's ranks after a backfill."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recompute hot and rising ranks for every post.",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        if not options["all"]:
+            changed = decay_rising_ranks(chunk_size)
+            self.stdout.write(self.style.SUCCESS(f"Updated rising rank of {changed} posts."))
+            return
+
+        last_pk = 0
+        scanned = changed = 0
+        while True:
+            with transaction.atomic():
+                posts = list(
+                    Post.objects.filter(pk__gt=last_pk)
+                    .order_by("pk")
+                    .only("score", "comment_count", "created_at", "hot_rank", "rising_rank")[
+                        :chunk_size
+                    ]
+                )
+                if not posts:
+                    break
+                last_pk = posts[-1].pk
+                changed += update_post_ranks(posts)
+            scanned += len(posts)
+        self.stdout.write(
+            self.style.SUCCESS(f"Scanned {scanned} posts, updated ranks of {changed}.")
+        )
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0003_post_comment_count_last_comment_at"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="hot_rank",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="rising_rank",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["-created_at"], name="core_post_created_84f629_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["community", "-hot_rank"], name="core_post_communi_365343_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["-hot_rank"], name="core_post_hot_ran_9b9d1e_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["community", "-rising_rank"], name="core_post_communi_910f3e_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["-rising_rank"], name="core_post_rising__ee60a1_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["community", "-score"], name="core_post_communi_c62045_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["-score"], name="core_post_score_d4c143_idx"),
+        ),
+    ]
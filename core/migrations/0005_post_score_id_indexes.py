@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0004_post_ranks"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="post",
+            name="core_post_communi_c62045_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="post",
+            name="core_post_score_d4c143_idx",
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["community", "-score", "-id"], name="core_post_communi_b0cd3b_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["-score", "-id"], name="core_post_score_871da1_idx"),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    """Existing comments are all top level: their path is their own id."""
+
+    Comment = apps.get_model("core", "Comment")
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+    def encode(pk):
+        out = ""
+        while pk:
+            pk, remainder = divmod(pk, 36)
+            out = digits[remainder] + out
+        return out.rjust(8, "0")
+
+    last_pk = 0
+    while True:
+        comments = list(Comment.objects.filter(pk__gt=last_pk).order_by("pk")[:1000])
+        if not comments:
+            break
+        for comment in comments:
+            comment.path = encode(comment.pk)
+        Comment.objects.bulk_update(comments, ["path"])
+        last_pk = comments[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0005_post_score_id_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="depth",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="parent",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="replies",
+                to="core.comment",
+            ),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="path",
+            field=models.CharField(default="", max_length=255),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="reply_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["post", "path"], name="core_commen_post_id_3e9299_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_comment_materialized_path"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["post", "depth", "created_at"],
+                name="core_commen_post_id_cac5b3_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,58 @@
+from django.db import migrations
+
+
+# (fts table, content table, indexed columns)
+FTS_TABLES = [
+    ("core_post_fts", "core_post", ["title", "body"]),
+    ("core_comment_fts", "core_comment", ["body"]),
+]
+
+
+def create_search_index(apps, schema_editor):
+    """Create SQLite FTS5 indexes kept in sync by triggers (SQLite only)."""
+
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for fts, table, columns in FTS_TABLES:
+        cols = ", ".join(columns)
+        new = ", ".join(f"new.{column}" for column in columns)
+        old = ", ".join(f"old.{column}" for column in columns)
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5({cols}, content='{table}', "
+            f"content_rowid='id', tokenize='porter unicode61')"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END"
+        )
+        # Only text edits touch the index; score and counter updates do not.
+        schema_editor.execute(
+            f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END"
+        )
+        schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for fts, _, _ in FTS_TABLES:
+        for suffix in ("ai", "ad", "au"):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {fts}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_comment_page_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
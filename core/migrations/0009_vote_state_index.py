@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_search_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="vote",
+            index=models.Index(
+                fields=["user", "target_type", "target_id", "value"],
+                name="core_vote_user_id_0d73b5_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['target_type', 'target_id'], name='core_vote_target__adef1a_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_vote_target_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageStamp',
+            fields=[
+                ('scope', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('stamp', models.BigIntegerField()),
+            ],
+        ),
+    ]
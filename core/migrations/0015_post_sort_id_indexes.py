@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0014_page_stamps"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="post",
+            name="core_post_communi_9f66d4_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="post",
+            name="core_post_created_84f629_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="post",
+            name="core_post_communi_365343_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="post",
+            name="core_post_hot_ran_9b9d1e_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="post",
+            name="core_post_communi_910f3e_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="post",
+            name="core_post_rising__ee60a1_idx",
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["community", "-created_at", "-id"], name="core_post_communi_935b52_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["-created_at", "-id"], name="core_post_created_1e8110_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["community", "-hot_rank", "-id"], name="core_post_communi_0cff97_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["-hot_rank", "-id"], name="core_post_hot_ran_69d78e_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["community", "-rising_rank", "-id"], name="core_post_communi_d7a6ad_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["-rising_rank", "-id"], name="core_post_rising__b4b03f_idx"),
+        ),
+    ]
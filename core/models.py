@@ -12,6 +12,20 @@ class Community(models.Model):
         return f"r/{self.name}"
 
 
+class Subscription(models.Model):
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="subscriptions"
+    )
+    community = models.ForeignKey(
+        Community, on_delete=models.CASCADE, related_name="subscriptions"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Also lists a user's communities from the index.
+        unique_together = ("user", "community")
+
+
 class Post(models.Model):
     community = models.ForeignKey(Community, on_delete=models.CASCADE, related_name="posts")
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -21,17 +35,51 @@ class Post(models.Model):
     url = models.URLField(blank=True)
     score = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized from Comment; kept current by core.counters and
+    # repaired with the rebuild_post_counters command.
+    comment_count = models.PositiveIntegerField(default=0)
+    last_comment_at = models.DateTimeField(null=True, blank=True)
+    # Precomputed sort keys, maintained by core.ranking.
+    hot_rank = models.FloatField(default=0)
+    rising_rank = models.FloatField(default=0)
 
     class Meta:
-        indexes = [models.Index(fields=["community", "-created_at"])]
+        indexes = [
+            # Every sort breaks ties by id, so the id is part of each key
+            # and the whole ORDER BY is read from the index.
+            models.Index(fields=["community", "-created_at", "-id"]),
+            models.Index(fields=["-created_at", "-id"]),
+            models.Index(fields=["community", "-hot_rank", "-id"]),
+            models.Index(fields=["-hot_rank", "-id"]),
+            models.Index(fields=["community", "-rising_rank", "-id"]),
+            models.Index(fields=["-rising_rank", "-id"]),
+            models.Index(fields=["community", "-score", "-id"]),
+            models.Index(fields=["-score", "-id"]),
+        ]
 
 
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="comments")
+    parent = models.ForeignKey(
+        "self", null=True, blank=True, on_delete=models.CASCADE, related_name="replies"
+    )
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     body = models.TextField()
     score = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Materialized path: the fixed-width encoded ids of every ancestor and
+    # of the comment itself, so ordering by path yields the thread in
+    # depth-first order and a subtree is a path prefix (see core.threads).
+    path = models.CharField(max_length=255, default="")
+    depth = models.PositiveSmallIntegerField(default=0)
+    reply_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["post", "path"]),
+            # Pages of top-level comments in post_detail.
+            models.Index(fields=["post", "depth", "created_at"]),
+        ]
 
 
 class Vote(models.Model):
@@ -44,3 +92,85 @@ class Vote(models.Model):
 
     class Meta:
         unique_together = ("user", "target_type", "target_id")
+        indexes = [
+            # Covers the vote-state lookup for a page of targets, so it is
+            # answered from the index without touching the table.
+            models.Index(fields=["user", "target_type", "target_id", "value"]),
+            # The votes on a set of targets, which bulk deletions remove
+            # (see core.moderation).
+            models.Index(fields=["target_type", "target_id"]),
+        ]
+
+
+class CommunityStats(models.Model):
+    """Running totals for a community's sidebar, kept by core.communitystats."""
+
+    community = models.OneToOneField(
+        Community, on_delete=models.CASCADE, primary_key=True, related_name="stats"
+    )
+    post_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    subscriber_count = models.PositiveIntegerField(default=0)
+
+
+class CommunityActivity(models.Model):
+    """Posts and comments created in a community during one UTC hour."""
+
+    community = models.ForeignKey(Community, on_delete=models.CASCADE)
+    hour = models.DateTimeField()
+    posts = models.PositiveIntegerField(default=0)
+    comments = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("community", "hour")
+
+
+class CommunityActiveUser(models.Model):
+    """A user who posted, commented or voted in a community during one UTC hour."""
+
+    community = models.ForeignKey(Community, on_delete=models.CASCADE)
+    hour = models.DateTimeField()
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+
+    class Meta:
+        # Also answers the distinct-user count of a window from the index.
+        unique_together = ("community", "hour", "user")
+
+
+class PageStamp(models.Model):
+    """When the pages of a scope last changed, in nanoseconds (see core.httpcache)."""
+
+    scope = models.CharField(max_length=64, primary_key=True)
+    stamp = models.BigIntegerField()
+
+
+class Job(models.Model):
+    """A queued background task run by the run_tasks command (see core.tasks)."""
+
+    PENDING, RUNNING, FAILED = "pending", "running", "failed"
+
+    # Dotted path of the task function.
+    task = models.CharField(max_length=200)
+    args = models.JSONField()
+    # Hash of the arguments of a deduplicated job; null otherwise.
+    key = models.CharField(max_length=40, null=True, blank=True)
+    status = models.CharField(
+        max_length=10,
+        choices=[(PENDING, PENDING), (RUNNING, RUNNING), (FAILED, FAILED)],
+        default=PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField()
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["task", "key"],
+                condition=models.Q(status="pending"),
+                name="core_job_pending_unique",
+            ),
+        ]
+        indexes = [models.Index(fields=["status", "run_after"])]
@@ -0,0 +1,346 @@
+"""Bulk removal, archiving and purging of posts, comments and communities.
+
+Deleting many posts through the ORM collects every comment, sends a signal
+per row and deletes everything in one transaction, holding SQLite's write
+lock throughout; ``Vote`` rows, which point at their target by
+``(target_type, target_id)`` rather than a foreign key, are left behind.
+The functions here work in chunks of about ``CHUNK_SIZE`` rows, each in
+its own short transaction:
+
+* comments are deleted deepest first (descending path), so every chunk
+  takes replies along with or before their parents and may end anywhere
+  in a thread; a post with more comments than a chunk loses them over
+  several chunks before it goes itself;
+* the votes on the deleted posts and comments go in the same transaction,
+  found through the ``(target_type, target_id)`` index;
+* comment counters, reply counts, community statistics and the caches
+  are adjusted once per chunk, in aggregate, instead of by a signal per
+  row.
+
+A ``progress`` callback is called with the :class:`Progress` after every
+chunk. Settings live in ``MODERATION``.
+"""
+
+import gzip
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Count, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import communitystats, feedcache, httpcache, ranking, threads
+from .models import Comment, CommunityActiveUser, CommunityActivity, Post, Subscription, Vote
+
+
+DEFAULTS = {"CHUNK_SIZE": 500, "ARCHIVE_DIR": "archive"}
+
+# Ids bound per statement, well under SQLite's limits on parameters and
+# expression depth.
+IDS_PER_QUERY = 500
+
+
+def moderation_settings():
+    return {**DEFAULTS, **getattr(settings, "MODERATION", {})}
+
+
+class Progress:
+    """Rows deleted so far by a bulk operation, and its throughput."""
+
+    def __init__(self):
+        self.posts = 0
+        self.comments = 0
+        self.votes = 0
+        self.chunks = 0
+        self.started = time.perf_counter()
+
+    @property
+    def rows(self):
+        return self.posts + self.comments + self.votes
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def __str__(self):
+        elapsed = self.elapsed
+        return (
+            f"{self.posts} posts, {self.comments} comments and {self.votes} votes "
+            f"in {self.chunks} chunks, {elapsed:.1f} s ({self.rows / elapsed:.0f} rows/s)"
+        )
+
+
+def remove_comments(queryset, chunk_size=None, progress=None):
+    """Delete the comments of ``queryset`` with their replies; return the :class:`Progress`."""
+
+    chunk_size = chunk_size or moderation_settings()["CHUNK_SIZE"]
+    tally = Progress()
+    while True:
+        with transaction.atomic():
+            # Each chunk deletes what it selects, so the next one starts over.
+            roots = list(
+                queryset.order_by("pk").values_list("post_id", "path")[
+                    : min(chunk_size, IDS_PER_QUERY)
+                ]
+            )
+            if not roots:
+                break
+            _delete_comments(_subtrees(roots, chunk_size), tally)
+        _chunk_done(tally, progress)
+    return tally
+
+
+def remove_posts(queryset, chunk_size=None, progress=None, archive=None):
+    """Delete the posts of ``queryset`` with their comments; return the :class:`Progress`.
+
+    ``archive``, if given, is called with the ids of posts about to be
+    deleted, in the same transaction (see :func:`archive_writer`).
+    """
+
+    chunk_size = chunk_size or moderation_settings()["CHUNK_SIZE"]
+    tally = Progress()
+    archived = set()
+    while True:
+        with transaction.atomic():
+            posts = list(
+                queryset.order_by("pk").values_list("pk", "comment_count")[
+                    : min(chunk_size, IDS_PER_QUERY)
+                ]
+            )
+            if not posts:
+                break
+            ids, rows = [], 0
+            for pk, comment_count in posts:
+                if ids and rows + 1 + comment_count > chunk_size:
+                    break
+                ids.append(pk)
+                rows += 1 + comment_count
+            if archive is not None:
+                archive([pk for pk in ids if pk not in archived])
+            if rows > chunk_size:
+                # One post with more comments than a chunk: its comments
+                # first, the post once they are gone.
+                archived.add(ids[0])
+                comments = Comment.objects.filter(post_id=ids[0]).order_by("-path")
+                comment_ids = list(comments.values_list("pk", flat=True)[:chunk_size])
+                if comment_ids:
+                    _delete_comments(comment_ids, tally, posts_going=True)
+                    # The post's counter is exact now; reselect it.
+                    ids = []
+            if ids:
+                _delete_posts(ids, tally)
+        _chunk_done(tally, progress)
+    return tally
+
+
+def purge_community(community, chunk_size=None, progress=None):
+    """Delete a community with all its posts and rows; return the :class:`Progress`."""
+
+    chunk_size = chunk_size or moderation_settings()["CHUNK_SIZE"]
+    tally = remove_posts(community.posts.all(), chunk_size, progress)
+    for model in (Subscription, CommunityActivity, CommunityActiveUser):
+        queryset = model.objects.filter(community=community)
+        while True:
+            with transaction.atomic():
+                ids = list(queryset.values_list("pk", flat=True)[:chunk_size])
+                if not ids:
+                    break
+                model.objects.filter(pk__in=ids).delete()
+            _chunk_done(tally, progress)
+    with transaction.atomic():
+        httpcache.touch(httpcache.home_scope())
+        httpcache.forget(httpcache.community_scope(community.pk))
+        community.delete()
+    return tally
+
+
+def archive_path():
+    """Return a new archive file name in ``ARCHIVE_DIR``."""
+
+    directory = Path(moderation_settings()["ARCHIVE_DIR"])
+    return directory / f"posts-{timezone.now():%Y%m%d-%H%M%S}.jsonl.gz"
+
+
+def open_archive(path):
+    """Open ``path`` for appending archive lines, gzipped if it ends in ``.gz``."""
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    opener = gzip.open if path.suffix == ".gz" else open
+    return opener(path, "at", encoding="utf-8")
+
+
+def archive_writer(stream):
+    """Return an ``archive`` callable writing posts to ``stream`` as JSON lines.
+
+    Each line is a post with its community, author and comments in thread
+    order. Lines are written before the posts' chunk commits, so a chunk
+    that fails leaves its posts both in the archive and in the database.
+    """
+
+    def write(post_ids):
+        if not post_ids:
+            return
+        comments = defaultdict(list)
+        rows = (
+            Comment.objects.filter(post_id__in=post_ids)
+            .order_by("post_id", "path")
+            .values(
+                "id", "post_id", "parent_id", "author__username", "body", "score", "created_at"
+            )
+        )
+        for row in rows:
+            comments[row.pop("post_id")].append(row)
+        posts = (
+            Post.objects.filter(pk__in=post_ids)
+            .order_by("pk")
+            .values(
+                "id",
+                "community__name",
+                "author__username",
+                "post_type",
+                "title",
+                "body",
+                "url",
+                "score",
+                "created_at",
+            )
+        )
+        for post in posts:
+            post["comments"] = comments.get(post["id"], [])
+            stream.write(json.dumps(post, cls=DjangoJSONEncoder) + "\n")
+        stream.flush()
+
+    return write
+
+
+def _chunk_done(tally, progress):
+    tally.chunks += 1
+    if progress is not None:
+        progress(tally)
+
+
+def _subtrees(roots, limit):
+    """Return up to ``limit`` ids of the comments at ``roots`` and below, deepest first.
+
+    ``roots`` holds ``(post_id, path)`` pairs. Any prefix of a post's
+    comments in descending path order holds the replies of every comment
+    in it, so a chunk never orphans a reply.
+    """
+
+    condition = Q()
+    for post_id, path in roots:
+        # A range on the (post, path) index; LIKE could not use it.
+        condition |= Q(post_id=post_id, path__gte=path, path__lt=threads.subtree_end(path))
+    return list(
+        Comment.objects.filter(condition)
+        .order_by("post_id", "-path")
+        .values_list("pk", flat=True)[:limit]
+    )
+
+
+def _delete_comments(ids, tally, posts_going=False):
+    """Delete the comments ``ids`` and their votes, and adjust what counts them.
+
+    ``posts_going`` says that the comments' posts are deleted next, so
+    their ranks and page stamps are left alone.
+    """
+
+    rows = []
+    for batch in _batches(ids):
+        rows += Comment.objects.filter(pk__in=batch).values_list(
+            "pk", "post_id", "parent_id", "created_at", "post__community_id"
+        )
+    deleted = {pk for pk, _, _, _, _ in rows}
+    post_ids = {post_id for _, post_id, _, _, _ in rows}
+    parents = {parent for _, _, parent, _, _ in rows if parent and parent not in deleted}
+
+    tally.votes += _delete_votes("comment", list(deleted))
+    tally.comments += _delete_rows(Comment, "id", list(deleted))
+
+    # Recounted from what is left, in one UPDATE per table.
+    remaining = Comment.objects.filter(post_id=OuterRef("pk")).values("post_id")
+    for batch in _batches(list(post_ids)):
+        Post.objects.filter(pk__in=batch).update(
+            comment_count=Coalesce(Subquery(remaining.annotate(n=Count("pk")).values("n")), 0),
+            last_comment_at=Subquery(remaining.annotate(last=Max("created_at")).values("last")),
+        )
+    replies = Comment.objects.filter(parent_id=OuterRef("pk")).values("parent_id")
+    for batch in _batches(list(parents)):
+        Comment.objects.filter(pk__in=batch).update(
+            reply_count=Coalesce(Subquery(replies.annotate(n=Count("pk")).values("n")), 0)
+        )
+
+    communitystats.activity_removed(
+        (community_id, created_at, 0, 1) for _, _, _, created_at, community_id in rows
+    )
+    communities = {community_id for _, _, _, _, community_id in rows}
+    scopes = [httpcache.home_scope(), *(httpcache.community_scope(pk) for pk in communities)]
+    if not posts_going:
+        # Rising ranks count comments.
+        ranking.schedule_post_ranks(post_ids)
+        scopes += (httpcache.post_scope(pk) for pk in post_ids)
+    httpcache.touch(*scopes)
+
+
+def _delete_posts(ids, tally):
+    posts = []
+    comments = []
+    for batch in _batches(ids):
+        posts += Post.objects.filter(pk__in=batch).values_list("pk", "community_id", "created_at")
+        comments += Comment.objects.filter(post_id__in=batch).values_list(
+            "pk", "created_at", "post__community_id"
+        )
+    post_ids = [pk for pk, _, _ in posts]
+    comment_ids = [pk for pk, _, _ in comments]
+
+    tally.votes += _delete_votes("post", post_ids) + _delete_votes("comment", comment_ids)
+    # Whole threads go, so no reply is left without its parent.
+    tally.comments += _delete_rows(Comment, "post_id", post_ids)
+    tally.posts += _delete_rows(Post, "id", post_ids)
+
+    communitystats.activity_removed(
+        [(community_id, created_at, 1, 0) for _, community_id, created_at in posts]
+        + [(community_id, created_at, 0, 1) for _, created_at, community_id in comments]
+    )
+    communities = {community_id for _, community_id, _ in posts}
+    feedcache.bump_feed_version(
+        feedcache.home_scope(), *(feedcache.community_scope(pk) for pk in communities)
+    )
+    httpcache.touch(
+        httpcache.home_scope(), *(httpcache.community_scope(pk) for pk in communities)
+    )
+    httpcache.forget(*(httpcache.post_scope(pk) for pk in post_ids))
+
+
+def _delete_votes(target_type, ids):
+    deleted = 0
+    for batch in _batches(ids):
+        deleted += Vote.objects.filter(target_type=target_type, target_id__in=batch).delete()[0]
+    return deleted
+
+
+def _delete_rows(model, column, ids):
+    """Delete the rows of ``model`` whose ``column`` is in ``ids``, without signals."""
+
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    deleted = 0
+    with connection.cursor() as cursor:
+        for batch in _batches(ids):
+            placeholders = ", ".join(["%s"] * len(batch))
+            cursor.execute(
+                f"DELETE FROM {table} WHERE {qn(column)} IN ({placeholders})", batch
+            )
+            deleted += cursor.rowcount
+    return deleted
+
+
+def _batches(ids):
+    for start in range(0, len(ids), IDS_PER_QUERY):
+        yield ids[start : start + IDS_PER_QUERY]
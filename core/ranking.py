@@ -0,0 +1,116 @@
+"""Precomputed feed ranks for posts.
+
+``hot_rank`` follows the classic Reddit formula: the log of the net score
+plus a term that grows linearly with the creation time. Because newer
+posts simply start higher, the rank never has to decay and only changes
+when the score does. ``rising_rank`` measures recent momentum (score and
+comments per hour of age) and is only non-zero inside ``RISING_WINDOW``;
+it does decay, so the ``update_ranks`` command recomputes it periodically.
+
+Votes and comments only queue a refresh (:func:`schedule_post_ranks`),
+which a background task runs (see core.tasks), so the sort order lags
+them by as long as the queue does.
+"""
+
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import tasks
+from .models import Post
+
+
+HOT_EPOCH = datetime(2005, 12, 8, 7, 46, 43, tzinfo=dt_timezone.utc)
+HOT_PERIOD_SECONDS = 45000
+RISING_WINDOW = timedelta(hours=24)
+RISING_COMMENT_WEIGHT = 2
+
+
+def hot_rank(score, created_at):
+    """Return the hot rank of a post with ``score`` created at ``created_at``."""
+
+    order = math.log10(max(abs(score), 1))
+    sign = (score > 0) - (score < 0)
+    seconds = (created_at - HOT_EPOCH).total_seconds()
+    return round(sign * order + seconds / HOT_PERIOD_SECONDS, 7)
+
+
+def rising_rank(score, comment_count, created_at, now=None):
+    """Return the rising rank of a post, or 0 once it has left the window."""
+
+    age = (now or timezone.now()) - created_at
+    if age > RISING_WINDOW:
+        return 0.0
+    activity = score + RISING_COMMENT_WEIGHT * comment_count
+    hours = max(age.total_seconds(), 0) / 3600
+    return round(activity / (hours + 2) ** 1.5, 7)
+
+
+def update_post_ranks(posts, now=None):
+    """Recompute and store the ranks of already loaded ``posts``.
+
+    Each post needs ``score``, ``comment_count`` and ``created_at`` loaded.
+    """
+
+    now = now or timezone.now()
+    changed = []
+    for post in posts:
+        hot = hot_rank(post.score, post.created_at)
+        rising = rising_rank(post.score, post.comment_count, post.created_at, now)
+        if (post.hot_rank, post.rising_rank) != (hot, rising):
+            post.hot_rank, post.rising_rank = hot, rising
+            changed.append(post)
+    Post.objects.bulk_update(changed, ["hot_rank", "rising_rank"], batch_size=500)
+    return len(changed)
+
+
+def refresh_post_ranks(post_ids):
+    """Reload the rank inputs of ``post_ids`` and store their new ranks."""
+
+    with transaction.atomic():
+        posts = Post.objects.filter(pk__in=post_ids).only(
+            "score", "comment_count", "created_at", "hot_rank", "rising_rank"
+        )
+        return update_post_ranks(posts)
+
+
+def schedule_post_ranks(post_ids):
+    """Queue a refresh of the ranks of ``post_ids``; queued refreshes are merged."""
+
+    tasks.enqueue(
+        "core.ranking.refresh_ranks_task", [{"post": pk} for pk in post_ids], dedupe=True
+    )
+
+
+def refresh_ranks_task(jobs):
+    refresh_post_ranks({job["post"] for job in jobs})
+
+
+def decay_rising_ranks(chunk_size=1000, now=None):
+    """Recompute ``rising_rank`` for recent posts and zero it for older ones.
+
+    Returns the number of posts whose rank changed. Work is done in
+    ``chunk_size`` batches, each in its own short transaction.
+    """
+
+    now = now or timezone.now()
+    cutoff = now - RISING_WINDOW
+    changed = Post.objects.filter(created_at__lt=cutoff).exclude(rising_rank=0).update(
+        rising_rank=0
+    )
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            posts = list(
+                Post.objects.filter(created_at__gte=cutoff, pk__gt=last_pk)
+                .order_by("pk")
+                .only("score", "comment_count", "created_at", "hot_rank", "rising_rank")[
+                    :chunk_size
+                ]
+            )
+            if not posts:
+                return changed
+            last_pk = posts[-1].pk
+            changed += update_post_ranks(posts, now)
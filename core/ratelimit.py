@@ -0,0 +1,156 @@
+"""Per-user and per-IP rate limits on the write endpoints.
+
+Each policy in ``RATE_LIMITS["POLICIES"]`` gives a rate per scope, such as
+``{"user": "120/m", "ip": "600/m"}``: ``user`` counts the requests of a
+signed-in user, ``ip`` those from a client address (IPv6 addresses are
+grouped by /64). A request must pass every scope of its policy.
+
+Counts are sliding windows, approximated from two fixed windows: the
+count of the current window plus the previous window's count weighted by
+how much of it still overlaps the sliding one. That takes one ``incr``
+and one ``get`` on the cache per scope, and no database query, as long as
+the view has loaded the user already (``login_required`` does). Blocked
+attempts count too, so a client that keeps hammering stays blocked.
+
+Counters live in the ``ALIAS`` cache. Local memory is per process, so
+with several workers each one enforces its own share of the limit; point
+the alias at a shared backend with an atomic ``incr`` (memcached, Redis)
+to enforce it across processes. The file-based cache lists its directory
+on every write, which makes a check take milliseconds. The check calls the
+cache synchronously even from async views: a thread hop would cost more
+than the check.
+"""
+
+import ipaddress
+import math
+import re
+import time
+from functools import lru_cache, wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+
+
+DEFAULTS = {"ENABLED": True, "ALIAS": "default", "POLICIES": {}}
+
+RATE_RE = re.compile(r"^(\d+)/(\d*)([smhd])$")
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def limit_settings():
+    return {**DEFAULTS, **getattr(settings, "RATE_LIMITS", {})}
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """Return ``(limit, window_seconds)`` for a rate like ``"10/m"`` or ``"5/10m"``."""
+
+    match = RATE_RE.match(rate)
+    if match is None:
+        raise ImproperlyConfigured(f"Invalid rate {rate!r}; expected e.g. '10/m' or '5/10m'.")
+    limit, count, unit = match.groups()
+    return int(limit), int(count or 1) * UNITS[unit]
+
+
+def client_ip(request):
+    """Return the client address of ``request``, IPv6 addresses reduced to their /64."""
+
+    address = request.META.get("REMOTE_ADDR", "")
+    if ":" in address:
+        try:
+            return str(ipaddress.IPv6Network(f"{address}/64", strict=False).network_address)
+        except ValueError:
+            pass
+    return address
+
+
+def hit(key, limit, window, now=None, cache=None):
+    """Count one request under ``key``; return seconds to wait, or 0 if it may pass."""
+
+    if cache is None:
+        cache = caches[limit_settings()["ALIAS"]]
+    if now is None:
+        now = time.time()
+    index, elapsed = divmod(now, window)
+    current_key = f"{key}:{window}:{int(index)}"
+    try:
+        current = cache.incr(current_key)
+    except ValueError:
+        # First request of the window. Kept for two windows, since it
+        # weighs on the next one.
+        if cache.add(current_key, 1, 2 * window):
+            current = 1
+        else:
+            current = cache.incr(current_key)
+    if current <= limit:
+        previous = cache.get(f"{key}:{window}:{int(index) - 1}", 0)
+        if previous * (1 - elapsed / window) + current <= limit:
+            return 0
+    return math.ceil(window - elapsed)
+
+
+def check(request, policy, user=None):
+    """Count ``request`` against ``policy``; return seconds to wait, or 0 if it may pass.
+
+    ``user`` is the user the view already loaded, if any.
+    """
+
+    config = limit_settings()
+    rates = config["POLICIES"].get(policy)
+    if not config["ENABLED"] or not rates:
+        return 0
+    cache = caches[config["ALIAS"]]
+    now = time.time()
+    wait = 0
+    for scope, rate in rates.items():
+        if scope == "user":
+            if user is None or not user.is_authenticated:
+                continue
+            identity = user.pk
+        elif scope == "ip":
+            identity = client_ip(request)
+        else:
+            raise ImproperlyConfigured(f"Unknown rate limit scope {scope!r} in {policy!r}.")
+        limit, window = parse_rate(rate)
+        wait = max(wait, hit(f"ratelimit:{policy}:{scope}:{identity}", limit, window, now, cache))
+    return wait
+
+
+def rate_limit(policy, methods=("POST",)):
+    """Limit a view's ``methods`` requests by ``policy``, answering 429 past it.
+
+    Place it below ``login_required`` so that anonymous requests are
+    turned away before they count, and the user is already loaded.
+    """
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+
+            async def wrapper(request, *args, **kwargs):
+                if request.method in methods:
+                    wait = check(request, policy, await request.auser())
+                    if wait:
+                        return too_many_requests(wait)
+                return await view(request, *args, **kwargs)
+
+        else:
+
+            def wrapper(request, *args, **kwargs):
+                if request.method in methods:
+                    wait = check(request, policy, request.user)
+                    if wait:
+                        return too_many_requests(wait)
+                return view(request, *args, **kwargs)
+
+        return wraps(view)(wrapper)
+
+    return decorator
+
+
+def too_many_requests(wait):
+    response = HttpResponse("Too many requests, try again later.", status=429)
+    response["Retry-After"] = str(wait)
+    return response
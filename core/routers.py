@@ -0,0 +1,138 @@
+"""Database routers.
+
+:class:`ReadConnectionRouter` sends reads to a ``query_only`` connection on
+the primary's own file (``SQLITE_READ_CONNECTION``). :class:`ReplicaRouter`
+sends them to read replicas, copies of ``default`` kept up to date outside
+of Django (``sync_replicas`` for local SQLite files, streaming replication
+for Postgres), listed in ``REPLICATION["REPLICAS"]``.
+
+A replica lags behind the primary, so a client that has just written reads
+from the primary for ``STICKY_SECONDS`` (see
+:class:`PrimaryStickinessMiddleware`). Pages rendered from a lagging
+replica may still be cached by :mod:`core.feedcache` for up to their TTL.
+"""
+
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+DEFAULTS = {
+    "REPLICAS": [],
+    "STICKY_SECONDS": 10,
+    "COOKIE_NAME": "read_primary",
+}
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE")
+
+# The alias the current request reads from; None outside of requests.
+_read_alias = contextvars.ContextVar("read_alias", default=None)
+
+
+def replication_settings():
+    return {**DEFAULTS, **getattr(settings, "REPLICATION", {})}
+
+
+def choose_replica(config=None):
+    """Return a random replica alias, or ``default`` when there are none."""
+
+    replicas = (config or replication_settings())["REPLICAS"]
+    return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+
+class ReadConnectionRouter:
+    """Send reads to the ``reader`` alias and writes to ``default``.
+
+    Reads made while ``default`` is inside a transaction stay on it, so
+    that they see the transaction's own uncommitted writes.
+    """
+
+    read_alias = "reader"
+
+    def db_for_read(self, model, **hints):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return self.read_alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are the same database.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter(ReadConnectionRouter):
+    """Send reads to a replica and writes to ``default``.
+
+    Within a request :class:`PrimaryStickinessMiddleware` picks the alias
+    once, so that a page never mixes two replicas' points in time. Outside
+    of requests (commands, workers) each read goes to a random replica.
+    Reads inside a transaction on ``default`` stay on it.
+    """
+
+    def db_for_read(self, model, **hints):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return _read_alias.get() or choose_replica()
+
+
+class PrimaryStickinessMiddleware:
+    """Choose each request's read alias for :class:`ReplicaRouter`.
+
+    Requests with an unsafe method read from the primary, and so does the
+    same client for ``STICKY_SECONDS`` afterwards: the response sets a
+    cookie that expires on its own. Anything else reads from one replica.
+    Both sync and async capable, like the other project middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        config = replication_settings()
+        token = _read_alias.set(self._alias(request, config))
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self._finish(request, response, config)
+
+    async def __acall__(self, request):
+        config = replication_settings()
+        token = _read_alias.set(self._alias(request, config))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+        return self._finish(request, response, config)
+
+    def _alias(self, request, config):
+        if request.method not in SAFE_METHODS or config["COOKIE_NAME"] in request.COOKIES:
+            return DEFAULT_DB_ALIAS
+        return choose_replica(config)
+
+    def _finish(self, request, response, config):
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(
+                config["COOKIE_NAME"],
+                "1",
+                max_age=config["STICKY_SECONDS"],
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
@@ -0,0 +1,107 @@
+"""Full-text search over posts and comments.
+
+On SQLite the ``core_post_fts`` and ``core_comment_fts`` FTS5 tables
+(created by migration 0008 and kept in sync by triggers) answer queries
+from an inverted index ranked with BM25. Other databases fall back to
+``icontains`` filters.
+"""
+
+import re
+
+from django.db import connection, connections, router
+from django.db.models import Q
+
+from .models import Comment, Post
+
+
+RESULT_LIMIT = 50
+# BM25 column weights: a match in a post title counts ten times one in the body.
+POST_WEIGHTS = (10.0, 1.0)
+
+FTS_TABLES = {
+    "core_post_fts": ("core_post", ["title", "body"]),
+    "core_comment_fts": ("core_comment", ["body"]),
+}
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_available():
+    return connection.vendor == "sqlite"
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query matching every word.
+
+    Each word is quoted so that user input can never be parsed as FTS5
+    syntax (operators, column filters or unbalanced quotes).
+    """
+
+    return " ".join(f'"{token}"' for token in TOKEN_RE.findall(query))
+
+
+def search_posts(query, community=None, limit=RESULT_LIMIT):
+    """Return posts matching ``query``, best match first."""
+
+    expression = match_expression(query)
+    if not expression:
+        return []
+    queryset = Post.objects.select_related("community", "author")
+    if not fts_available():
+        queryset = queryset.filter(Q(title__icontains=query) | Q(body__icontains=query))
+        if community is not None:
+            queryset = queryset.filter(community=community)
+        return list(queryset.order_by("-created_at")[:limit])
+
+    sql = (
+        "SELECT p.id FROM core_post_fts JOIN core_post p ON p.id = core_post_fts.rowid "
+        "WHERE core_post_fts MATCH %s"
+    )
+    params = [expression]
+    if community is not None:
+        sql += " AND p.community_id = %s"
+        params.append(community.pk)
+    sql += " ORDER BY bm25(core_post_fts, %s, %s) LIMIT %s"
+    params += [*POST_WEIGHTS, limit]
+    return _in_order(queryset, _ids(Post, sql, params))
+
+
+def search_comments(query, community=None, limit=RESULT_LIMIT):
+    """Return comments matching ``query``, best match first."""
+
+    expression = match_expression(query)
+    if not expression:
+        return []
+    queryset = Comment.objects.select_related("post", "author")
+    if not fts_available():
+        queryset = queryset.filter(body__icontains=query)
+        if community is not None:
+            queryset = queryset.filter(post__community=community)
+        return list(queryset.order_by("-created_at")[:limit])
+
+    sql = (
+        "SELECT c.id FROM core_comment_fts JOIN core_comment c ON c.id = core_comment_fts.rowid"
+    )
+    params = []
+    if community is not None:
+        sql += " JOIN core_post p ON p.id = c.post_id"
+    sql += " WHERE core_comment_fts MATCH %s"
+    params.append(expression)
+    if community is not None:
+        sql += " AND p.community_id = %s"
+        params.append(community.pk)
+    sql += " ORDER BY bm25(core_comment_fts) LIMIT %s"
+    params.append(limit)
+    return _in_order(queryset, _ids(Comment, sql, params))
+
+
+def _ids(model, sql, params):
+    # Raw SQL bypasses the database routers; ask them where to read.
+    with connections[router.db_for_read(model)].cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _in_order(queryset, ids):
+    objects = queryset.in_bulk(ids)
+    return [objects[pk] for pk in ids if pk in objects]
@@ -0,0 +1,46 @@
+"""Signal receivers for the core app."""
+
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import communitystats, counters, feedcache, httpcache, instrumentation
+from .models import Comment, Post
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.comment_removed(instance.post_id)
+    communitystats.comment_removed(instance)
+    community_id = (
+        Post.objects.filter(pk=instance.post_id).values_list("community_id", flat=True).first()
+    )
+    httpcache.comment_changed(instance.post_id, community_id)
+    if instance.parent_id is not None:
+        Comment.objects.filter(pk=instance.parent_id, reply_count__gt=0).update(
+            reply_count=F("reply_count") - 1
+        )
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    feedcache.invalidate_post(instance)
+    httpcache.post_changed(instance)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        communitystats.post_added(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    communitystats.post_removed(instance)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    instrumentation.install(connection)
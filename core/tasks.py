@@ -0,0 +1,160 @@
+"""Background tasks: side effects of a write, run after the request.
+
+A write queues what may lag behind it (recomputing a post's ranks, the
+community sidebar counts) as :class:`~core.models.Job` rows inside its own
+transaction, so the jobs exist exactly when the write commits, and returns.
+The ``run_tasks`` command claims due jobs, groups them by task and runs
+each group as one batch in a pool of processes. A task is a function named
+by its dotted path that takes the list of its jobs' arguments (JSON
+objects), so a hundred votes on a post refresh its ranks once.
+
+Jobs queued with ``dedupe`` are unique among pending jobs of their task:
+queuing arguments that are already waiting adds nothing. A batch runs in
+one transaction with the deletion of its jobs, so a job's writes commit
+at most once. A batch that raises is retried job by job, so one bad job
+does not hold up the others; a job that fails waits ``RETRY_DELAY``
+seconds, doubled at each attempt, and is kept as ``failed`` after
+``MAX_ATTEMPTS``. Claimed jobs are leased for ``LEASE`` seconds and go
+back to pending if their worker dies.
+
+With ``EAGER`` tasks run inline when queued, inside the caller's
+transaction, and nothing is stored. Settings live in ``TASKS``.
+"""
+
+import hashlib
+import json
+import traceback
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+
+DEFAULTS = {
+    "EAGER": False,
+    "BATCH_SIZE": 500,
+    "MAX_ATTEMPTS": 5,
+    "RETRY_DELAY": 10,
+    "LEASE": 300,
+    "POLL_INTERVAL": 1.0,
+}
+
+
+def task_settings():
+    return {**DEFAULTS, **getattr(settings, "TASKS", {})}
+
+
+def enqueue(task, jobs, dedupe=False):
+    """Queue a job of ``task`` for each arguments dict in ``jobs``, in one ``INSERT``."""
+
+    if not jobs:
+        return
+    if task_settings()["EAGER"]:
+        import_string(task)(list(jobs))
+        return
+    now = timezone.now()
+    Job.objects.bulk_create(
+        [
+            Job(task=task, args=args, key=_key(args) if dedupe else None, run_after=now)
+            for args in jobs
+        ],
+        ignore_conflicts=dedupe,
+    )
+
+
+def _key(args):
+    return hashlib.sha1(json.dumps(args, sort_keys=True).encode()).hexdigest()
+
+
+def claim(limit, now=None):
+    """Lease up to ``limit`` due jobs; return ``{task: [(job_id, args), ...]}``."""
+
+    config = task_settings()
+    now = now or timezone.now()
+    with transaction.atomic():
+        _release_expired(now)
+        rows = list(
+            Job.objects.filter(status=Job.PENDING, run_after__lte=now)
+            .order_by("run_after", "pk")
+            .values_list("pk", "task", "args")[:limit]
+        )
+        Job.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(
+            status=Job.RUNNING,
+            attempts=F("attempts") + 1,
+            locked_until=now + timedelta(seconds=config["LEASE"]),
+        )
+    batches = defaultdict(list)
+    for pk, task, args in rows:
+        batches[task].append((pk, args))
+    return dict(batches)
+
+
+def _release_expired(now):
+    # Jobs of a worker that died mid-batch; their batch was rolled back.
+    expired = Job.objects.filter(status=Job.RUNNING, locked_until__lt=now)
+    for job in expired.only("pk"):
+        _requeue(job.pk, status=Job.PENDING, locked_until=None)
+
+
+def _requeue(pk, **fields):
+    try:
+        with transaction.atomic():
+            Job.objects.filter(pk=pk).update(**fields)
+    except IntegrityError:
+        # The same job has been queued again since; that one will run.
+        Job.objects.filter(pk=pk).delete()
+
+
+def run_batch(task, jobs):
+    """Run ``jobs`` of ``task`` and delete them; return ``[(job_id, error)]`` of failures."""
+
+    try:
+        _run(task, jobs)
+        return []
+    except Exception:
+        if len(jobs) == 1:
+            return [(jobs[0][0], traceback.format_exc())]
+    failures = []
+    for job in jobs:
+        try:
+            _run(task, [job])
+        except Exception:
+            failures.append((job[0], traceback.format_exc()))
+    return failures
+
+
+def _run(task, jobs):
+    with transaction.atomic():
+        import_string(task)([args for _, args in jobs])
+        Job.objects.filter(pk__in=[pk for pk, _ in jobs]).delete()
+
+
+def fail(failures, now=None):
+    """Schedule the retry of each failed ``(job_id, error)``, or give the job up."""
+
+    config = task_settings()
+    now = now or timezone.now()
+    attempts = dict(
+        Job.objects.filter(pk__in=[pk for pk, _ in failures]).values_list("pk", "attempts")
+    )
+    for pk, error in failures:
+        tries = attempts.get(pk, 0)
+        if tries >= config["MAX_ATTEMPTS"]:
+            Job.objects.filter(pk=pk).update(
+                status=Job.FAILED, locked_until=None, last_error=error
+            )
+        else:
+            delay = timedelta(seconds=config["RETRY_DELAY"] * 2 ** (tries - 1))
+            _requeue(
+                pk,
+                status=Job.PENDING,
+                run_after=now + delay,
+                locked_until=None,
+                last_error=error,
+            )
@@ -0,0 +1,78 @@
+"""Template helpers for post and comment rows.
+
+The viewer's vote state, the vote buttons shared by posts and comments,
+and the URLs of a row's object.
+"""
+
+from functools import lru_cache
+
+from django import template
+from django.urls import get_script_prefix, get_urlconf, reverse
+from django.utils.safestring import mark_safe
+
+from ..votes import TARGET_TYPES
+
+
+register = template.Library()
+
+# Stands in for the primary key while reversing a URL once.
+_PK_SENTINEL = 4294967291
+
+
+@register.filter
+def vote_value(target, vote_state):
+    """Return the viewer's vote on a post or comment: 1, -1 or 0.
+
+    ``vote_state`` is the map returned by ``votes.load_vote_state``.
+    """
+
+    if not vote_state:
+        return 0
+    return vote_state.get((TARGET_TYPES[type(target)], target.pk), 0)
+
+
+@register.filter
+def pk_url(pk, name):
+    """Return ``reverse(name, args=[pk])``, reversing ``name`` only once.
+
+    ``{% url %}`` resolves the URL pattern again for every row; this fills
+    the primary key into the URL reversed for the first one.
+    """
+
+    before, after = _url_parts(name, get_script_prefix(), get_urlconf())
+    return f"{before}{pk}{after}"
+
+
+@lru_cache(maxsize=None)
+def _url_parts(name, prefix, urlconf):
+    before, _, after = reverse(name, urlconf, args=[_PK_SENTINEL]).partition(str(_PK_SENTINEL))
+    return before, after
+
+
+@register.inclusion_tag("core/_vote_buttons.html", takes_context=True)
+def vote_buttons(context, target, live=False):
+    """Render the vote buttons and score of a post or comment.
+
+    In a feed page rendered for the cache (``placeholders``), the score
+    and the viewer's vote are placeholders filled in by ``core.feedcache``.
+    With ``live`` the score is also replaced by the post's live updates.
+    """
+
+    kind = TARGET_TYPES[type(target)]
+    pk = str(target.pk)
+    if context.get("placeholders"):
+        up, down = mark_safe(f"<!--up:{pk}-->"), mark_safe(f"<!--down:{pk}-->")
+        score = mark_safe(f"<!--score:{pk}-->")
+    else:
+        vote = vote_value(target, context.get("votes"))
+        up, down = (" voted" if vote == 1 else ""), (" voted" if vote == -1 else "")
+        score = str(target.score)
+    return {
+        "kind": kind,
+        "pk": pk,
+        "url": pk_url(pk, f"vote_{kind}"),
+        "up": up,
+        "down": down,
+        "score": score,
+        "live": live,
+    }
@@ -1,10 +1,91 @@
 """Tests for post submission and voting endpoints."""
 
+import asyncio
+import base64
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections, transaction
+from django.db.utils import ConnectionHandler
+from django.db.models import Count, F, Sum
+from django.http import HttpResponse
+from django.template import TemplateDoesNotExist, engines
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.module_loading import import_string
+
+from config.sqlite import copy_database, sqlite_database
+from config.templates import django_templates
+
+from . import (
+    communitystats,
+    feedcache,
+    feeds,
+    httpcache,
+    instrumentation,
+    live,
+    moderation,
+    ranking,
+    ratelimit,
+    search,
+    subscriptions,
+    tasks,
+    threads,
+)
+from .models import (
+    Comment,
+    Community,
+    CommunityActivity,
+    CommunityStats,
+    Job,
+    PageStamp,
+    Post,
+    Subscription,
+    Vote,
+)
+from .routers import PrimaryStickinessMiddleware, ReadConnectionRouter, ReplicaRouter
+from .templatetags.vote_tags import pk_url
+from .votebuffer import VoteBuffer
+from .votes import apply_votes, cast_vote, load_vote_state
+
+
+# The suite runs background tasks inline, to see them right after a write,
+# without rate limits, as all its requests share one user and address, and
+# with the query budgets enforced.
+SUITE_SETTINGS = override_settings(
+    RATE_LIMITS={**settings.RATE_LIMITS, "ENABLED": False},
+    TASKS={**settings.TASKS, "EAGER": True},
+    INSTRUMENTATION={**settings.INSTRUMENTATION, "FAIL_ON_BUDGET": True},
+)
+
+
+def setUpModule():
+    SUITE_SETTINGS.enable()
+
 
-from .models import Community, Post
+def tearDownModule():
+    SUITE_SETTINGS.disable()
 
 
 class SubmitPostTests(TestCase):
@@ -64,6 +145,7 @@ class VoteTests(TestCase):
             post_type="text",
             title="Hello",
         )
+        self.client.login(username="alice", password="pwd")
 
     def test_upvote_post(self):
         url = reverse("vote_post", args=[self.post.pk])
@@ -86,3 +168,1959 @@ class VoteTests(TestCase):
         self.post.refresh_from_db()
         self.assertEqual(self.post.score, 0)
 
+    def test_vote_records_vote_row(self):
+        url = reverse("vote_post", args=[self.post.pk])
+        self.client.post(url, {"v": "1"})
+        vote = Vote.objects.get()
+        self.assertEqual(
+            (vote.user, vote.target_type, vote.target_id, vote.value),
+            (self.user, "post", self.post.pk, 1),
+        )
+
+    def test_repeat_vote_is_deduplicated(self):
+        url = reverse("vote_post", args=[self.post.pk])
+        self.client.post(url, {"v": "1"})
+        resp = self.client.post(url, {"v": "1"})
+        self.assertContains(resp, ">1</span>")
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.score, 1)
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_changing_vote_applies_delta(self):
+        url = reverse("vote_post", args=[self.post.pk])
+        self.client.post(url, {"v": "1"})
+        resp = self.client.post(url, {"v": "-1"})
+        self.assertContains(resp, ">-1</span>")
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.score, -1)
+        self.assertEqual(Vote.objects.get().value, -1)
+
+    def test_vote_on_missing_post(self):
+        url = reverse("vote_post", args=[self.post.pk + 1])
+        resp = self.client.post(url, {"v": "1"})
+        self.assertEqual(resp.status_code, 404)
+        self.assertFalse(Vote.objects.exists())
+
+    def test_vote_requires_login(self):
+        self.client.logout()
+        url = reverse("vote_post", args=[self.post.pk])
+        resp = self.client.post(url, {"v": "1"})
+        self.assertEqual(resp.status_code, 302)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.score, 0)
+
+
+class CommentVoteTests(TestCase):
+    """Ensure comment voting and the batch endpoint share the vote engine."""
+
+    def setUp(self):
+        user_model = get_user_model()
+        self.user = user_model.objects.create_user("alice", password="pwd")
+        community = Community.objects.create(name="t", title="Test")
+        self.post = Post.objects.create(
+            community=community, author=self.user, post_type="text", title="Hello"
+        )
+        self.comment = threads.create_comment(self.post, self.user, "Nice")
+        self.client.login(username="alice", password="pwd")
+
+    def test_vote_comment(self):
+        url = reverse("vote_comment", args=[self.comment.pk])
+        self.client.post(url, {"v": "1"})
+        resp = self.client.post(url, {"v": "-1"})
+        self.assertContains(resp, f"<span id='comment-score-{self.comment.pk}'>-1</span>")
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.score, -1)
+        self.assertEqual(Vote.objects.get().target_type, "comment")
+
+    def test_vote_missing_comment(self):
+        url = reverse("vote_comment", args=[self.comment.pk + 100])
+        self.assertEqual(self.client.post(url, {"v": "1"}).status_code, 404)
+
+    def test_batch_votes(self):
+        cast_vote(self.user, "post", self.post.pk, -1)
+        votes = [
+            ["post", self.post.pk, 1],
+            ["comment", self.comment.pk, 1],
+            ["comment", self.comment.pk, -1],
+            ["comment", self.comment.pk + 100, 1],
+        ]
+        resp = self.client.post(
+            reverse("vote_batch"), {"votes": votes}, content_type="application/json"
+        )
+        self.assertEqual(
+            sorted(resp.json()["scores"]),
+            [["comment", self.comment.pk, -1], ["post", self.post.pk, 1]],
+        )
+        self.assertEqual(Vote.objects.count(), 2)
+
+    def test_batch_rejects_bad_input(self):
+        url = reverse("vote_batch")
+        for body in ({"votes": [["post", self.post.pk]]}, {"votes": [["user", 1, 1]]}, [1]):
+            resp = self.client.post(url, body, content_type="application/json")
+            self.assertEqual(resp.status_code, 400)
+        self.assertFalse(Vote.objects.exists())
+
+    def test_batch_rejects_mistyped_entries(self):
+        url = reverse("vote_batch")
+        pk = self.post.pk
+        entries = [
+            [["post"], pk, 1],
+            [None, pk, 1],
+            ["post", True, 1],
+            ["post", float(pk), 1],
+            ["post", str(pk), 1],
+            ["post", 2**63, 1],
+            ["post", -pk, 1],
+            ["post", pk, 1.9],
+            ["post", pk, True],
+            ["post", pk, "1"],
+            ["post", pk, 2],
+        ]
+        for entry in entries:
+            with self.subTest(entry=entry):
+                # A valid entry first: nothing of a rejected batch is applied.
+                body = {"votes": [["post", pk, 1], entry]}
+                resp = self.client.post(url, body, content_type="application/json")
+                self.assertEqual(resp.status_code, 400)
+        resp = self.client.post(url, {"votes": {"post": pk}}, content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(Vote.objects.exists())
+
+    def test_post_detail_renders_thread(self):
+        reply = threads.create_comment(self.post, self.user, "Reply", parent=self.comment)
+        resp = self.client.get(reverse("post_detail", args=[self.post.pk]))
+        self.assertContains(resp, "Reply")
+        self.assertContains(resp, reverse("vote_comment", args=[reply.pk]))
+
+    def test_comment_page_and_replies_endpoints(self):
+        for i in range(threads.COMMENT_PAGE_SIZE):
+            threads.create_comment(self.post, self.user, f"Comment {i}")
+        resp = self.client.get(reverse("post_detail", args=[self.post.pk]))
+        cursor = resp.context["next_cursor"]
+        # Live comments would repeat on the page still to load.
+        self.assertNotContains(resp, 'sse-swap="comment"')
+        resp = self.client.get(reverse("comment_page", args=[self.post.pk]), {"cursor": cursor})
+        self.assertContains(resp, f"Comment {threads.COMMENT_PAGE_SIZE - 1}")
+        self.assertNotContains(resp, "Load more comments")
+        self.assertContains(resp, 'sse-swap="comment"')
+
+        parent = self.comment
+        for depth in range(threads.THREAD_DEPTH + 1):
+            parent = threads.create_comment(self.post, self.user, f"depth {depth}", parent)
+        resp = self.client.get(reverse("post_detail", args=[self.post.pk]))
+        self.assertNotContains(resp, f"depth {threads.THREAD_DEPTH - 1}")
+        self.assertContains(resp, "1 more reply")
+        hidden = Comment.objects.get(body=f"depth {threads.THREAD_DEPTH - 2}")
+        resp = self.client.get(reverse("comment_replies", args=[hidden.pk]))
+        self.assertContains(resp, f"depth {threads.THREAD_DEPTH}")
+
+
+# Votes as in production: side effects queued, so that ranking the post
+# does not lengthen every vote's write transaction.
+@override_settings(TASKS={"EAGER": False})
+class ConcurrentVoteTests(TransactionTestCase):
+    """Ensure parallel votes never lose score updates."""
+
+    # Includes the optional read connection (SQLITE_READ_CONNECTION).
+    databases = "__all__"
+    voters = 2000
+
+    def setUp(self):
+        user_model = get_user_model()
+        author = user_model.objects.create_user("alice", password="pwd")
+        community = Community.objects.create(name="t", title="Test")
+        self.post = Post.objects.create(
+            community=community, author=author, post_type="text", title="Hello"
+        )
+        user_model.objects.bulk_create(
+            user_model(username=f"voter{i}") for i in range(self.voters)
+        )
+        self.users = list(user_model.objects.filter(username__startswith="voter"))
+        # The worker threads' connections use the production profile, as
+        # concurrent writers must: under Django's defaults (deferred
+        # transactions, rollback journal) two writers can deadlock, and
+        # SQLite fails one of them at once with "database is locked".
+        production = sqlite_database(connection.settings_dict["NAME"], "production")
+        options = patch.dict(connection.settings_dict, OPTIONS=production["OPTIONS"])
+        options.start()
+        self.addCleanup(self._restore_journal_mode)
+        self.addCleanup(options.stop)
+
+    def _restore_journal_mode(self):
+        # The journal mode is stored in the file; later tests expect the
+        # suite's profile.
+        connections.close_all()
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode=DELETE")
+
+    def _vote(self, user, value):
+        try:
+            return cast_vote(user, "post", self.post.pk, value)
+        finally:
+            connections.close_all()
+
+    def test_parallel_votes_are_exact(self):
+        values = [1 if i % 3 else -1 for i in range(self.voters)]
+        # Every voter also re-sends its vote, which must not count twice.
+        jobs = list(zip(self.users, values)) * 2
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            list(pool.map(lambda job: self._vote(*job), jobs))
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.score, sum(values))
+        self.assertEqual(Vote.objects.count(), self.voters)
+        call_command("run_tasks", once=True, processes=0, stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.hot_rank, ranking.hot_rank(sum(values), self.post.created_at))
+
+
+class BatchVoteTests(TestCase):
+    """Ensure batched votes dedupe per user and apply grouped deltas."""
+
+    def setUp(self):
+        user_model = get_user_model()
+        self.alice = user_model.objects.create(username="alice")
+        self.bob = user_model.objects.create(username="bob")
+        community = Community.objects.create(name="t", title="Test")
+        self.post = Post.objects.create(
+            community=community, author=self.alice, post_type="text", title="Hello"
+        )
+
+    def test_apply_votes(self):
+        cast_vote(self.alice, "post", self.post.pk, -1)
+        scores = apply_votes(
+            [
+                (self.alice.pk, "post", self.post.pk, 1),
+                (self.bob.pk, "post", self.post.pk, -1),
+                (self.bob.pk, "post", self.post.pk, 1),
+            ]
+        )
+        self.assertEqual(scores, {("post", self.post.pk): 2})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.score, 2)
+        self.assertEqual(
+            dict(Vote.objects.values_list("user__username", "value")),
+            {"alice": 1, "bob": 1},
+        )
+
+    def test_apply_votes_skips_missing_targets(self):
+        scores = apply_votes([(self.alice.pk, "post", self.post.pk + 1, 1)])
+        self.assertEqual(scores, {})
+        self.assertFalse(Vote.objects.exists())
+
+    def test_buffer_reports_pending_score_and_flushes(self):
+        buffer = VoteBuffer(flush_interval_ms=60_000)
+        self.addCleanup(buffer.stop)
+        cast_vote(self.alice, "post", self.post.pk, 1)
+
+        self.assertEqual(buffer.add(self.bob.pk, "post", self.post.pk, 1), 2)
+        self.assertEqual(buffer.add(self.alice.pk, "post", self.post.pk, -1), 0)
+        self.assertEqual(buffer.add(self.alice.pk, "post", self.post.pk, -1), 0)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.score, 1)
+
+        self.assertEqual(buffer.flush(), 2)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.score, 0)
+        self.assertEqual(buffer.add(self.bob.pk, "post", self.post.pk, -1), -2)
+        buffer.flush()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.score, -2)
+
+
+class VoteBufferFlushTests(TransactionTestCase):
+    """Ensure votes buffered while a flush commits are counted once."""
+
+    def setUp(self):
+        user_model = get_user_model()
+        self.alice = user_model.objects.create(username="alice")
+        self.bob = user_model.objects.create(username="bob")
+        community = Community.objects.create(name="t", title="Test")
+        self.post = Post.objects.create(
+            community=community, author=self.alice, post_type="text", title="Hello"
+        )
+
+    def test_add_while_flush_commits(self):
+        buffer = VoteBuffer(flush_interval_ms=60_000)
+        self.addCleanup(buffer.stop)
+        buffer.add(self.alice.pk, "post", self.post.pk, 1)
+        scores = []
+
+        def add_vote():
+            try:
+                scores.append(buffer.add(self.bob.pk, "post", self.post.pk, 1))
+            finally:
+                connections.close_all()
+
+        adder = threading.Thread(target=add_vote)
+
+        def start_adder():
+            adder.start()
+            adder.join(timeout=0.5)
+
+        def apply_then_add(votes):
+            applied = apply_votes(votes)
+            # The second vote arrives as soon as alice's is committed, before
+            # the flush has finished its own bookkeeping.
+            transaction.on_commit(start_adder)
+            return applied
+
+        with patch("core.votebuffer.apply_votes", side_effect=apply_then_add):
+            self.assertEqual(buffer.flush(), 1)
+        adder.join()
+        self.assertEqual(scores, [2])
+
+        self.assertEqual(buffer.flush(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.score, 2)
+
+
+class CommentCounterTests(TestCase):
+    """Ensure the denormalized comment counters follow the Comment table."""
+
+    def setUp(self):
+        user_model = get_user_model()
+        self.user = user_model.objects.create_user("alice", password="pwd")
+        community = Community.objects.create(name="t", title="Test")
+        self.post = Post.objects.create(
+            community=community, author=self.user, post_type="text", title="Hello"
+        )
+        self.client.login(username="alice", password="pwd")
+
+    def test_add_comment_updates_counters(self):
+        url = reverse("add_comment", args=[self.post.pk])
+        self.client.post(url, {"body": "first"})
+        self.client.post(url, {"body": "second"})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+        self.assertEqual(self.post.last_comment_at, Comment.objects.latest("pk").created_at)
+
+    def test_delete_comment_updates_counters(self):
+        url = reverse("add_comment", args=[self.post.pk])
+        self.client.post(url, {"body": "first"})
+        self.client.post(url, {"body": "second"})
+        first, second = Comment.objects.order_by("pk")
+        second.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(self.post.last_comment_at, first.created_at)
+        first.delete()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.comment_count, self.post.last_comment_at), (0, None))
+
+    def test_rebuild_command_repairs_drift(self):
+        comments = Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.user, body=str(i)) for i in range(3)
+        )
+        call_command("rebuild_post_counters", chunk_size=1, stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 3)
+        self.assertEqual(
+            self.post.last_comment_at, max(comment.created_at for comment in comments)
+        )
+
+
+class CommunityStatsTests(TestCase):
+    """Ensure community statistics follow writes and match a rebuild."""
+
+    def setUp(self):
+        cache.clear()
+        user_model = get_user_model()
+        self.alice = user_model.objects.create_user("alice", password="pwd")
+        self.bob = user_model.objects.create_user("bob", password="pwd")
+        self.community = Community.objects.create(name="t", title="Test")
+        self.client.login(username="alice", password="pwd")
+
+    def _stats(self):
+        cache.clear()
+        return communitystats.community_stats(self.community.pk)
+
+    def _write(self):
+        self.client.post(
+            reverse("submit_post", args=[self.community.name]),
+            {"post_type": "text", "title": "Hello", "body": "Hi"},
+        )
+        post = Post.objects.get()
+        self.client.post(reverse("add_comment", args=[post.pk]), {"body": "first"})
+        self.client.post(reverse("add_comment", args=[post.pk]), {"body": "second"})
+        cast_vote(self.bob, "post", post.pk, 1)
+        return post
+
+    def test_writes_update_stats(self):
+        post = self._write()
+        stats = self._stats()
+        self.assertEqual((stats.post_count, stats.comment_count), (1, 2))
+        self.assertEqual((stats.recent_posts, stats.recent_comments), (1, 2))
+        self.assertEqual(stats.active_users, 2)
+
+        Comment.objects.order_by("pk").last().delete()
+        self.assertEqual(self._stats().comment_count, 1)
+        post.delete()
+        stats = self._stats()
+        self.assertEqual((stats.post_count, stats.comment_count), (0, 0))
+        self.assertEqual((stats.recent_posts, stats.recent_comments), (0, 0))
+
+    def test_window_uses_hourly_buckets(self):
+        self._write()
+        old = timezone.now() - timedelta(hours=settings.COMMUNITY_STATS["WINDOW_HOURS"])
+        CommunityActivity.objects.create(
+            community=self.community, hour=communitystats.hour_of(old), posts=5
+        )
+        communitystats.users_active([(self.community.pk, self.bob.pk)], old)
+        stats = self._stats()
+        self.assertEqual((stats.recent_posts, stats.active_users), (1, 2))
+        self.assertEqual(communitystats.prune(), 2)
+
+    def test_rebuild_matches_incremental(self):
+        self._write()
+        expected = self._stats()
+        CommunityStats.objects.all().delete()
+        CommunityActivity.objects.all().delete()
+        Post.objects.bulk_create(
+            [Post(community=self.community, author=self.bob, post_type="text", title="Bulk")]
+        )
+        call_command("rebuild_community_stats", chunk_size=1, stdout=StringIO())
+        stats = self._stats()
+        self.assertEqual(stats.post_count, expected.post_count + 1)
+        self.assertEqual(stats.recent_posts, expected.recent_posts + 1)
+        self.assertEqual(stats.comment_count, expected.comment_count)
+        self.assertEqual(stats.active_users, expected.active_users)
+
+    def test_community_page_caches_stats(self):
+        self._write()
+        url = reverse("community", args=[self.community.name])
+        response = self.client.get(url)
+        self.assertContains(response, "1 posts, 2 comments")
+        self.assertContains(response, "2 active users")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse(
+            any("core_communitystats" in query["sql"] for query in queries.captured_queries)
+        )
+
+
+class RankingTests(TestCase):
+    """Ensure precomputed ranks follow votes and drive the feed sorts."""
+
+    def setUp(self):
+        cache.clear()
+        user_model = get_user_model()
+        self.user = user_model.objects.create_user("alice", password="pwd")
+        self.community = Community.objects.create(name="t", title="Test")
+        self.client.login(username="alice", password="pwd")
+
+    def _post(self, title, score=0, age=timedelta(0)):
+        post = Post.objects.create(
+            community=self.community, author=self.user, post_type="text", title=title
+        )
+        Post.objects.filter(pk=post.pk).update(
+            score=score, created_at=timezone.now() - age
+        )
+        ranking.refresh_post_ranks([post.pk])
+        return Post.objects.get(pk=post.pk)
+
+    def test_hot_rank_formula(self):
+        created = ranking.HOT_EPOCH + timedelta(seconds=ranking.HOT_PERIOD_SECONDS)
+        self.assertEqual(ranking.hot_rank(0, created), 1)
+        self.assertEqual(ranking.hot_rank(100, created), 3)
+        self.assertEqual(ranking.hot_rank(-10, created), 0)
+
+    def test_vote_updates_hot_rank(self):
+        post = self._post("p")
+        url = reverse("vote_post", args=[post.pk])
+        self.client.post(url, {"v": "1"})
+        post.refresh_from_db()
+        self.assertEqual(post.hot_rank, ranking.hot_rank(1, post.created_at))
+
+    def test_submit_post_sets_ranks(self):
+        url = reverse("submit_post", args=[self.community.name])
+        self.client.post(url, {"post_type": "text", "title": "Hi", "body": "", "url": ""})
+        post = Post.objects.get()
+        self.assertEqual(post.hot_rank, ranking.hot_rank(0, post.created_at))
+
+    def test_sorts(self):
+        self._post("old top", score=50, age=timedelta(days=3))
+        self._post("fresh", score=5, age=timedelta(hours=1))
+        self._post("newest", score=0)
+
+        def titles(sort, url=reverse("community", args=["t"]), **params):
+            resp = self.client.get(url, {"sort": sort, **params})
+            titles = dict(Post.objects.values_list("pk", "title"))
+            return [titles[pk] for pk in resp.context["feed"].post_ids]
+
+        self.assertEqual(titles("new"), ["newest", "fresh", "old top"])
+        self.assertEqual(titles("top", t="all"), ["old top", "fresh", "newest"])
+        self.assertEqual(titles("top", t="day"), ["fresh", "newest"])
+        self.assertEqual(titles("hot"), ["fresh", "newest", "old top"])
+        self.assertEqual(titles("rising"), ["fresh"])
+        self.assertEqual(titles("bogus"), titles("new"))
+        self.assertEqual(titles("hot", url=reverse("home")), ["fresh", "newest", "old top"])
+
+    def test_decay_zeroes_rising_rank_outside_window(self):
+        post = self._post("p", score=5, age=timedelta(hours=1))
+        self.assertGreater(post.rising_rank, 0)
+        Post.objects.filter(pk=post.pk).update(created_at=timezone.now() - timedelta(days=2))
+        call_command("update_ranks", stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.rising_rank, 0)
+
+
+class FeedPaginationTests(TestCase):
+    """Ensure keyset pagination walks every post exactly once."""
+
+    def setUp(self):
+        cache.clear()
+        user_model = get_user_model()
+        self.user = user_model.objects.create(username="alice")
+        self.community = Community.objects.create(name="t", title="Test")
+        now = timezone.now()
+        posts = Post.objects.bulk_create(
+            Post(
+                community=self.community,
+                author=self.user,
+                post_type="text",
+                title=f"Post {i}",
+                score=i % 7,
+            )
+            for i in range(120)
+        )
+        # Shared timestamps exercise the id tiebreaker.
+        for i, post in enumerate(posts):
+            Post.objects.filter(pk=post.pk).update(created_at=now - timedelta(minutes=i // 4))
+        ranking.refresh_post_ranks([post.pk for post in posts])
+
+    def _walk(self, sort, page_size):
+        queryset = feeds.sort_posts(Post.objects.all(), sort, "all")
+        seen, cursor = [], None
+        while True:
+            page, cursor = feeds.paginate(queryset, sort, cursor, page_size)
+            seen.extend(post.pk for post in page)
+            if cursor is None:
+                return seen
+
+    def test_walks_all_sorts_in_order(self):
+        for sort in ("new", "hot", "top"):
+            with self.subTest(sort=sort):
+                expected = list(
+                    feeds.sort_posts(Post.objects.all(), sort, "all").values_list("pk", flat=True)
+                )
+                self.assertEqual(self._walk(sort, page_size=7), expected)
+
+    def test_invalid_or_foreign_cursor_restarts(self):
+        queryset = feeds.sort_posts(Post.objects.all(), "new")
+        first, cursor = feeds.paginate(queryset, "new", page_size=10)
+        self.assertEqual(feeds.paginate(queryset, "new", "garbage", 10)[0], first)
+        self.assertEqual(feeds.decode_cursor("hot", cursor), None)
+
+    def test_mistyped_cursor_restarts(self):
+        def craft(*payload):
+            token = base64.urlsafe_b64encode(json.dumps(payload).encode())
+            return token.decode().rstrip("=")
+
+        home, community = reverse("home"), reverse("community", args=[self.community.name])
+        pages = [
+            (home, "hot", craft("hot", "2020-01-01", 1)),
+            (community, "top", craft("top", "2020-01-01", 1)),
+            (community, "new", craft("new", True, 1)),
+            (community, "new", craft("new", "2020-01-01", 1)),
+            (community, "hot", craft("hot", float("inf"), 1)),
+            (community, "top", craft("top", 5, 2**64)),
+        ]
+        subscriptions.subscribe(self.user, self.community)
+        for login in (False, True):
+            if login:
+                # The personal feed compares cursors with its cached rows.
+                self.client.force_login(self.user)
+            for url, sort, cursor in pages:
+                with self.subTest(url=url, sort=sort, cursor=cursor, login=login):
+                    first = self.client.get(url, {"sort": sort}).context["feed"].post_ids
+                    resp = self.client.get(url, {"sort": sort, "cursor": cursor})
+                    self.assertEqual(resp.status_code, 200)
+                    self.assertEqual(resp.context["feed"].post_ids, first)
+
+        post = Post.objects.first()
+        threads.create_comment(post, self.user, "first")
+        url = reverse("comment_page", args=[post.pk])
+        for cursor in (craft("comments", 5, 1), craft("comments", "2020-01-01", 1)):
+            with self.subTest(cursor=cursor):
+                resp = self.client.get(url, {"cursor": cursor})
+                self.assertContains(resp, "first")
+
+    def test_htmx_load_more_renders_only_rows(self):
+        url = reverse("community", args=[self.community.name])
+        resp = self.client.get(url)
+        self.assertEqual(len(resp.context["feed"].post_ids), feeds.PAGE_SIZE)
+        cursor = resp.context["feed"].next_cursor
+        resp = self.client.get(url, {"cursor": cursor}, HTTP_HX_REQUEST="true")
+        self.assertNotContains(resp, "<html")
+        self.assertContains(resp, "post-score-", count=feeds.PAGE_SIZE * 3)
+        cursor = re.search(r"cursor=([\w-]+)", resp.content.decode()).group(1)
+        resp = self.client.get(url, {"cursor": cursor}, HTTP_HX_REQUEST="true")
+        self.assertContains(resp, "post-score-", count=20 * 3)
+        self.assertNotContains(resp, "Load more")
+
+
+class PersonalFeedTests(TestCase):
+    """Ensure subscriptions drive a merged feed equal to one big query."""
+
+    def setUp(self):
+        cache.clear()
+        user_model = get_user_model()
+        self.user = user_model.objects.create_user("alice", password="pwd")
+        self.communities = Community.objects.bulk_create(
+            Community(name=f"c{i}", title=f"C{i}") for i in range(6)
+        )
+        now = timezone.now()
+        # Uneven community sizes, shared timestamps and tied scores.
+        posts = Post.objects.bulk_create(
+            Post(
+                community=self.communities[(i * i) % 5],
+                author=self.user,
+                post_type="text",
+                title=f"Post {i}",
+                score=i % 4,
+                created_at=now - timedelta(minutes=i // 3),
+            )
+            for i in range(90)
+        )
+        ranking.refresh_post_ranks([post.pk for post in posts])
+        self.client.login(username="alice", password="pwd")
+
+    def _walk(self, community_ids, sort, page_size):
+        seen, cursor = [], None
+        while True:
+            page, cursor = subscriptions.personal_page(
+                community_ids, sort, "all", cursor, page_size
+            )
+            seen.extend(post.pk for post in page)
+            if cursor is None:
+                return seen
+
+    def _expected(self, community_ids, sort):
+        queryset = Post.objects.filter(community_id__in=community_ids)
+        return list(feeds.sort_posts(queryset, sort, "all").values_list("pk", flat=True))
+
+    def test_merge_matches_single_query(self):
+        community_ids = [community.pk for community in self.communities[:4]]
+        # "rising" also filters, on rising_rank > 0.
+        for sort in ("new", "hot", "top", "rising"):
+            for page_size in (1, 7, 50):
+                with self.subTest(sort=sort, page_size=page_size):
+                    self.assertEqual(
+                        self._walk(community_ids, sort, page_size),
+                        self._expected(community_ids, sort),
+                    )
+
+    def test_merge_reads_streams_in_few_statements(self):
+        community_ids = [community.pk for community in self.communities]
+        with self.settings(PERSONAL_FEED={"CACHE_MIN_SUBSCRIPTIONS": None}):
+            with patch.object(feeds, "MERGE_CHUNK", 2):
+                with CaptureQueriesContext(connection) as queries:
+                    subscriptions.personal_page(community_ids, "new", page_size=10)
+        sql = [query["sql"] for query in queries.captured_queries]
+        # The first round reads six streams, two per statement.
+        self.assertGreaterEqual(sum("UNION ALL" in statement for statement in sql), 3)
+        self.assertFalse(any('"community_id" IN' in statement for statement in sql))
+
+    def test_cached_feed_pages_past_its_depth(self):
+        community_ids = [community.pk for community in self.communities]
+        config = {"CACHE_MIN_SUBSCRIPTIONS": 1, "CACHE_DEPTH": 10, "CACHE_TTL": 60}
+        with self.settings(PERSONAL_FEED=config):
+            for sort in ("new", "top"):
+                with self.subTest(sort=sort):
+                    expected = self._expected(community_ids, sort)
+                    self.assertEqual(self._walk(community_ids, sort, 4), expected)
+                    # A second walk starts from the cache.
+                    self.assertEqual(self._walk(community_ids, sort, 4), expected)
+
+    def test_subscribe_and_home_feed(self):
+        home = reverse("home")
+        self.assertEqual(len(self.client.get(home).context["feed"].post_ids), 50)
+        community = self.communities[1]
+        url = reverse("subscribe", args=[community.name])
+        self.client.post(url)
+        self.assertEqual(communitystats.community_stats(community.pk).subscriber_count, 1)
+        response = self.client.get(home)
+        self.assertTrue(response.context["personal"])
+        self.assertEqual(
+            list(response.context["feed"].post_ids), self._expected([community.pk], "new")
+        )
+        self.assertEqual(len(self.client.get(reverse("all_posts")).context["feed"].post_ids), 50)
+
+        self.client.post(url)
+        self.assertFalse(Subscription.objects.exists())
+        cache.clear()
+        self.assertEqual(communitystats.community_stats(community.pk).subscriber_count, 0)
+        self.assertNotIn("personal", self.client.get(home).context)
+
+
+class FeedCacheTests(TestCase):
+    """Ensure cached feed pages are reused and invalidated precisely."""
+
+    def setUp(self):
+        cache.clear()
+        user_model = get_user_model()
+        self.user = user_model.objects.create_user("alice", password="pwd")
+        self.community = Community.objects.create(name="t", title="Test")
+        self.post = Post.objects.create(
+            community=self.community, author=self.user, post_type="text", title="Hello"
+        )
+        self.url = reverse("community", args=[self.community.name])
+
+    def _stats(self):
+        return feedcache.feed_cache_stats()
+
+    def test_hit_serves_fresh_score_and_comment_count(self):
+        self.client.get(self.url)
+        before = self._stats()
+        Post.objects.filter(pk=self.post.pk).update(score=7, comment_count=1)
+        with self.assertNumQueries(2):  # community with its page stamp + score refresh
+            resp = self.client.get(self.url)
+        self.assertEqual(self._stats()["hits"], before["hits"] + 1)
+        self.assertContains(resp, f'<span id="post-score-{self.post.pk}">7</span>', html=True)
+        self.assertContains(resp, "1 comment")
+        self.assertNotContains(resp, "<!--")
+
+    def test_new_post_invalidates_community_and_home(self):
+        self.client.get(self.url)
+        self.client.get(reverse("home"))
+        Post.objects.create(
+            community=self.community, author=self.user, post_type="text", title="Second"
+        )
+        before = self._stats()
+        self.assertContains(self.client.get(self.url), "Second")
+        self.assertContains(self.client.get(reverse("home")), "Second")
+        self.assertEqual(self._stats()["misses"], before["misses"] + 2)
+
+    def test_other_community_is_not_invalidated(self):
+        other = Community.objects.create(name="o", title="Other")
+        self.client.get(self.url)
+        Post.objects.create(community=other, author=self.user, post_type="text", title="X")
+        before = self._stats()
+        self.client.get(self.url)
+        self.assertEqual(self._stats()["hits"], before["hits"] + 1)
+
+    def test_file_based_backend(self):
+        with tempfile.TemporaryDirectory() as location, self.settings(
+            FEED_CACHE={"ALIAS": "files"},
+            CACHES={
+                "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+                "files": {
+                    "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": location,
+                },
+            },
+        ):
+            self.client.get(self.url)
+            before = self._stats()
+            self.assertContains(self.client.get(self.url), "Hello")
+            self.assertEqual(self._stats()["hits"], before["hits"] + 1)
+
+
+class VoteStateTests(TestCase):
+    """Ensure the viewer's votes are loaded in bulk and never cached."""
+
+    def setUp(self):
+        cache.clear()
+        user_model = get_user_model()
+        self.user = user_model.objects.create_user("alice", password="pwd")
+        self.other = user_model.objects.create_user("bob", password="pwd")
+        self.community = Community.objects.create(name="t", title="Test")
+        self.url = reverse("community", args=[self.community.name])
+
+    def _add_posts(self, count):
+        posts = [
+            Post.objects.create(
+                community=self.community, author=self.user, post_type="text", title=f"P{i}"
+            )
+            for i in range(count)
+        ]
+        for post in posts[::2]:
+            cast_vote(self.user, "post", post.pk, 1)
+        return posts
+
+    def _captured(self, url):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        return context.captured_queries
+
+    def test_load_vote_state(self):
+        post = self._add_posts(1)[0]
+        comment = threads.create_comment(post, self.user, "c")
+        cast_vote(self.user, "comment", comment.pk, -1)
+        with self.assertNumQueries(1):
+            state = load_vote_state(self.user, {"post": [post.pk], "comment": [comment.pk]})
+        self.assertEqual(state, {("post", post.pk): 1, ("comment", comment.pk): -1})
+        self.assertEqual(load_vote_state(self.other, {"post": [post.pk]}), {})
+        with self.assertNumQueries(0):
+            self.assertEqual(load_vote_state(AnonymousUser(), {"post": [post.pk]}), {})
+
+    def test_feed_queries_do_not_grow_with_page_size(self):
+        self.client.login(username="alice", password="pwd")
+        # session + user + subscriptions + (posts on a miss | scores on a
+        # hit) + votes; on a community page the community lookup instead of
+        # the subscriptions, the subscription check and, on a miss, the
+        # sidebar stats.
+        expected = {reverse("home"): (5, 5), self.url: (9, 6)}
+        for count in (3, feeds.PAGE_SIZE - 3):
+            self._add_posts(count)
+            cache.clear()
+            for url, queries in expected.items():
+                for expected_queries in queries:
+                    with self.assertNumQueries(expected_queries):
+                        self.client.get(url)
+
+    def test_cached_page_is_marked_per_viewer(self):
+        post = self._add_posts(1)[0]
+        up = re.compile(rf'class="vote up voted"[^>]*{reverse("vote_post", args=[post.pk])}')
+        self.client.login(username="alice", password="pwd")
+        self.assertRegex(self.client.get(self.url).content.decode(), up)
+        self.client.login(username="bob", password="pwd")
+        before = feedcache.feed_cache_stats()
+        body = self.client.get(self.url).content.decode()
+        self.assertEqual(feedcache.feed_cache_stats()["hits"], before["hits"] + 1)
+        self.assertNotIn("voted", body)
+        self.assertNotIn("<!--", body)
+
+    def test_post_detail_marks_votes_in_one_query(self):
+        post = self._add_posts(1)[0]
+        comments = [threads.create_comment(post, self.user, f"c{i}") for i in range(5)]
+        for comment in comments[:3]:
+            cast_vote(self.user, "comment", comment.pk, -1)
+        self.client.login(username="alice", password="pwd")
+        body = self.client.get(reverse("post_detail", args=[post.pk])).content.decode()
+        self.assertEqual(body.count("vote up voted"), 1)
+        self.assertEqual(body.count("vote down voted"), 3)
+        votes = [
+            query["sql"]
+            for query in self._captured(reverse("post_detail", args=[post.pk]))
+            if '"core_vote"' in query["sql"]
+        ]
+        self.assertEqual(len(votes), 1)
+
+
+class CommentThreadTests(TestCase):
+    """Ensure threads are stored as paths and load in a single query."""
+
+    def setUp(self):
+        user_model = get_user_model()
+        self.user = user_model.objects.create_user("alice", password="pwd")
+        community = Community.objects.create(name="t", title="Test")
+        self.post = Post.objects.create(
+            community=community, author=self.user, post_type="text", title="Hello"
+        )
+
+    def _comment(self, body, parent=None):
+        return threads.create_comment(self.post, self.user, body, parent=parent)
+
+    def test_encode_segment_sorts_numerically(self):
+        segments = [threads.encode_segment(pk) for pk in (1, 9, 10, 35, 36, 1295, 1296)]
+        self.assertEqual(segments, sorted(segments))
+        self.assertEqual({len(segment) for segment in segments}, {threads.SEGMENT_WIDTH})
+
+    def test_reply_via_view(self):
+        parent = self._comment("parent")
+        self.client.login(username="alice", password="pwd")
+        url = reverse("add_comment", args=[self.post.pk])
+        self.client.post(url, {"body": "child", "parent": parent.pk})
+        child = Comment.objects.get(body="child")
+        self.assertEqual((child.parent, child.depth), (parent, 1))
+        self.assertEqual(child.path, parent.path + threads.encode_segment(child.pk))
+        parent.refresh_from_db()
+        self.assertEqual(parent.reply_count, 1)
+
+    def test_reply_to_other_post_is_rejected(self):
+        other = Post.objects.create(
+            community=self.post.community, author=self.user, post_type="text", title="Other"
+        )
+        foreign = threads.create_comment(other, self.user, "elsewhere")
+        self.client.login(username="alice", password="pwd")
+        url = reverse("add_comment", args=[self.post.pk])
+        self.client.post(url, {"body": "child", "parent": foreign.pk})
+        self.assertFalse(Comment.objects.filter(body="child").exists())
+
+    def test_thread_structure_and_limits(self):
+        a = self._comment("a")
+        a1 = self._comment("a1", a)
+        a1x = self._comment("a1x", a1)
+        self._comment("a1xy", a1x)
+        a2 = self._comment("a2", a)
+        b = self._comment("b")
+
+        with self.assertNumQueries(1):
+            roots = threads.load_thread(self.post, depth=None)
+        self.assertEqual(roots, [a, b])
+        self.assertEqual(roots[0].children, [a1, a2])
+        self.assertEqual(roots[0].children[0].children[0].children[0].body, "a1xy")
+
+        roots = threads.load_thread(self.post, depth=2)
+        self.assertEqual(roots[0].children[0].children, [])
+        self.assertEqual(roots[0].children[0].more_replies, 1)
+
+        replies = threads.load_thread(self.post, root=a1, depth=1)
+        self.assertEqual(replies, [a1x])
+        self.assertEqual(replies[0].more_replies, 1)
+
+    def test_deleting_reply_updates_parent(self):
+        parent = self._comment("parent")
+        child = self._comment("child", parent)
+        child.delete()
+        parent.refresh_from_db()
+        self.assertEqual(parent.reply_count, 0)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+    def test_comment_pages_walk_all_roots(self):
+        roots = [self._comment(f"root {i}") for i in range(45)]
+        for root in roots[::10]:
+            self._comment("reply", self._comment("reply", root))
+        # Shared timestamps exercise the id tiebreaker.
+        Comment.objects.filter(depth=0, pk__lte=roots[20].pk).update(
+            created_at=roots[0].created_at
+        )
+
+        seen, cursor = [], None
+        while True:
+            with self.assertNumQueries(2):
+                page, cursor = threads.load_page(self.post, cursor, page_size=10)
+            seen.extend(page)
+            if cursor is None:
+                break
+        self.assertEqual([comment.pk for comment in seen], [root.pk for root in roots])
+        self.assertEqual(seen[10].children[0].children[0].body, "reply")
+        self.assertEqual(seen[11].children, [])
+
+    def test_large_thread_loads_in_one_query(self):
+        # 10k top-level comments with four replies each, inserted with
+        # precomputed ids and paths.
+        comments = []
+        pk = 0
+        for _ in range(10_000):
+            pk += 1
+            root_pk, root_path = pk, threads.encode_segment(pk)
+            comments.append(
+                Comment(
+                    pk=pk,
+                    post=self.post,
+                    author=self.user,
+                    body="root",
+                    path=root_path,
+                    reply_count=4,
+                )
+            )
+            for _ in range(4):
+                pk += 1
+                comments.append(
+                    Comment(
+                        pk=pk,
+                        post=self.post,
+                        parent_id=root_pk,
+                        author=self.user,
+                        body="reply",
+                        path=root_path + threads.encode_segment(pk),
+                        depth=1,
+                    )
+                )
+        Comment.objects.bulk_create(comments, batch_size=5000)
+
+        with self.assertNumQueries(1):
+            roots = threads.load_thread(self.post, limit=None)
+        self.assertEqual(len(roots), 10_000)
+        self.assertTrue(all(len(root.children) == 4 for root in roots))
+
+        with self.assertNumQueries(1):
+            roots = threads.load_thread(self.post, limit=threads.THREAD_LIMIT)
+        self.assertEqual(len(roots), threads.THREAD_LIMIT // 5)
+
+
+class SearchTests(TestCase):
+    """Ensure the full-text index follows posts and comments."""
+
+    def setUp(self):
+        user_model = get_user_model()
+        self.user = user_model.objects.create(username="alice")
+        self.news = Community.objects.create(name="news", title="News")
+        self.pics = Community.objects.create(name="pics", title="Pics")
+        self.title_hit = self._post(self.news, "Kittens everywhere", "")
+        self.body_hit = self._post(self.news, "Daily thread", "so many kittens today")
+        self.elsewhere = self._post(self.pics, "Kitten photo", "")
+        self.comment = threads.create_comment(self.body_hit, self.user, "I love kittens")
+
+    def _post(self, community, title, body):
+        return Post.objects.create(
+            community=community, author=self.user, post_type="text", title=title, body=body
+        )
+
+    def test_ranked_post_search_with_stemming(self):
+        self.assertEqual(
+            search.search_posts("kitten"), [self.title_hit, self.elsewhere, self.body_hit]
+        )
+        self.assertEqual(search.search_posts("kittens", self.news), [self.title_hit, self.body_hit])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.title_hit.title = "Puppies"
+        self.title_hit.save()
+        self.elsewhere.delete()
+        self.assertEqual(search.search_posts("kitten"), [self.body_hit])
+        self.assertEqual(search.search_posts("puppies"), [self.title_hit])
+
+    def test_score_updates_do_not_touch_index(self):
+        Post.objects.filter(pk=self.body_hit.pk).update(score=5)
+        self.assertEqual(len(search.search_posts("kittens")), 3)
+
+    def test_comment_search(self):
+        self.assertEqual(search.search_comments("love kitten"), [self.comment])
+        self.assertEqual(search.search_comments("love", self.pics), [])
+
+    def test_user_input_is_not_fts_syntax(self):
+        for query in ['"', "kitten OR", "title:kitten", "NEAR(", "*"]:
+            search.search_posts(query)
+
+    def test_search_view(self):
+        resp = self.client.get(reverse("search"), {"q": "kittens", "r": "pics"})
+        self.assertEqual(list(resp.context["results"]), [self.elsewhere])
+        resp = self.client.get(reverse("search"), {"q": "love", "type": "comments"})
+        self.assertContains(resp, "Daily thread")
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO core_post_fts(core_post_fts) VALUES ('delete-all')")
+        self.assertEqual(search.search_posts("kitten"), [])
+        call_command("rebuild_search_index", chunk_size=2, stdout=StringIO())
+        self.assertEqual(len(search.search_posts("kitten")), 3)
+
+
+class SeedDemoTests(TestCase):
+    """Ensure the synthetic data generator is consistent and deterministic."""
+
+    options = {
+        "users": 20,
+        "communities": 3,
+        "posts": 40,
+        "comments": 300,
+        "votes": 400,
+        "batch_size": 15,
+        "stdout": StringIO(),
+    }
+
+    def _snapshot(self):
+        return (
+            list(Post.objects.order_by("pk").values_list("title", "community", "score")),
+            list(Comment.objects.order_by("pk").values_list("path", "score", "reply_count")),
+            sorted(Vote.objects.values_list("user", "target_type", "target_id", "value")),
+        )
+
+    def test_seed_is_consistent_and_deterministic(self):
+        call_command("seed_demo", **self.options)
+        self.assertEqual(Post.objects.count(), 40)
+        self.assertEqual(Comment.objects.count(), 300)
+        self.assertTrue(get_user_model().objects.filter(username="alice").exists())
+
+        out = StringIO()
+        call_command("rebuild_post_counters", stdout=out)
+        self.assertIn("repaired 0", out.getvalue())
+        for target_type, model in (("post", Post), ("comment", Comment)):
+            totals = dict(
+                Vote.objects.filter(target_type=target_type)
+                .values_list("target_id")
+                .annotate(total=Sum("value"))
+                .order_by()
+            )
+            for pk, score in model.objects.values_list("pk", "score"):
+                self.assertEqual(score, totals.get(pk, 0))
+        for comment in Comment.objects.filter(parent__isnull=False).select_related("parent"):
+            self.assertTrue(comment.path.startswith(comment.parent.path))
+            self.assertEqual(comment.depth, comment.parent.depth + 1)
+            self.assertGreaterEqual(comment.created_at, comment.parent.created_at)
+
+        snapshot = self._snapshot()
+        Vote.objects.all().delete()
+        Community.objects.all().delete()
+        get_user_model().objects.exclude(username__in=["alice", "bob"]).delete()
+        call_command("seed_demo", **self.options)
+        self.assertEqual(self._snapshot(), snapshot)
+
+
+class BenchEndpointsTests(TestCase):
+    """Ensure the endpoint benchmark reports every scenario."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_results_are_written_and_compared(self):
+        call_command(
+            "seed_demo", users=5, communities=2, posts=10, comments=30, votes=40, stdout=StringIO()
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            first = os.path.join(directory, "first.json")
+            options = {"requests": 3, "warmup": 0, "stdout": StringIO()}
+            call_command("bench_endpoints", output=first, **options)
+            with open(first) as f:
+                results = json.load(f)
+            self.assertEqual(results["posts"], 10)
+            self.assertEqual(
+                set(results["scenarios"]),
+                {"home", "community", "post_detail", "submit_post", "add_comment", "vote_post"},
+            )
+            home = results["scenarios"]["home"]
+            self.assertEqual(home["requests"], 3)
+            self.assertEqual(home["errors"], 0)
+            self.assertGreater(home["queries"], 0)
+
+            out = StringIO()
+            call_command(
+                "bench_endpoints",
+                scenarios=["home"],
+                output=os.path.join(directory, "second.json"),
+                compare=first,
+                **{**options, "stdout": out},
+            )
+            self.assertIn("Compared with", out.getvalue())
+
+
+class InstrumentationTests(TestCase):
+    """Ensure requests are measured per view and held to their query budgets."""
+
+    def setUp(self):
+        instrumentation.reset_stats()
+        cache.clear()
+        user_model = get_user_model()
+        self.user = user_model.objects.create_user("alice", password="pwd")
+        self.community = Community.objects.create(name="t", title="Test")
+        Post.objects.create(
+            community=self.community, author=self.user, post_type="text", title="Hello"
+        )
+
+    def test_records_metrics_and_server_timing(self):
+        with self.settings(INSTRUMENTATION={"SERVER_TIMING": True}):
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get(reverse("home"))
+        self.assertRegex(
+            resp["Server-Timing"],
+            rf'^db;dur=[\d.]+;desc="{len(queries)} queries", tpl;dur=[\d.]+, total;dur=[\d.]+$',
+        )
+        self.client.get(reverse("home"))
+        stats = instrumentation.view_stats()["home"]
+        self.assertEqual(stats["count"], 2)
+        self.assertEqual(set(stats), {"count", *instrumentation.METRICS})
+        self.assertGreater(stats["template_ms"]["p99"], 0)
+        self.assertGreaterEqual(stats["total_ms"]["p99"], stats["db_ms"]["p99"])
+
+    def test_rolling_window(self):
+        with self.settings(INSTRUMENTATION={"WINDOW": 3}):
+            for _ in range(5):
+                self.client.get(reverse("home"))
+        self.assertEqual(instrumentation.view_stats()["home"]["count"], 3)
+
+    def test_query_budget(self):
+        with self.settings(QUERY_BUDGETS={"home": 0}):
+            with self.settings(INSTRUMENTATION={"FAIL_ON_BUDGET": True}):
+                with self.assertRaises(instrumentation.QueryBudgetExceeded):
+                    self.client.get(reverse("home"))
+            with self.settings(INSTRUMENTATION={"FAIL_ON_BUDGET": False}):
+                with self.assertLogs("core.instrumentation", "WARNING"):
+                    self.assertEqual(self.client.get(reverse("home")).status_code, 200)
+
+    def test_backend_reports_template_errors(self):
+        backend = engines.all()[0]
+        with self.assertRaises(TemplateDoesNotExist) as caught:
+            backend.get_template("core/missing.html")
+        self.assertIs(caught.exception.backend, backend)
+        template = backend.from_string("{{ name }}")
+        self.assertEqual(template.render({"name": "alice"}), "alice")
+        self.assertIsNotNone(template.origin)
+
+    def test_stats_endpoint_is_staff_only(self):
+        self.client.get(reverse("home"))
+        url = reverse("request_stats")
+        self.client.login(username="alice", password="pwd")
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.user.is_staff = True
+        self.user.save()
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["views"]["home"]["count"], 1)
+
+
+class AsyncViewTests(TestCase):
+    """Ensure the async views serve the ASGI request path end to end."""
+
+    def setUp(self):
+        instrumentation.reset_stats()
+        cache.clear()
+        self.user = get_user_model().objects.create_user("alice", password="pwd")
+        self.community = Community.objects.create(name="t", title="Test")
+        self.post = Post.objects.create(
+            community=self.community, author=self.user, post_type="text", title="Hello"
+        )
+        self.comment = threads.create_comment(self.post, self.user, "First")
+        cast_vote(self.user, "comment", self.comment.pk, 1)
+
+    def test_middleware_is_async_capable(self):
+        for path in settings.MIDDLEWARE:
+            self.assertTrue(import_string(path).async_capable, path)
+
+    async def test_pages(self):
+        await self.async_client.aforce_login(self.user)
+        for url in (
+            reverse("home"),
+            reverse("community", args=[self.community.name]),
+            reverse("post_detail", args=[self.post.pk]),
+            reverse("comment_page", args=[self.post.pk]),
+        ):
+            with self.subTest(url=url):
+                resp = await self.async_client.get(url)
+                self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, "First")
+        self.assertContains(resp, 'class="vote up voted"')
+        resp = await self.async_client.get(reverse("post_detail", args=[self.post.pk + 1]))
+        self.assertEqual(resp.status_code, 404)
+
+    async def test_queries_are_measured(self):
+        with self.settings(INSTRUMENTATION={"SERVER_TIMING": True}):
+            sync_timing = (await sync_to_async(self.client.get)(reverse("home")))["Server-Timing"]
+            cache.clear()
+            async_timing = (await self.async_client.get(reverse("home")))["Server-Timing"]
+        self.assertRegex(async_timing, r'desc="[1-9]\d* queries"')
+        self.assertEqual(
+            re.search(r"\d+ queries", async_timing)[0], re.search(r"\d+ queries", sync_timing)[0]
+        )
+
+    async def test_vote(self):
+        url = reverse("vote_post", args=[self.post.pk])
+        resp = await self.async_client.post(url, {"v": 1})
+        self.assertEqual(resp.status_code, 302)
+        await self.async_client.aforce_login(self.user)
+        resp = await self.async_client.post(url, {"v": 1})
+        self.assertContains(resp, f"<span id='post-score-{self.post.pk}'>1</span>")
+        url = reverse("vote_comment", args=[self.comment.pk])
+        resp = await self.async_client.post(url, {"v": -1})
+        self.assertContains(resp, ">-1</span>")
+        resp = await self.async_client.post(reverse("vote_post", args=[0]), {"v": 1})
+        self.assertEqual(resp.status_code, 404)
+        await self.post.arefresh_from_db()
+        self.assertEqual(self.post.score, 1)
+
+
+class LiveUpdateTests(TestCase):
+    """Ensure post pages get coalesced live updates over server-sent events."""
+
+    live = {"INTERVAL_MS": 100, "HEARTBEAT": 0.2, "MAX_DURATION": 2}
+
+    def setUp(self):
+        cache.clear()
+        user_model = get_user_model()
+        self.user = user_model.objects.create_user("alice", password="pwd")
+        self.community = Community.objects.create(name="t", title="Test")
+        self.post = Post.objects.create(
+            community=self.community, author=self.user, post_type="text", title="Hello"
+        )
+        self.comment = threads.create_comment(self.post, self.user, "First")
+        self.url = reverse("post_live", args=[self.post.pk])
+
+    def test_subscription_coalesces_and_bounds_updates(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        subscription = live.Subscription(self.post.pk, loop, max_pending=2)
+        for score, comment_id in ((1, 10), (2, 11), (3, 12)):
+            subscription.push(score=score, comment_id=comment_id)
+        self.assertEqual(subscription.take(), (3, [11, 12]))
+        self.assertEqual(subscription.take(), (None, []))
+
+    async def test_stream_sends_votes_and_comments(self):
+        await self.async_client.aforce_login(self.user)
+        with self.settings(LIVE_UPDATES=self.live):
+            resp = await self.async_client.get(self.url)
+            self.assertEqual(resp["Content-Type"], "text/event-stream")
+            stream = resp.streaming_content
+            first = (await anext(stream)).decode()
+            self.assertIn(f"event: post-score-{self.post.pk}\n", first)
+            self.assertIn(f"data: <span id='post-score-{self.post.pk}'>0</span>\n", first)
+
+            vote_url = reverse("vote_post", args=[self.post.pk])
+            await self.async_client.post(vote_url, {"v": 1})
+            await self.async_client.post(vote_url, {"v": -1})
+            comment_url = reverse("add_comment", args=[self.post.pk])
+            await self.async_client.post(comment_url, {"body": "Second"})
+            reply = {"body": "Reply", "parent": self.comment.pk}
+            await self.async_client.post(comment_url, reply)
+
+            update = (await anext(stream)).decode()
+            self.assertEqual(update.count("event: post-score-"), 1)
+            self.assertIn(">-1</span>", update)
+            self.assertIn("event: comment\n", update)
+            self.assertIn("Second", update)
+            self.assertIn(f"event: reply-{self.comment.pk}\n", update)
+            rest = [chunk.decode() async for chunk in stream]
+        self.assertIn(": keepalive\n\n", rest)
+        self.assertEqual(live.hub.connection_count(), 0)
+
+    async def test_connection_limit(self):
+        with self.settings(LIVE_UPDATES={**self.live, "MAX_CONNECTIONS": 1}):
+            first = await self.async_client.get(self.url)
+            resp = await self.async_client.get(self.url)
+            self.assertEqual(resp.status_code, 503)
+            self.assertIn("Retry-After", resp)
+            first.close()
+            resp = await self.async_client.get(self.url)
+            self.assertEqual(resp.status_code, 200)
+            resp.close()
+        self.assertEqual(live.hub.connection_count(), 0)
+
+    def test_not_served_over_wsgi(self):
+        self.assertEqual(self.client.get(self.url).status_code, 501)
+
+
+class SQLiteProfileTests(TestCase):
+    """Ensure the SQLite profiles configure connections as documented."""
+
+    def test_production_profile(self):
+        database = sqlite_database("db.sqlite3", "production")
+        self.assertEqual(database["OPTIONS"]["transaction_mode"], "IMMEDIATE")
+        self.assertGreater(database["CONN_MAX_AGE"], 0)
+        pragmas = dict(
+            command.split("=") for command in database["OPTIONS"]["init_command"].split(";")
+        )
+        self.assertEqual(pragmas["PRAGMA journal_mode"], "WAL")
+        self.assertEqual(pragmas["PRAGMA synchronous"], "NORMAL")
+        read_only = sqlite_database("db.sqlite3", "production", read_only=True)
+        self.assertIn("PRAGMA query_only=ON", read_only["OPTIONS"]["init_command"])
+        self.assertNotIn("journal_mode", read_only["OPTIONS"]["init_command"])
+        self.assertNotIn("init_command", sqlite_database("db.sqlite3", "development")["OPTIONS"])
+
+    def test_connection_uses_profile(self):
+        # The suite's own connections follow SQLITE_PROFILE, which is
+        # "development" while DEBUG is on.
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "db.sqlite3")
+        probe = ConnectionHandler({"default": sqlite_database(path, "production")})["default"]
+        self.addCleanup(probe.close)
+        with probe.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("PRAGMA synchronous")
+            # NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_copy_database(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        source, target = (os.path.join(directory.name, name) for name in ("a.db", "b.db"))
+        with closing(sqlite3.connect(source)) as db, db:
+            db.execute("CREATE TABLE t (x)")
+            db.execute("INSERT INTO t VALUES (1)")
+        for profile, journal_mode in (("production", "wal"), ("development", "delete")):
+            with self.subTest(profile=profile):
+                copy_database(source, target, profile)
+                with closing(sqlite3.connect(target)) as db:
+                    self.assertEqual(db.execute("SELECT x FROM t").fetchall(), [(1,)])
+                    self.assertEqual(db.execute("PRAGMA journal_mode").fetchone(), (journal_mode,))
+
+    def test_read_router(self):
+        router = ReadConnectionRouter()
+        self.assertEqual(router.db_for_write(Post), "default")
+        # TestCase wraps every test in a transaction on default.
+        self.assertEqual(router.db_for_read(Post), "default")
+        self.assertFalse(router.allow_migrate("reader", "core"))
+
+
+@override_settings(REPLICATION={"REPLICAS": ["replica"], "STICKY_SECONDS": 5})
+class ReplicaRouterTests(SimpleTestCase):
+    """Ensure reads go to replicas unless they could miss the client's own writes."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+
+    def route(self, request):
+        """Return the alias reads go to during ``request``, and the response."""
+
+        aliases = []
+
+        def get_response(request):
+            aliases.append(self.router.db_for_read(Post))
+            return HttpResponse()
+
+        response = PrimaryStickinessMiddleware(get_response)(request)
+        return aliases[0], response
+
+    def test_reads_go_to_replicas(self):
+        self.assertEqual(self.router.db_for_read(Post), "replica")
+        self.assertEqual(self.router.db_for_write(Post), "default")
+        alias, response = self.route(self.factory.get("/"))
+        self.assertEqual(alias, "replica")
+        self.assertNotIn("read_primary", response.cookies)
+        with override_settings(REPLICATION={"REPLICAS": []}):
+            self.assertEqual(self.router.db_for_read(Post), "default")
+
+    def test_writer_reads_from_primary(self):
+        alias, response = self.route(self.factory.post("/"))
+        self.assertEqual(alias, "default")
+        self.assertEqual(response.cookies["read_primary"]["max-age"], 5)
+
+        request = self.factory.get("/")
+        request.COOKIES["read_primary"] = response.cookies["read_primary"].value
+        self.assertEqual(self.route(request)[0], "default")
+        # Only for the requests that carry the cookie.
+        self.assertEqual(self.route(self.factory.get("/"))[0], "replica")
+        self.assertEqual(self.router.db_for_read(Post), "replica")
+
+    async def test_async_requests(self):
+        aliases = []
+
+        async def get_response(request):
+            aliases.append(self.router.db_for_read(Post))
+            return HttpResponse()
+
+        middleware = PrimaryStickinessMiddleware(get_response)
+        await middleware(self.factory.get("/"))
+        response = await middleware(self.factory.post("/"))
+        self.assertEqual(aliases, ["replica", "default"])
+        self.assertIn("read_primary", response.cookies)
+
+
+class RenderingTests(TestCase):
+    """Ensure rows share their partials and HTMX requests get only fragments."""
+
+    def setUp(self):
+        cache.clear()
+        user_model = get_user_model()
+        self.user = user_model.objects.create_user("alice", password="pwd")
+        self.community = Community.objects.create(name="t", title="Test")
+        self.post = Post.objects.create(
+            community=self.community, author=self.user, post_type="text", title="Hello"
+        )
+        self.comment = threads.create_comment(self.post, self.user, "First")
+        self.client.login(username="alice", password="pwd")
+
+    def test_production_profile(self):
+        entry = django_templates("backend", [], "production")
+        self.assertFalse(entry["APP_DIRS"])
+        self.assertFalse(entry["OPTIONS"]["debug"])
+        self.assertEqual(entry["OPTIONS"]["loaders"][0][0], "django.template.loaders.cached.Loader")
+        self.assertTrue(django_templates("backend", [], "development")["APP_DIRS"])
+
+    def test_pk_url_matches_reverse(self):
+        for name in ("post_detail", "vote_post", "vote_comment", "comment_replies"):
+            self.assertEqual(pk_url(42, name), reverse(name, args=[42]))
+
+    def test_vote_buttons_shared_by_posts_and_comments(self):
+        cast_vote(self.user, "post", self.post.pk, 1)
+        cast_vote(self.user, "comment", self.comment.pk, -1)
+        resp = self.client.get(reverse("post_detail", args=[self.post.pk]))
+        content = resp.content.decode()
+        vote_post = reverse("vote_post", args=[self.post.pk])
+        vote_comment = reverse("vote_comment", args=[self.comment.pk])
+        self.assertIn(f'class="vote up voted"\n        hx-post="{vote_post}"', content)
+        self.assertIn(f'class="vote down voted"\n        hx-post="{vote_comment}"', content)
+        self.assertIn(f'sse-swap="post-score-{self.post.pk}"', content)
+        self.assertEqual(content.count("hx-vals="), 4)
+
+    def test_htmx_sort_change_renders_only_the_feed(self):
+        url = reverse("community", args=[self.community.name])
+        page = self.client.get(url)
+        self.assertContains(page, '<div id="feed">')
+        with CaptureQueriesContext(connection) as page_queries:
+            self.client.get(url, {"sort": "top"})
+        with CaptureQueriesContext(connection) as fragment_queries:
+            resp = self.client.get(
+                url, {"sort": "top"}, HTTP_HX_REQUEST="true", HTTP_HX_TARGET="feed"
+            )
+        self.assertNotContains(resp, "<html")
+        self.assertNotContains(resp, "subscribers")
+        self.assertContains(resp, "<nav>")
+        self.assertContains(resp, f"post-score-{self.post.pk}")
+        # Neither the sidebar stats nor the subscription are loaded.
+        self.assertLess(len(fragment_queries), len(page_queries))
+
+    def test_htmx_subscribe_renders_only_the_form(self):
+        url = reverse("subscribe", args=[self.community.name])
+        resp = self.client.post(url, HTTP_HX_REQUEST="true")
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, "Unsubscribe")
+        self.assertNotContains(resp, "<html")
+        resp = self.client.post(url, HTTP_HX_REQUEST="true")
+        self.assertContains(resp, ">Subscribe<")
+        self.assertFalse(Subscription.objects.exists())
+
+
+class ConditionalGetTests(TestCase):
+    """Ensure anonymous repeat requests are answered 304 from version stamps."""
+
+    def setUp(self):
+        cache.clear()
+        user_model = get_user_model()
+        self.user = user_model.objects.create_user("alice", password="pwd")
+        self.community = Community.objects.create(name="t", title="Test")
+        self.post = Post.objects.create(
+            community=self.community, author=self.user, post_type="text", title="Hello"
+        )
+        self.urls = [
+            reverse("home"),
+            reverse("all_posts") + "?sort=hot",
+            reverse("community", args=[self.community.name]),
+            reverse("post_detail", args=[self.post.pk]),
+        ]
+
+    def _revalidate(self, url, resp, **extra):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=resp["ETag"], **extra)
+
+    def _clock(self, now):
+        """Set the time core.httpcache sees to ``now`` seconds."""
+
+        clock = patch("core.httpcache.time").start()
+        self.addCleanup(patch.stopall)
+        clock.time.return_value = now
+        clock.time_ns.return_value = int(now * 10**9)
+
+    def test_anonymous_pages_are_public_and_revalidate(self):
+        # Once the second of the last change is over.
+        self._clock(time.time() + 2)
+        for url in self.urls:
+            with self.subTest(url=url):
+                resp = self.client.get(url)
+                self.assertEqual(resp.status_code, 200)
+                # Ranked sorts change with time alone.
+                self.assertEqual("Last-Modified" in resp, "sort=hot" not in url)
+                self.assertIn("public", resp["Cache-Control"])
+                self.assertIn("max-age=", resp["Cache-Control"])
+                self.assertIn("HX-Request", resp["Vary"])
+                self.assertNotIn(settings.CSRF_COOKIE_NAME, resp.cookies)
+                # The stamp, with the community on a community page.
+                with self.assertNumQueries(1):
+                    again = self._revalidate(url, resp)
+                self.assertEqual(again.status_code, 304)
+                self.assertEqual(again["ETag"], resp["ETag"])
+                if "Last-Modified" in resp:
+                    modified = self.client.get(
+                        url, HTTP_IF_MODIFIED_SINCE=resp["Last-Modified"]
+                    )
+                    self.assertEqual(modified.status_code, 304)
+
+    def test_if_modified_since_alone(self):
+        start = 3600 * 500_000 + 1800  # Half past an hour.
+        url, scope = self.urls[3], httpcache.post_scope(self.post.pk)
+        self._clock(start + 0.1)
+        httpcache.touch(scope)
+        self._clock(start + 0.2)
+        # The second is still running: no Last-Modified to trust yet.
+        self.assertNotIn("Last-Modified", self.client.get(url))
+        self._clock(start + 0.3)
+        httpcache.touch(scope)
+        self._clock(start + 0.4)
+        resp = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(start))
+        self.assertEqual(resp.status_code, 200)
+
+        self._clock(start + 2)
+        resp = self.client.get(url)
+        self.assertEqual(resp["Last-Modified"], http_date(start))
+        since = {"HTTP_IF_MODIFIED_SINCE": resp["Last-Modified"]}
+        self.assertEqual(self.client.get(url, **since).status_code, 304)
+        # Ranked sorts never offer it, so a date alone never matches.
+        ranked = self.urls[1]
+        self.assertNotIn("Last-Modified", self.client.get(ranked))
+        self.assertEqual(self.client.get(ranked, **since).status_code, 200)
+        # A new hour moves it, for the hourly sidebar counts.
+        self._clock(start + 3600)
+        self.assertEqual(self.client.get(url, **since).status_code, 200)
+
+    def test_stamps_only_increase(self):
+        scope = httpcache.post_scope(self.post.pk)
+        self._clock(time.time() + 60)
+        httpcache.touch(scope)
+        first = PageStamp.objects.get(scope=scope).stamp
+        httpcache.touch(scope)
+        self.assertEqual(PageStamp.objects.get(scope=scope).stamp, first + 1)
+        # A clock stepping back does not move it back.
+        self._clock(time.time() - 60)
+        httpcache.touch(scope)
+        self.assertEqual(PageStamp.objects.get(scope=scope).stamp, first + 2)
+
+    def test_htmx_fragment_has_its_own_etag(self):
+        url = self.urls[1]
+        page = self.client.get(url)
+        fragment = self.client.get(url, HTTP_HX_REQUEST="true")
+        self.assertNotEqual(page["ETag"], fragment["ETag"])
+        self.assertEqual(self._revalidate(url, page, HTTP_HX_REQUEST="true").status_code, 200)
+
+    def test_changes_invalidate(self):
+        other = Community.objects.create(name="other", title="Other")
+        other_url = reverse("community", args=[other.name])
+        now = time.time()
+        self._clock(now)
+        responses = {url: self.client.get(url) for url in [*self.urls, other_url]}
+
+        stamps = dict(PageStamp.objects.values_list("scope", "stamp"))
+        cast_vote(self.user, "post", self.post.pk, 1)
+        # A vote stamps its post's page only...
+        changed = {
+            scope
+            for scope, stamp in PageStamp.objects.values_list("scope", "stamp")
+            if stamps.get(scope) != stamp
+        }
+        self.assertEqual(changed, {httpcache.post_scope(self.post.pk)})
+        post_url = self.urls[3]
+        self.assertEqual(self._revalidate(post_url, responses[post_url]).status_code, 200)
+        for url in [*self.urls[:3], other_url]:
+            self.assertEqual(self._revalidate(url, responses[url]).status_code, 304)
+        # ...and the feeds catch up with the next period.
+        self._clock(now + settings.HTTP_CACHE["RANKED_PERIOD"])
+        for url in self.urls[:3]:
+            self.assertEqual(self._revalidate(url, responses[url]).status_code, 200)
+
+        resp = self.client.get(post_url)
+        threads.create_comment(self.post, self.user, "First")
+        self.assertEqual(self._revalidate(post_url, resp).status_code, 200)
+
+        resp = self.client.get(other_url)
+        subscriptions.subscribe(self.user, other)
+        self.assertEqual(self._revalidate(other_url, resp).status_code, 200)
+
+    def test_stamps_are_shared_through_the_database(self):
+        url = self.urls[3]
+        resp = self.client.get(url)
+        # Nothing lives in this process's cache...
+        cache.clear()
+        self.assertEqual(self._revalidate(url, resp).status_code, 304)
+        # ...and a change stamped by another process is seen.
+        PageStamp.objects.filter(scope=httpcache.post_scope(self.post.pk)).update(
+            stamp=F("stamp") + 10**9
+        )
+        self.assertEqual(self._revalidate(url, resp).status_code, 200)
+        # Removing content from a command invalidates its pages.
+        resp = self.client.get(self.urls[2])
+        call_command("remove_content", "posts", community="t", stdout=StringIO())
+        self.assertEqual(self._revalidate(self.urls[2], resp).status_code, 200)
+
+    def test_signed_in_pages_are_private(self):
+        self.client.login(username="alice", password="pwd")
+        for url in self.urls:
+            with self.subTest(url=url):
+                resp = self.client.get(url)
+                self.assertEqual(resp.status_code, 200)
+                self.assertNotIn("ETag", resp)
+                self.assertIn("private", resp["Cache-Control"])
+                self.assertIn("no-cache", resp["Cache-Control"])
+        resp = self.client.get(self.urls[3])
+        self.assertContains(resp, "Add comment")
+
+
+@override_settings(
+    RATE_LIMITS={
+        "ENABLED": True,
+        "ALIAS": "ratelimit",
+        "POLICIES": {
+            "vote": {"user": "3/m", "ip": "100/m"},
+            "submit_post": {"user": "3/m", "ip": "2/m"},
+        },
+    }
+)
+class RateLimitTests(TestCase):
+    """Ensure the write endpoints are rate limited without touching the database."""
+
+    def setUp(self):
+        caches["ratelimit"].clear()
+        user_model = get_user_model()
+        self.user = user_model.objects.create_user("alice", password="pwd")
+        self.community = Community.objects.create(name="t", title="Test")
+        self.post = Post.objects.create(
+            community=self.community, author=self.user, post_type="text", title="Hello"
+        )
+
+    def test_parse_rate(self):
+        self.assertEqual(ratelimit.parse_rate("10/m"), (10, 60))
+        self.assertEqual(ratelimit.parse_rate("5/10m"), (5, 600))
+        with self.assertRaises(ImproperlyConfigured):
+            ratelimit.parse_rate("10 per minute")
+
+    def test_sliding_window(self):
+        store = caches["ratelimit"]
+        start = 6000.0  # The start of a 60 second window.
+        results = [ratelimit.hit("k", 10, 60, start + i, store) for i in range(11)]
+        self.assertEqual(results[:10], [0] * 10)
+        self.assertEqual(results[10], 60 - 10)
+        # Half way through the next window the previous one still weighs
+        # 11 * 0.5, so four more requests fit under 10.
+        results = [ratelimit.hit("k", 10, 60, start + 90, store) for _ in range(5)]
+        self.assertEqual(results, [0, 0, 0, 0, 30])
+        # A window later the blocked attempts have aged out.
+        self.assertEqual(ratelimit.hit("k", 10, 60, start + 181, store), 0)
+
+    def test_vote_limited_per_user(self):
+        self.client.login(username="alice", password="pwd")
+        url = reverse("vote_post", args=[self.post.pk])
+        for value in ("1", "-1", "1"):
+            self.assertEqual(self.client.post(url, {"v": value}).status_code, 200)
+        resp = self.client.post(url, {"v": "-1"})
+        self.assertEqual(resp.status_code, 429)
+        self.assertGreater(int(resp["Retry-After"]), 0)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.score, 1)
+
+        # Other users have their own count.
+        get_user_model().objects.create_user("bob", password="pwd")
+        self.client.login(username="bob", password="pwd")
+        self.assertEqual(self.client.post(url, {"v": "1"}).status_code, 200)
+
+    def test_anonymous_limited_per_ip(self):
+        url = reverse("submit_post", args=[self.community.name])
+        other_ip = {"REMOTE_ADDR": "10.0.0.2"}
+        self.assertEqual(self.client.post(url, {}).status_code, 200)
+        self.assertEqual(self.client.post(url, {}).status_code, 200)
+        self.assertEqual(self.client.post(url, {}).status_code, 429)
+        self.assertEqual(self.client.post(url, {}, **other_ip).status_code, 200)
+        # Only the policy's methods count.
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_check_runs_no_queries(self):
+        request = RequestFactory().post("/", REMOTE_ADDR="2001:db8::1")
+        with self.assertNumQueries(0):
+            self.assertEqual(ratelimit.check(request, "vote", self.user), 0)
+            self.assertEqual(ratelimit.check(request, "vote", AnonymousUser()), 0)
+        self.assertEqual(ratelimit.client_ip(request), "2001:db8::")
+
+    def test_disabled(self):
+        request = RequestFactory().post("/")
+        with override_settings(RATE_LIMITS={"ENABLED": False}):
+            for _ in range(5):
+                self.assertEqual(ratelimit.check(request, "vote", self.user), 0)
+
+
+def create_communities_task(jobs):
+    """A task for the tests: create the named communities, failing on ``fail``."""
+
+    for args in jobs:
+        if args.get("fail"):
+            raise ValueError("boom")
+        Community.objects.create(name=args["name"], title=args["name"])
+
+
+@override_settings(TASKS={"EAGER": False, "RETRY_DELAY": 0, "MAX_ATTEMPTS": 2})
+class TaskQueueTests(TestCase):
+    """Ensure writes queue their side effects and run_tasks runs them."""
+
+    def setUp(self):
+        cache.clear()
+        user_model = get_user_model()
+        self.alice = user_model.objects.create_user("alice", password="pwd")
+        self.bob = user_model.objects.create_user("bob", password="pwd")
+        self.community = Community.objects.create(name="t", title="Test")
+        self.post = Post.objects.create(
+            community=self.community, author=self.alice, post_type="text", title="Hello"
+        )
+        # The post's own jobs.
+        self._run_tasks()
+
+    def _run_tasks(self):
+        call_command("run_tasks", once=True, processes=0, stdout=StringIO())
+
+    def test_votes_queue_deduplicated_jobs(self):
+        hot_rank = Post.objects.get(pk=self.post.pk).hot_rank
+        for user in (self.alice, self.bob, self.alice):
+            cast_vote(user, "post", self.post.pk, 1)
+        cast_vote(self.alice, "post", self.post.pk, -1)
+        counts = dict(
+            Job.objects.values_list("task").annotate(n=Count("pk")).order_by()
+        )
+        # One rank refresh; one activity job per voter.
+        self.assertEqual(
+            counts,
+            {"core.ranking.refresh_ranks_task": 1, "core.communitystats.record_activity": 2},
+        )
+        self.assertEqual(Post.objects.get(pk=self.post.pk).hot_rank, hot_rank)
+
+        self._run_tasks()
+        self.assertFalse(Job.objects.exists())
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.hot_rank, ranking.hot_rank(0, post.created_at))
+        self.assertEqual(communitystats.community_stats(self.community.pk).active_users, 2)
+
+    def test_jobs_of_a_task_run_as_one_batch(self):
+        for body in ("one", "two", "three"):
+            threads.create_comment(self.post, self.bob, body)
+        batches = tasks.claim(100)
+        self.assertEqual(len(batches["core.communitystats.record_activity"]), 3)
+        for task, jobs in batches.items():
+            self.assertEqual(tasks.run_batch(task, jobs), [])
+        stats = CommunityStats.objects.get(community=self.community)
+        self.assertEqual((stats.post_count, stats.comment_count), (1, 3))
+        self.assertEqual(
+            CommunityActivity.objects.get(community=self.community).comments, 3
+        )
+        self.assertFalse(Job.objects.exists())
+
+    def test_rebuild_drops_queued_counts(self):
+        for body in ("one", "two"):
+            threads.create_comment(self.post, self.alice, body)
+        cast_vote(self.bob, "post", self.post.pk, 1)
+        call_command("rebuild_community_stats", stdout=StringIO())
+        # Only the voter's activity is left queued.
+        activity = Job.objects.filter(task="core.communitystats.record_activity")
+        self.assertEqual(list(activity.values_list("args__user", flat=True)), [self.bob.pk])
+        self._run_tasks()
+        stats = communitystats.community_stats(self.community.pk)
+        self.assertEqual((stats.post_count, stats.comment_count), (1, 2))
+        self.assertEqual((stats.recent_posts, stats.recent_comments), (1, 2))
+        self.assertEqual(stats.active_users, 2)
+
+    def test_failures_retried_then_kept(self):
+        tasks.enqueue(
+            "core.tests.create_communities_task", [{"name": "ok"}, {"name": "bad", "fail": True}]
+        )
+        self._run_tasks()
+        # The batch failed as a whole, then its good job ran alone.
+        self.assertTrue(Community.objects.filter(name="ok").exists())
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn("boom", job.last_error)
+
+    def test_expired_lease_released(self):
+        tasks.enqueue("core.tests.create_communities_task", [{"name": "late"}])
+        self.assertEqual(len(tasks.claim(10)), 1)
+        self.assertEqual(tasks.claim(10), {})
+        later = timezone.now() + timedelta(seconds=tasks.task_settings()["LEASE"] + 1)
+        batches = tasks.claim(10, now=later)
+        self.assertEqual(batches["core.tests.create_communities_task"][0][1], {"name": "late"})
+
+    @override_settings(TASKS={"EAGER": True})
+    def test_eager_runs_inline(self):
+        tasks.enqueue("core.tests.create_communities_task", [{"name": "now"}])
+        self.assertTrue(Community.objects.filter(name="now").exists())
+        self.assertFalse(Job.objects.exists())
+
+
+class ModerationTests(TestCase):
+    """Ensure bulk removals work in chunks and leave no votes or stale counts."""
+
+    def setUp(self):
+        user_model = get_user_model()
+        self.alice = user_model.objects.create_user("alice", password="pwd")
+        self.bob = user_model.objects.create_user("bob", password="pwd")
+        self.community = Community.objects.create(name="t", title="Test")
+        self.other = Community.objects.create(name="other", title="Other")
+        self.posts = [
+            Post.objects.create(
+                community=self.community, author=self.alice, post_type="text", title=f"P{i}"
+            )
+            for i in range(3)
+        ]
+        self.kept = Post.objects.create(
+            community=self.other, author=self.alice, post_type="text", title="Kept"
+        )
+
+    def _thread(self, post):
+        """A root comment with a reply and a reply to that, and a second root."""
+
+        root = threads.create_comment(post, self.bob, "root")
+        reply = threads.create_comment(post, self.alice, "reply", parent=root)
+        nested = threads.create_comment(post, self.bob, "nested", parent=reply)
+        other = threads.create_comment(post, self.bob, "other")
+        return root, reply, nested, other
+
+    def test_remove_posts_in_chunks(self):
+        for post in self.posts + [self.kept]:
+            root = self._thread(post)[0]
+            cast_vote(self.bob, "post", post.pk, 1)
+            cast_vote(self.alice, "comment", root.pk, -1)
+        chunks = []
+        tally = moderation.remove_posts(
+            Post.objects.filter(community=self.community), chunk_size=6, progress=chunks.append
+        )
+        self.assertEqual((tally.posts, tally.comments, tally.votes), (3, 12, 6))
+        # A post and its four comments fit in a chunk of six; two do not.
+        self.assertEqual(tally.chunks, 3)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(list(Post.objects.all()), [self.kept])
+        self.assertEqual(Comment.objects.count(), 4)
+        self.assertEqual(
+            set(Vote.objects.values_list("target_type", "target_id")),
+            {("post", self.kept.pk), ("comment", root.pk)},
+        )
+        stats = CommunityStats.objects.get(community=self.community)
+        self.assertEqual((stats.post_count, stats.comment_count), (0, 0))
+        activity = CommunityActivity.objects.get(community=self.community)
+        self.assertEqual((activity.posts, activity.comments), (0, 0))
+        stats = CommunityStats.objects.get(community=self.other)
+        self.assertEqual((stats.post_count, stats.comment_count), (1, 4))
+
+    def test_large_thread_removed_over_chunks_and_archived(self):
+        post = self.posts[0]
+        self._thread(post)
+        for comment in Comment.objects.filter(post=post):
+            cast_vote(self.alice, "comment", comment.pk, 1)
+        stream = StringIO()
+        with override_settings(TASKS={"EAGER": False}):
+            tally = moderation.remove_posts(
+                Post.objects.filter(pk=post.pk),
+                chunk_size=2,
+                archive=moderation.archive_writer(stream),
+            )
+        # Two chunks of comments, deepest first, then the post.
+        self.assertEqual((tally.posts, tally.comments, tally.votes, tally.chunks), (1, 4, 4, 3))
+        self.assertFalse(Post.objects.filter(pk=post.pk).exists())
+        # Nothing was queued or stamped for the post on its way out.
+        self.assertFalse(Job.objects.filter(task="core.ranking.refresh_ranks_task").exists())
+        self.assertFalse(PageStamp.objects.filter(scope=httpcache.post_scope(post.pk)).exists())
+        [line] = stream.getvalue().splitlines()
+        archived = json.loads(line)
+        self.assertEqual(archived["title"], "P0")
+        self.assertEqual(archived["community__name"], "t")
+        self.assertEqual(
+            [comment["body"] for comment in archived["comments"]],
+            ["root", "reply", "nested", "other"],
+        )
+
+    def test_remove_comments_takes_replies(self):
+        post = self.posts[0]
+        root, reply, nested, other = self._thread(post)
+        cast_vote(self.alice, "comment", nested.pk, 1)
+        with CaptureQueriesContext(connection) as queries:
+            tally = moderation.remove_comments(
+                Comment.objects.filter(pk=reply.pk), chunk_size=1
+            )
+        self.assertEqual((tally.comments, tally.votes, tally.chunks), (2, 1, 2))
+        # Subtrees are path ranges on the (post, path) index, never LIKE.
+        self.assertFalse(any(" LIKE " in query["sql"] for query in queries.captured_queries))
+        self.assertEqual(set(Comment.objects.all()), {root, other})
+        root.refresh_from_db()
+        self.assertEqual(root.reply_count, 0)
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 2)
+        self.assertEqual(post.last_comment_at, other.created_at)
+        stats = CommunityStats.objects.get(community=self.community)
+        self.assertEqual(stats.comment_count, 2)
+
+    def test_purge_community(self):
+        Subscription.objects.create(user=self.bob, community=self.community)
+        self._thread(self.posts[0])
+        out = StringIO()
+        call_command("purge_community", "t", interactive=False, chunk_size=2, stdout=out)
+        self.assertIn("Purged r/t: 3 posts, 4 comments", out.getvalue())
+        self.assertFalse(Community.objects.filter(name="t").exists())
+        self.assertFalse(Subscription.objects.exists())
+        self.assertEqual(list(Post.objects.all()), [self.kept])
+
+    def test_remove_content_command(self):
+        with self.assertRaises(CommandError):
+            call_command("remove_content", "posts", stdout=StringIO())
+        self._thread(self.kept)
+        call_command("remove_content", "comments", user="bob", stdout=StringIO())
+        # Bob's replies went, and alice's reply below bob's root with them.
+        self.assertFalse(Comment.objects.exists())
+        call_command("remove_content", "posts", community="t", stdout=StringIO())
+        self.assertEqual(list(Post.objects.all()), [self.kept])
+
+    def test_admin_actions(self):
+        admin_user = get_user_model().objects.create_superuser("admin", password="pwd")
+        self.client.force_login(admin_user)
+        url = reverse("admin:core_post_changelist")
+        response = self.client.get(url)
+        self.assertNotContains(response, "delete_selected")
+        response = self.client.post(
+            url,
+            {"action": "remove_posts", "_selected_action": [self.posts[0].pk, self.posts[1].pk]},
+            follow=True,
+        )
+        self.assertContains(response, "Removed 2 posts")
+        self.assertEqual(Post.objects.filter(community=self.community).count(), 1)
@@ -0,0 +1,198 @@
+"""Threaded comments stored as materialized paths.
+
+Every comment's ``path`` is its parent's path followed by its own id,
+encoded as ``SEGMENT_WIDTH`` base-36 digits. Because the segments are
+fixed width, sorting by path lists a thread depth first with siblings in
+creation order, and a comment's subtree is exactly the rows whose path
+starts with its own. Loading a thread (or a depth- and size-limited part
+of it) is therefore one ordered range scan on the ``(post, path)`` index,
+and the tree is assembled in a single pass over the rows.
+"""
+
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from . import communitystats, counters, httpcache
+from .feeds import decode_cursor, encode_cursor
+from .models import Comment
+
+
+SEGMENT_WIDTH = 8
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+MAX_DEPTH = Comment._meta.get_field("path").max_length // SEGMENT_WIDTH - 1
+
+# How much of a thread post_detail and the replies endpoint render at once.
+THREAD_DEPTH = 6
+THREAD_LIMIT = 500
+# Top-level comments per page of post_detail, and the cap on replies
+# rendered below one page.
+COMMENT_PAGE_SIZE = 20
+PAGE_REPLY_LIMIT = 500
+
+
+def encode_segment(pk):
+    """Return ``pk`` as a fixed-width base-36 path segment."""
+
+    digits = []
+    while pk:
+        pk, remainder = divmod(pk, 36)
+        digits.append(DIGITS[remainder])
+    return "".join(reversed(digits)).rjust(SEGMENT_WIDTH, "0")
+
+
+def subtree_end(path):
+    """Return the smallest path that sorts after every descendant of ``path``.
+
+    Prefix matches are expressed as a ``path`` range rather than ``LIKE``,
+    which SQLite cannot answer from the index.
+    """
+
+    return path + "~"
+
+
+def create_comment(post, author, body, parent=None):
+    """Create a comment (a reply when ``parent`` is given) with its path.
+
+    Replies nested deeper than ``MAX_DEPTH`` are attached to the deepest
+    allowed ancestor instead. Also updates the post's comment counters and
+    the community's statistics, and marks the pages showing them changed.
+    """
+
+    while parent is not None and parent.depth >= MAX_DEPTH:
+        parent = parent.parent
+    with transaction.atomic():
+        comment = Comment.objects.create(
+            post=post,
+            parent=parent,
+            author=author,
+            body=body,
+            depth=parent.depth + 1 if parent else 0,
+        )
+        comment.path = (parent.path if parent else "") + encode_segment(comment.pk)
+        Comment.objects.filter(pk=comment.pk).update(path=comment.path)
+        if parent is not None:
+            Comment.objects.filter(pk=parent.pk).update(reply_count=F("reply_count") + 1)
+        counters.comment_added(comment)
+        communitystats.comment_added(comment, post.community_id)
+        httpcache.comment_changed(post.pk, post.community_id)
+    return comment
+
+
+def load_thread(post, root=None, depth=THREAD_DEPTH, limit=THREAD_LIMIT):
+    """Return the top-level nodes of a post's comment tree.
+
+    With ``root`` only that comment's replies are loaded. At most ``depth``
+    levels below the starting point and ``limit`` comments are fetched, in
+    a single query. Every returned comment has a ``children`` list and a
+    ``more_replies`` count of direct replies that were not loaded.
+    """
+
+    queryset = Comment.objects.filter(post=post).select_related("author")
+    base_depth = 0
+    if root is not None:
+        queryset = queryset.filter(path__gt=root.path, path__lt=subtree_end(root.path))
+        base_depth = root.depth + 1
+    if depth is not None:
+        queryset = queryset.filter(depth__lt=base_depth + depth)
+    queryset = queryset.order_by("path")
+    if limit is not None:
+        queryset = queryset[:limit]
+    return build_tree(queryset)
+
+
+def load_page(post, cursor=None, page_size=COMMENT_PAGE_SIZE, depth=THREAD_DEPTH):
+    """Return ``(roots, next_cursor)`` for one page of a post's comments.
+
+    Top-level comments are paged oldest first with a keyset cursor on
+    ``(created_at, id)`` served by the ``(post, depth, created_at)`` index.
+    Their replies, down to ``depth`` levels and at most
+    ``PAGE_REPLY_LIMIT`` of them, come from one more query over the roots'
+    path ranges. ``next_cursor`` is ``None`` on the last page.
+    """
+
+    roots, next_cursor = _split_roots(list(_page_roots(post, cursor, page_size)), page_size)
+    if not roots:
+        return [], None
+    replies = _page_replies(post, roots, depth)
+    _assemble(roots, list(replies) if replies is not None else [])
+    return roots, next_cursor
+
+
+async def aload_page(post, cursor=None, page_size=COMMENT_PAGE_SIZE, depth=THREAD_DEPTH):
+    """Async version of :func:`load_page`."""
+
+    roots = [comment async for comment in _page_roots(post, cursor, page_size)]
+    roots, next_cursor = _split_roots(roots, page_size)
+    if not roots:
+        return [], None
+    replies = _page_replies(post, roots, depth)
+    _assemble(roots, [comment async for comment in replies] if replies is not None else [])
+    return roots, next_cursor
+
+
+def _page_roots(post, cursor, page_size):
+    roots = Comment.objects.filter(post=post, depth=0).select_related("author")
+    position = decode_cursor("comments", cursor, "created_at")
+    if position is not None:
+        created_at, pk = position
+        roots = roots.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk),
+            created_at__gte=created_at,
+        )
+    return roots.order_by("created_at", "pk")[: page_size + 1]
+
+
+def _split_roots(roots, page_size):
+    if len(roots) <= page_size:
+        return roots, None
+    roots = roots[:page_size]
+    return roots, encode_cursor("comments", roots[-1], "created_at")
+
+
+def _page_replies(post, roots, depth):
+    if depth <= 1:
+        return None
+    ranges = reduce(
+        or_,
+        (Q(path__gt=root.path, path__lt=subtree_end(root.path)) for root in roots),
+    )
+    return (
+        Comment.objects.filter(ranges, post=post, depth__lt=depth)
+        .select_related("author")
+        .order_by("path")[:PAGE_REPLY_LIMIT]
+    )
+
+
+def _assemble(roots, replies):
+    build_tree(sorted([*roots, *replies], key=lambda comment: comment.path))
+
+
+def walk(roots):
+    """Yield every comment of a forest returned by :func:`build_tree`."""
+
+    stack = list(roots)
+    while stack:
+        comment = stack.pop()
+        yield comment
+        stack.extend(comment.children)
+
+
+def build_tree(comments):
+    """Assemble comments ordered by path into a forest in one pass."""
+
+    nodes = {}
+    roots = []
+    for comment in comments:
+        comment.children = []
+        nodes[comment.path] = comment
+        parent = nodes.get(comment.path[:-SEGMENT_WIDTH])
+        if parent is None:
+            roots.append(comment)
+        else:
+            parent.children.append(comment)
+    for comment in nodes.values():
+        comment.more_replies = comment.reply_count - len(comment.children)
+    return roots
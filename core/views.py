@@ -1,36 +1,182 @@
-"""Core application views."""
+"""Core application views.
 
+The feeds, post pages and vote endpoints are async views: under ASGI they
+run on the event loop and query through the async ORM instead of holding
+a thread each. Writes still go through the synchronous vote engine in a
+single ``sync_to_async`` call, since transactions are not available to
+async code.
+"""
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, HttpResponseBadRequest
-from django.shortcuts import get_object_or_404, redirect, render
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect, render
 from django.views.decorators.http import require_POST
 
+from . import (
+    feedcache,
+    httpcache,
+    instrumentation,
+    live,
+    ranking,
+    search as search_index,
+    subscriptions,
+    threads,
+)
+from .communitystats import acommunity_stats
+from .feeds import SORT_ORDERINGS, TOP_PERIODS, apaginate, parse_sort, sort_posts
 from .forms import PostForm, CommentForm
-from .models import Community, Post, Comment
+from .models import Community, Post, Comment, Subscription
+from .ratelimit import rate_limit
+from .votebuffer import get_vote_buffer
+from .votes import (
+    TARGET_MODELS,
+    VOTE_VALUES,
+    aload_vote_state,
+    apply_votes,
+    cast_vote,
+    load_vote_state,
+)
+
+
+MAX_VOTE_BATCH = 500
+
 
+async def home(request):
+    """Display the posts of the user's communities, or of all of them."""
 
-def home(request):
+    user = await request.auser()
+    community_ids = await subscriptions.asubscribed_community_ids(user)
+    if not community_ids:
+        return await all_posts(request)
+    sort, period = parse_sort(request.GET)
+    feed = await sync_to_async(subscriptions.personal_feed)(
+        user, community_ids, sort, period, request.GET.get("cursor")
+    )
+    context = {"feed": feed, "personal": True, **_sort_context(sort, period)}
+    # A signed-in user's feed: only marked private.
+    validators = await httpcache.avalidators(request, user, httpcache.home_scope())
+    return httpcache.finish(_render_feed(request, "core/home.html", context), validators)
+
+
+async def all_posts(request):
     """Display the latest posts across all communities."""
 
-    posts = (
-        Post.objects.select_related("community", "author")
-        .order_by("-created_at")[:50]
+    user = await request.auser()
+    sort, period = parse_sort(request.GET)
+    validators = await httpcache.avalidators(request, user, httpcache.home_scope(), sort)
+    if response := httpcache.not_modified(request, validators):
+        return response
+    cursor = request.GET.get("cursor")
+    queryset = sort_posts(Post.objects.select_related("community", "author"), sort, period)
+    feed = await feedcache.afeed_page(
+        feedcache.home_scope(),
+        sort,
+        period,
+        cursor,
+        lambda: apaginate(queryset, sort, cursor),
+        user=user,
+        show_community=True,
     )
-    return render(request, "core/home.html", {"posts": posts})
+    context = {"feed": feed, **_sort_context(sort, period)}
+    return httpcache.finish(_render_feed(request, "core/home.html", context), validators)
 
 
-def community(request, name):
+async def community(request, name):
     """Display posts for a specific community."""
 
-    community = get_object_or_404(Community, name=name)
-    posts = (
-        community.posts.select_related("author")
-        .order_by("-created_at")[:50]
+    # With its page stamp, so that a 304 costs this one query.
+    communities = Community.objects.annotate(page_stamp=httpcache.community_stamp())
+    community = await aget_object_or_404(communities, name=name)
+    user = await request.auser()
+    sort, period = parse_sort(request.GET)
+    validators = httpcache.validators(request, user, community.page_stamp, sort)
+    if response := httpcache.not_modified(request, validators):
+        return response
+    cursor = request.GET.get("cursor")
+    queryset = sort_posts(community.posts.select_related("author"), sort, period)
+    feed = await feedcache.afeed_page(
+        feedcache.community_scope(community.pk),
+        sort,
+        period,
+        cursor,
+        lambda: apaginate(queryset, sort, cursor),
+        user=user,
     )
-    context = {"community": community, "posts": posts}
-    return render(request, "core/community.html", context)
+    context = {"community": community, "feed": feed, **_sort_context(sort, period)}
+    # Feed fragments leave the sidebar as it is.
+    if not _feed_fragment(request):
+        context["stats"] = await acommunity_stats(community.pk)
+        if user.is_authenticated:
+            context["subscribed"] = await Subscription.objects.filter(
+                user=user, community=community
+            ).aexists()
+    return httpcache.finish(_render_feed(request, "core/community.html", context), validators)
+
+
+def _sort_context(sort, period):
+    return {
+        "sort": sort,
+        "period": period,
+        "sorts": list(SORT_ORDERINGS),
+        "periods": list(TOP_PERIODS),
+    }
+
+
+def _feed_fragment(request):
+    # HTMX requests get only what they replace: the next page's rows when
+    # loading more, the sort links and the feed when changing the sort.
+    return bool(request.htmx) and bool(request.GET.get("cursor") or request.htmx.target == "feed")
+
+
+def _render_feed(request, template_name, context):
+    if not _feed_fragment(request):
+        return render(request, template_name, context)
+    if request.GET.get("cursor"):
+        return HttpResponse(context["feed"].html)
+    return render(request, "core/_feed.html", context)
+
+
+def search(request):
+    """Full-text search over posts or comments, optionally in one community."""
 
+    query = request.GET.get("q", "").strip()
+    kind = "comments" if request.GET.get("type") == "comments" else "posts"
+    community = None
+    if request.GET.get("r"):
+        community = get_object_or_404(Community, name=request.GET["r"])
 
+    results = []
+    if query:
+        if kind == "comments":
+            results = search_index.search_comments(query, community)
+        else:
+            results = search_index.search_posts(query, community)
+    context = {"query": query, "kind": kind, "community": community, "results": results}
+    return render(request, "core/search.html", context)
+
+
+@login_required
+@require_POST
+def subscribe(request, name):
+    """Subscribe to a community, or unsubscribe when already subscribed."""
+
+    community = get_object_or_404(Community, name=name)
+    subscribed = subscriptions.subscribe(request.user, community)
+    if not subscribed:
+        subscriptions.unsubscribe(request.user, community)
+    if request.htmx:
+        context = {"community": community, "subscribed": subscribed}
+        return render(request, "core/_subscribe.html", context)
+    return redirect("community", name=community.name)
+
+
+@rate_limit("submit_post")
 def submit_post(request, name):
     """Submit a new post to a community."""
 
@@ -43,6 +189,7 @@ def submit_post(request, name):
             post.community = community
             post.author = request.user
             post.save()
+            ranking.schedule_post_ranks([post.pk])
             return redirect("community", name=community.name)
     else:
         form = PostForm()
@@ -51,44 +198,204 @@ def submit_post(request, name):
     return render(request, "core/submit_post.html", context)
 
 
-def post_detail(request, pk):
+async def post_detail(request, pk):
     """Display a single post and its comments."""
 
-    post = get_object_or_404(Post, pk=pk)
-    comments = post.comments.select_related("author").order_by("created_at")
-    form = CommentForm()
-    context = {"post": post, "comments": comments, "form": form}
-    return render(request, "core/post_detail.html", context)
+    user = await request.auser()
+    validators = await httpcache.avalidators(request, user, httpcache.post_scope(pk))
+    if response := httpcache.not_modified(request, validators):
+        return response
+    # Everything the template reads is loaded here: a lazy relation would
+    # be a synchronous query while rendering.
+    post = await aget_object_or_404(Post.objects.select_related("community", "author"), pk=pk)
+    comments, next_cursor = await threads.aload_page(post)
+    context = {
+        "post": post,
+        "comments": comments,
+        "next_cursor": next_cursor,
+        # Anonymous pages have no forms, so no CSRF token or cookie.
+        "can_comment": user.is_authenticated,
+        "form": CommentForm(),
+        "votes": await aload_vote_state(user, _vote_targets(comments, post)),
+    }
+    return httpcache.finish(render(request, "core/post_detail.html", context), validators)
+
+
+async def comment_page(request, pk):
+    """Render the next page of a post's top-level comments (HTMX)."""
+
+    post = await aget_object_or_404(Post.objects.only("pk"), pk=pk)
+    comments, next_cursor = await threads.aload_page(post, request.GET.get("cursor"))
+    user = await request.auser()
+    context = {
+        "post": post,
+        "comments": comments,
+        "next_cursor": next_cursor,
+        "can_comment": user.is_authenticated,
+        "votes": await aload_vote_state(user, _vote_targets(comments)),
+    }
+    return render(request, "core/_comment_page.html", context)
 
 
 @login_required
 @require_POST
+@rate_limit("comment")
 def add_comment(request, pk):
     """Add a comment to a post."""
 
     post = get_object_or_404(Post, pk=pk)
-    form = CommentForm(request.POST)
+    form = CommentForm(request.POST, post=post)
     if form.is_valid():
-        Comment.objects.create(
-            post=post, author=request.user, body=form.cleaned_data["body"]
-        )
+        with transaction.atomic():
+            comment = threads.create_comment(
+                post,
+                request.user,
+                form.cleaned_data["body"],
+                parent=form.cleaned_data["parent"],
+            )
+            ranking.schedule_post_ranks([post.pk])
+        live.publish_comment(comment)
     return redirect("post_detail", pk=post.pk)
 
 
+def comment_replies(request, pk):
+    """Render the next levels of replies below a collapsed comment."""
+
+    comment = get_object_or_404(Comment, pk=pk)
+    comment.children = threads.load_thread(comment.post_id, root=comment)
+    comment.more_replies = 0
+    votes = load_vote_state(request.user, _vote_targets(comment.children))
+    context = {
+        "comment": comment,
+        "votes": votes,
+        "can_comment": request.user.is_authenticated,
+    }
+    return render(request, "core/_comment_replies.html", context)
+
+
+def _vote_targets(comments, post=None):
+    # The viewer's votes on the post and every loaded comment, in one query.
+    targets = {"comment": [comment.pk for comment in threads.walk(comments)]}
+    if post is not None:
+        targets["post"] = [post.pk]
+    return targets
+
+
+@login_required
 @require_POST
-def vote_post(request, pk):
+@rate_limit("vote")
+async def vote_post(request, pk):
     """Handle voting on a post."""
 
+    return await _vote(request, "post", pk)
+
+
+@login_required
+@require_POST
+@rate_limit("vote")
+async def vote_comment(request, pk):
+    """Handle voting on a comment."""
+
+    return await _vote(request, "comment", pk)
+
+
+async def _vote(request, target_type, pk):
     try:
         value = int(request.POST.get("v"))
     except (TypeError, ValueError):
         return HttpResponseBadRequest("Invalid vote")
-    if value not in (-1, 1):
+    if value not in VOTE_VALUES:
         return HttpResponseBadRequest("Invalid vote")
 
-    post = get_object_or_404(Post, pk=pk)
-    post.score += value
-    post.save(update_fields=["score"])
-    return HttpResponse(
-        f"<span id='post-score-{post.pk}'>{post.score}</span>"
+    model = TARGET_MODELS[target_type]
+    user = await request.auser()
+    buffer = get_vote_buffer()
+    try:
+        if buffer is not None:
+            score = await sync_to_async(buffer.add)(user.pk, target_type, pk, value)
+        else:
+            score = await sync_to_async(cast_vote)(user, target_type, pk, value)
+    except model.DoesNotExist:
+        raise Http404(f"No {model.__name__} matches the given query.")
+    if target_type == "post":
+        live.publish_score(pk, score)
+    return HttpResponse(f"<span id='{target_type}-score-{pk}'>{score}</span>")
+
+
+@login_required
+@require_POST
+@rate_limit("vote_batch")
+def vote_batch(request):
+    """Apply a batch of queued votes in one transaction.
+
+    Expects a JSON body ``{"votes": [[target_type, target_id, value], ...]}``
+    and answers with the new score of every target that still exists.
+    """
+
+    try:
+        votes = json.loads(request.body)["votes"]
+        if not isinstance(votes, list):
+            raise TypeError("votes must be a list")
+        votes = [_batch_vote(request.user.pk, *vote) for vote in votes]
+    except (ValueError, TypeError, KeyError):
+        return HttpResponseBadRequest("Invalid vote batch")
+    if len(votes) > MAX_VOTE_BATCH:
+        return HttpResponseBadRequest(f"At most {MAX_VOTE_BATCH} votes per batch")
+
+    try:
+        scores = apply_votes(votes)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid vote batch")
+    for (target_type, target_id), score in scores.items():
+        if target_type == "post":
+            live.publish_score(target_id, score)
+    return JsonResponse(
+        {
+            "scores": [
+                [target_type, target_id, score]
+                for (target_type, target_id), score in scores.items()
+            ]
+        }
     )
+
+
+def _batch_vote(user_id, target_type, target_id, value):
+    """Return one ``[target_type, target_id, value]`` entry as an ``apply_votes`` row.
+
+    Raises ``ValueError`` unless the types are exact: a known target type,
+    an id that fits a 64-bit column and a vote value, neither a bool nor
+    a float, which ``int()`` would quietly turn into a valid vote.
+    """
+
+    if not isinstance(target_type, str) or target_type not in TARGET_MODELS:
+        raise ValueError(f"Unknown target type {target_type!r}")
+    if not _is_int(target_id) or not 0 < target_id < 2**63:
+        raise ValueError(f"Invalid target id {target_id!r}")
+    if not _is_int(value) or value not in VOTE_VALUES:
+        raise ValueError(f"Invalid vote {value!r}")
+    return user_id, target_type, target_id, value
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+async def post_live(request, pk):
+    """Stream a post's score changes and new comments as server-sent events."""
+
+    if not isinstance(request, ASGIRequest):
+        # A sync server would hold a worker thread for the whole stream.
+        return HttpResponse("Live updates are only served over ASGI.", status=501)
+    post = await aget_object_or_404(Post.objects.only("score"), pk=pk)
+    response = live.stream(request, post)
+    if response is None:
+        response = HttpResponse("Too many live connections.", status=503)
+        response["Retry-After"] = str(live.RETRY_MS // 1000)
+    return response
+
+
+@staff_member_required
+def request_stats(request):
+    """Rolling query count and latency percentiles per view, as JSON."""
+
+    return JsonResponse({"views": instrumentation.view_stats()})
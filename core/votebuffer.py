@@ -0,0 +1,206 @@
+"""Write-behind vote buffer.
+
+When ``VOTE_BUFFER["ENABLED"]`` is set, ``vote_post`` records votes here
+instead of opening a write transaction per click. A background thread
+flushes the accumulated votes every ``FLUSH_INTERVAL_MS`` (or as soon as
+``MAX_PENDING`` distinct votes are waiting) through
+:func:`core.votes.apply_votes`, so a hot post gets one ``UPDATE`` per
+flush instead of one per vote. The buffer is per process; pending votes
+are flushed at interpreter exit.
+"""
+
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .models import Vote
+from .votes import TARGET_MODELS, VOTE_VALUES, apply_votes
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {"ENABLED": False, "FLUSH_INTERVAL_MS": 250, "MAX_PENDING": 1000}
+
+
+class VoteBuffer:
+    """Accumulate votes in memory and flush them to the database in batches."""
+
+    def __init__(self, flush_interval_ms=250, max_pending=1000):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        # (user_id, target_type, target_id) -> latest value, for votes that
+        # have not been handed to a flush yet, and for the flush in progress.
+        self._pending = {}
+        self._inflight = {}
+        # Value each buffered key had in the database when first seen, and
+        # the resulting score change per target, again split between pending
+        # votes and the flush in progress. ``_flushes`` counts committed
+        # flushes so that ``add`` can tell whether its score read already
+        # includes the in-flight deltas.
+        self._baseline = {}
+        self._deltas = defaultdict(int)
+        self._inflight_deltas = {}
+        self._flushes = 0
+
+    def add(self, user_id, target_type, target_id, value):
+        """Buffer a vote and return the target's score including pending votes.
+
+        Raises the target model's ``DoesNotExist`` when the target is missing.
+        """
+
+        if value not in VOTE_VALUES:
+            raise ValueError(f"Invalid vote value: {value!r}")
+        model = TARGET_MODELS[target_type]
+        target = (target_type, target_id)
+        key = (user_id, target_type, target_id)
+        with self._lock:
+            known = key in self._pending or key in self._inflight
+        baseline = None if known else self._stored_value(key)
+
+        while True:
+            with self._lock:
+                flushes = self._flushes
+            score = model.objects.filter(pk=target_id).values_list("score", flat=True).first()
+            if score is None:
+                raise model.DoesNotExist(f"{model.__name__} {target_id} does not exist")
+            with self._lock:
+                if self._flushes != flushes:
+                    # A flush committed around the read, which may or may not
+                    # have seen it; read again now that it is over.
+                    continue
+                if key in self._pending:
+                    previous = self._pending[key]
+                elif key in self._inflight:
+                    previous = self._inflight[key]
+                else:
+                    previous = self._baseline.setdefault(key, baseline or 0)
+                self._pending[key] = value
+                self._deltas[target] += value - previous
+                buffered = score + self._deltas[target] + self._inflight_deltas.get(target, 0)
+                full = len(self._pending) >= self.max_pending
+                break
+
+        self._ensure_started()
+        if full:
+            self._wakeup.set()
+        return buffered
+
+    def flush(self):
+        """Write every pending vote to the database; return the number written."""
+
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+                self._inflight_deltas, self._deltas = self._deltas, defaultdict(int)
+            locked = False
+            try:
+                with transaction.atomic():
+                    apply_votes((*key, value) for key, value in batch.items())
+                    # Held across the commit, so add() never reads the new
+                    # scores while still counting the in-flight deltas.
+                    self._lock.acquire()
+                    locked = True
+            except Exception:
+                logger.exception("Vote buffer flush failed; retrying next interval")
+                if not locked:
+                    self._lock.acquire()
+                try:
+                    # Newer votes for the same key supersede the failed ones.
+                    self._pending = {**batch, **self._pending}
+                    for target, delta in self._inflight_deltas.items():
+                        self._deltas[target] += delta
+                    self._inflight = {}
+                    self._inflight_deltas = {}
+                finally:
+                    self._lock.release()
+                return 0
+
+            try:
+                self._flushes += 1
+                self._inflight = {}
+                self._inflight_deltas = {}
+                for key in batch:
+                    self._baseline.pop(key, None)
+                    if key in self._pending:
+                        # Re-voted during the flush: the stored value is now
+                        # the baseline for the newer pending vote.
+                        self._baseline[key] = batch[key]
+            finally:
+                self._lock.release()
+            return len(batch)
+
+    def stop(self):
+        """Stop the flusher thread and flush whatever is still pending."""
+
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _stored_value(self, key):
+        user_id, target_type, target_id = key
+        value = (
+            Vote.objects.filter(user_id=user_id, target_type=target_type, target_id=target_id)
+            .values_list("value", flat=True)
+            .first()
+        )
+        return value or 0
+
+    def _ensure_started(self):
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="vote-buffer-flusher", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                if self._stopped.is_set():
+                    # stop() does the final flush on the caller's thread.
+                    break
+                self.flush()
+        finally:
+            connections.close_all()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def buffer_settings():
+    return {**DEFAULTS, **getattr(settings, "VOTE_BUFFER", {})}
+
+
+def get_vote_buffer():
+    """Return the process-wide buffer, or ``None`` when buffering is disabled."""
+
+    global _buffer
+    config = buffer_settings()
+    if not config["ENABLED"]:
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = VoteBuffer(config["FLUSH_INTERVAL_MS"], config["MAX_PENDING"])
+                atexit.register(_buffer.stop)
+    return _buffer
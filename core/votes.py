@@ -0,0 +1,236 @@
+"""Vote engine: per-user vote dedupe and atomic score updates."""
+
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+
+from . import communitystats, httpcache, ranking
+from .models import Comment, Post, Vote
+
+
+VOTE_VALUES = (-1, 1)
+
+TARGET_MODELS = {"post": Post, "comment": Comment}
+TARGET_TYPES = {model: target_type for target_type, model in TARGET_MODELS.items()}
+
+
+def cast_vote(user, target_type, target_id, value):
+    """Record ``user``'s vote on a target and return the target's new score.
+
+    The ``Vote`` row is upserted and only the difference between the new
+    and the previous value is applied to the target's score, in a single
+    ``UPDATE ... SET score = score + delta`` so concurrent voters never
+    overwrite each other. Raises the target model's ``DoesNotExist`` when
+    the target is missing, in which case nothing is written.
+    """
+
+    if value not in VOTE_VALUES:
+        raise ValueError(f"Invalid vote value: {value!r}")
+    model = TARGET_MODELS[target_type]
+
+    with transaction.atomic():
+        previous = _upsert_vote(user, target_type, target_id, value)
+        score = apply_score_delta(model, target_id, value - previous)
+        if value != previous:
+            if target_type == "post":
+                ranking.schedule_post_ranks([target_id])
+            targets = communitystats.votes_cast([(user.pk, target_type, target_id)])
+            httpcache.votes_changed(targets)
+        return score
+
+
+def apply_votes(votes):
+    """Apply many votes in one transaction and return the new scores.
+
+    ``votes`` is an iterable of ``(user_id, target_type, target_id, value)``
+    tuples; when the same user votes on the same target more than once the
+    last value wins. Existing votes are read in one query per target type,
+    the ``Vote`` rows are bulk-upserted and each target's score gets one
+    ``UPDATE`` with the summed delta. Votes by users or on targets that no
+    longer exist are dropped. Returns ``{(target_type, target_id): score}`` for every
+    target that was voted on.
+    """
+
+    latest = {}
+    for user_id, target_type, target_id, value in votes:
+        if value not in VOTE_VALUES:
+            raise ValueError(f"Invalid vote value: {value!r}")
+        if target_type not in TARGET_MODELS:
+            raise ValueError(f"Invalid vote target: {target_type!r}")
+        latest[(user_id, target_type, target_id)] = value
+    if not latest:
+        return {}
+
+    by_type = defaultdict(set)
+    for _, target_type, target_id in latest:
+        by_type[target_type].add(target_id)
+
+    with transaction.atomic():
+        user_ids = set(
+            get_user_model()
+            .objects.filter(pk__in={key[0] for key in latest})
+            .values_list("pk", flat=True)
+        )
+        for target_type, target_ids in by_type.items():
+            model = TARGET_MODELS[target_type]
+            target_ids &= set(
+                model.objects.filter(pk__in=target_ids).values_list("pk", flat=True)
+            )
+
+        existing = {}
+        for target_type, target_ids in by_type.items():
+            rows = Vote.objects.filter(
+                target_type=target_type, target_id__in=target_ids, user_id__in=user_ids
+            ).values_list("user_id", "target_id", "value")
+            for user_id, target_id, value in rows:
+                existing[(user_id, target_type, target_id)] = value
+
+        deltas = defaultdict(int)
+        changed = []
+        for key, value in latest.items():
+            user_id, target_type, target_id = key
+            if user_id not in user_ids or target_id not in by_type[target_type]:
+                continue
+            deltas[(target_type, target_id)] += value - existing.get(key, 0)
+            if existing.get(key) != value:
+                changed.append(
+                    Vote(
+                        user_id=user_id,
+                        target_type=target_type,
+                        target_id=target_id,
+                        value=value,
+                    )
+                )
+
+        Vote.objects.bulk_create(
+            changed,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=["user", "target_type", "target_id"],
+            update_fields=["value"],
+        )
+        targets = communitystats.votes_cast(
+            [(vote.user_id, vote.target_type, vote.target_id) for vote in changed]
+        )
+        httpcache.votes_changed(targets)
+        scores = {
+            (target_type, target_id): apply_score_delta(
+                TARGET_MODELS[target_type], target_id, delta
+            )
+            for (target_type, target_id), delta in deltas.items()
+        }
+        ranking.schedule_post_ranks(
+            [
+                target_id
+                for (target_type, target_id), delta in deltas.items()
+                if target_type == "post" and delta
+            ]
+        )
+        return scores
+
+
+def load_vote_state(user, targets):
+    """Return ``user``'s votes on the given targets.
+
+    ``targets`` maps a target type to the ids shown on the page. All of them
+    are looked up in one query, answered from the ``(user, target_type,
+    target_id, value)`` covering index. Returns ``{(target_type, target_id):
+    value}`` with an entry only for targets the user voted on; anonymous
+    users get an empty map without a query.
+    """
+
+    rows = _vote_state_rows(user, targets)
+    if rows is None:
+        return {}
+    return {(target_type, target_id): value for target_type, target_id, value in rows}
+
+
+async def aload_vote_state(user, targets):
+    """Async version of :func:`load_vote_state`."""
+
+    rows = _vote_state_rows(user, targets)
+    if rows is None:
+        return {}
+    return {(target_type, target_id): value async for target_type, target_id, value in rows}
+
+
+def _vote_state_rows(user, targets):
+    if not user.is_authenticated:
+        return None
+    # The user goes into every branch of the OR so that SQLite can seek
+    # the full index key for each target type.
+    conditions = [
+        Q(user=user, target_type=target_type, target_id__in=ids)
+        for target_type, ids in targets.items()
+        if ids
+    ]
+    if not conditions:
+        return None
+    return Vote.objects.filter(reduce(or_, conditions)).values_list(
+        "target_type", "target_id", "value"
+    )
+
+
+def _upsert_vote(user, target_type, target_id, value):
+    """Insert or update the user's vote and return the previous value (0 if new)."""
+
+    try:
+        # The INSERT comes first so that SQLite takes its write lock before
+        # anything is read; a fresh vote costs exactly one statement.
+        with transaction.atomic():
+            Vote.objects.create(
+                user=user, target_type=target_type, target_id=target_id, value=value
+            )
+        return 0
+    except IntegrityError:
+        pass
+
+    vote = (
+        Vote.objects.select_for_update()
+        .only("value")
+        .get(user=user, target_type=target_type, target_id=target_id)
+    )
+    if vote.value != value:
+        Vote.objects.filter(pk=vote.pk).update(value=value)
+    return vote.value
+
+
+def _can_update_returning():
+    # MariaDB only supports RETURNING on INSERT/DELETE, so restrict this to
+    # the backends that also accept it on UPDATE.
+    return (
+        connection.vendor in ("sqlite", "postgresql")
+        and connection.features.can_return_columns_from_insert
+    )
+
+
+def apply_score_delta(model, target_id, delta):
+    """Atomically add ``delta`` to a target's score and return the new score."""
+
+    if delta == 0:
+        score = model.objects.filter(pk=target_id).values_list("score", flat=True).first()
+    elif _can_update_returning():
+        qn = connection.ops.quote_name
+        table, column, pk = qn(model._meta.db_table), qn("score"), qn(model._meta.pk.column)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET {column} = {column} + %s WHERE {pk} = %s RETURNING {column}",
+                [delta, target_id],
+            )
+            row = cursor.fetchone()
+        score = row[0] if row else None
+    else:
+        updated = model.objects.filter(pk=target_id).update(score=F("score") + delta)
+        score = (
+            model.objects.filter(pk=target_id).values_list("score", flat=True).first()
+            if updated
+            else None
+        )
+
+    if score is None:
+        raise model.DoesNotExist(f"{model.__name__} {target_id} does not exist")
+    return score